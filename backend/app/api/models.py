@@ -1,23 +1,39 @@
-from typing import Optional
+from typing import Optional, List
 
 from pydantic import BaseModel
+from qdrant_client.http.models import ScoredPoint
 
 from app.db.models import Media
+from app.recommender.models import MediaRecord
 
 
 class MediaResponse(BaseModel):
     title: str
     type: str
     url: Optional[str]
+    image_url: Optional[str] = None
     status: Optional[str]
     score: Optional[float]
 
 
-def convert_media(media: Media) -> MediaResponse:
+class CandidateResponse(BaseModel):
+    media_id: int
+    title: Optional[str]
+
+
+def convert_media(media: Media | MediaRecord) -> MediaResponse:
     return MediaResponse(
         title=media.title,
         type=media.type,
         url=media.external_url,
+        image_url=media.image_url,
         status=media.status,
         score=float(round(media.score, 2)) if media.score else None,
     )
+
+
+def convert_candidates(points: List[ScoredPoint]) -> List[CandidateResponse]:
+    return [
+        CandidateResponse(media_id=point.id, title=(point.payload or {}).get("title"))
+        for point in points
+    ]
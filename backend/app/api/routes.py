@@ -1,10 +1,25 @@
-from fastapi import FastAPI
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from pydantic import BaseModel, Field
 
-from app.api.models import convert_media
-from app.recommender.pipeline import get_recommendations
+from app.api.models import convert_media, convert_candidates
+from app.monitoring.structured_logging import configure_logging
+from app.recommender.cache import recommendation_cache
+from app.recommender.pagination import create_recommendation_cursor, get_next_page_async
+from app.recommender.pipeline import get_recommendations_async, recommendation_flights, stream_recommendations, \
+    get_recommendations_batch
+from app.recommender.prewarmed_queries import prewarmed_queries
+from app.recommender.query_processor import query_processing_flights
 from app.services.openai_service import get_openai_response
+from app.services.query_log import get_query_log
 from common.config.recommender.recommender_config import get_recommender_config
 
 
@@ -12,7 +27,55 @@ class QueryRequest(BaseModel):  # Helps validate the JSON structure
     query: str
 
 
-app = FastAPI()
+class CursorRequest(BaseModel):
+    cursor: str
+
+
+MAX_BATCH_QUERIES = 100
+MAX_BATCH_CONCURRENCY = 32
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES)
+    max_concurrency: int = Field(8, ge=1, le=MAX_BATCH_CONCURRENCY)
+
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The most frequent queries are served from memory, and reloaded periodically after each prewarm job
+    cfg = get_recommender_config()
+    try:
+        await asyncio.to_thread(prewarmed_queries.load, cfg)
+    except Exception:
+        logger.warning("Could not load the prewarmed queries", exc_info=True, extra={"stage": "prewarm"})
+    refresh = asyncio.create_task(prewarmed_queries.refresh_periodically(cfg, cfg.prewarm_refresh_seconds))
+    # Queries are counted in memory on the request path, and written periodically
+    try:
+        query_log = await asyncio.to_thread(get_query_log)
+    except Exception:
+        logger.warning("Could not open the query log", exc_info=True)
+        query_log = None
+    flush = asyncio.create_task(query_log.flush_periodically()) if query_log is not None else None
+    yield
+    refresh.cancel()
+    if query_log is not None:
+        flush.cancel()
+        await asyncio.to_thread(query_log.flush)
+
+
+def log_query(user_query: str):
+    """ Count the query in the query log, which the prewarm job mines for the most frequent queries. """
+    try:
+        get_query_log().record(user_query)
+    except Exception:
+        logger.warning("Could not log the query", exc_info=True)
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["http://localhost:3000"]
 app.add_middleware(
@@ -31,8 +94,85 @@ async def generate_response(request: QueryRequest):
 
 @app.post("/recommend")
 async def recommend(request: QueryRequest):
-    recommendations = get_recommendations(request.query, get_recommender_config())
+    cfg = get_recommender_config()
+    log_query(request.query)
+    recommendations = await get_recommendations_async(request.query, cfg)
     recommendations_response = [convert_media(rec) for rec in recommendations]
     return {
-        "message": " ; ".join(str(rec) for rec in recommendations_response)
+        "message": " ; ".join(str(rec) for rec in recommendations_response),
+        "cursor": create_recommendation_cursor(request.query, cfg),
+    }
+
+
+@app.post("/recommend/more")
+async def recommend_more(request: CursorRequest):
+    """ Return the next page of recommendations of a previous query, from the cursor returned with the last page. """
+    page = await get_next_page_async(request.cursor, get_recommender_config())
+    if page is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired cursor")
+    recommendations_response = [convert_media(rec) for rec in page.media]
+    return {
+        "message": " ; ".join(str(rec) for rec in recommendations_response),
+        "cursor": page.cursor,
+    }
+
+
+def format_recommendation_event(event: str, data) -> str:
+    """ Serialize a pipeline event as one line of NDJSON. """
+    if event == "constraints":
+        data = data.model_dump(mode="json")
+    elif event == "candidates":
+        data = [candidate.model_dump(mode="json") for candidate in convert_candidates(data)]
+    elif event == "media":
+        data = [convert_media(media).model_dump(mode="json") for media in data]
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+@app.post("/recommend/stream")
+async def recommend_stream(request: QueryRequest):
+    """ Stream each stage of the recommendation pipeline as newline-delimited JSON events. """
+    log_query(request.query)
+    async def events():
+        try:
+            async for event, data in stream_recommendations(request.query, get_recommender_config()):
+                yield format_recommendation_event(event, data)
+        except Exception as e:
+            yield format_recommendation_event("error", str(e))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/recommend/batch")
+async def recommend_batch(request: BatchQueryRequest):
+    results = await get_recommendations_batch(
+        request.queries,
+        get_recommender_config(),
+        max_concurrency=request.max_concurrency,
+    )
+    return [
+        {
+            "query": result.query,
+            "recommendations": [convert_media(media) for media in result.media],
+            "error": result.error,
+        }
+        for result in results
+    ]
+
+
+@app.get("/metrics")
+async def metrics():
+    """ Expose the application metrics in the Prometheus text format. """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/recommend/cache")
+async def recommendation_cache_stats():
+    return recommendation_cache.stats()
+
+
+@app.get("/recommend/coalescing")
+async def recommendation_coalescing_stats():
+    return {
+        "recommendations": recommendation_flights.stats(),
+        "query_processing": query_processing_flights.stats(),
     }
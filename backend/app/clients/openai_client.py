@@ -3,9 +3,10 @@ from typing import List
 
 import math
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from tqdm import tqdm
 
+from app.monitoring.metrics import track_dependency, record_openai_usage
 from common.env import get_env_variable
 
 MAXIMUM_EMBEDDING_REQUESTS_PER_MINUTE = 2500  # actual is 3000, lowered for safety https://platform.openai.com/settings/organization/limits
@@ -16,29 +17,45 @@ class OpenAIClient:
         self.client = OpenAI(api_key=api_key)
 
     def get_response(self, prompt: str, instructions: str):
-        response = self.client.responses.create(
-            model="gpt-4.1-nano",
-            instructions=instructions,
-            store=True,
-            input=[{"role": "user", "content": prompt}]
-        )
+        with track_dependency("openai", "responses"):
+            response = self.client.responses.create(
+                model="gpt-4.1-nano",
+                instructions=instructions,
+                store=True,
+                input=[{"role": "user", "content": prompt}]
+            )
+        record_openai_usage(response.model, response.usage)
         return response
 
     def get_response_from_prompt_id(self, user_input: str, prompt_id: str):
-        response = self.client.responses.create(
-            prompt={"id": prompt_id},
-            input=user_input
-        )
+        with track_dependency("openai", "responses"):
+            response = self.client.responses.create(
+                prompt={"id": prompt_id},
+                input=user_input
+            )
+        record_openai_usage(response.model, response.usage)
         return response.output_text
 
     def get_embedding(self, text: str, model, dimensions) -> list[float]:  # single embedding
-        response = self.client.embeddings.create(
-            model=model,
-            input=text,
-            dimensions=dimensions
-        )
+        with track_dependency("openai", "embeddings"):
+            response = self.client.embeddings.create(
+                model=model,
+                input=text,
+                dimensions=dimensions
+            )
+        record_openai_usage(model, response.usage)
         return response.data[0].embedding
 
+    def get_embeddings(self, texts: List[str], model, dimensions) -> List[List[float]]:  # several embeddings, one request
+        with track_dependency("openai", "embeddings"):
+            response = self.client.embeddings.create(
+                model=model,
+                input=texts,
+                dimensions=dimensions
+            )
+        record_openai_usage(model, response.usage)
+        return [item.embedding for item in response.data]
+
     def get_embeddings_batched(
             self,
             texts: List[str],
@@ -59,11 +76,13 @@ class OpenAIClient:
 
             for attempt in range(max_retries):
                 try:
-                    response = self.client.embeddings.create(
-                        model=model,
-                        input=batch_texts,
-                        dimensions=dimensions,
-                    )
+                    with track_dependency("openai", "embeddings"):
+                        response = self.client.embeddings.create(
+                            model=model,
+                            input=batch_texts,
+                            dimensions=dimensions,
+                        )
+                    record_openai_usage(model, response.usage)
                     batch_embeddings = [item.embedding for item in response.data]
                     all_embeddings.extend(batch_embeddings)
                     break  # Success, break retry loop
@@ -79,6 +98,33 @@ class OpenAIClient:
         return all_embeddings
 
 
-# Singleton instance
+class AsyncOpenAIClient:
+    """ Non-blocking counterpart of OpenAIClient, used on the request path of the API. """
+
+    def __init__(self, api_key: str):
+        self.client = AsyncOpenAI(api_key=api_key)
+
+    async def get_response_from_prompt_id(self, user_input: str, prompt_id: str):
+        with track_dependency("openai", "responses"):
+            response = await self.client.responses.create(
+                prompt={"id": prompt_id},
+                input=user_input
+            )
+        record_openai_usage(response.model, response.usage)
+        return response.output_text
+
+    async def get_embedding(self, text: str, model, dimensions) -> list[float]:  # single embedding
+        with track_dependency("openai", "embeddings"):
+            response = await self.client.embeddings.create(
+                model=model,
+                input=text,
+                dimensions=dimensions
+            )
+        record_openai_usage(model, response.usage)
+        return response.data[0].embedding
+
+
+# Singleton instances
 openai_api_key = get_env_variable("OPENAI_API_KEY")
 openai_client = OpenAIClient(openai_api_key)
+async_openai_client = AsyncOpenAIClient(openai_api_key)
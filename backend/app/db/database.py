@@ -1,17 +1,18 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
 from common.env import get_env_variable
 
 
-def get_database_url():
+def get_database_url(driver: str = "postgresql"):
     db_user = get_env_variable("POSTGRES_USER")
     db_password = get_env_variable("POSTGRES_PASSWORD")
     db_host = "db"  # name of the docker service that runs the database
     db_port = 5432
     db_name = get_env_variable("POSTGRES_DB")
 
-    database_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+    database_url = f"{driver}://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 
     return database_url
 
@@ -20,3 +21,9 @@ DATABASE_URL = get_database_url()
 
 engine = create_engine(DATABASE_URL, echo=False)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine used on the request path of the API, so that database calls do not block the event loop
+ASYNC_DATABASE_URL = get_database_url(driver="postgresql+asyncpg")
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
@@ -1,6 +1,7 @@
 from datetime import datetime, UTC
 
 from app.db.models import Media, ContentDescriptor, MediaType, Status
+from app.services.catalog_service import mark_catalog_updated, mark_media_updated, MEDIA_CATALOG
 from sqlalchemy.orm import Session
 from tqdm import tqdm
 
@@ -91,6 +92,7 @@ def update_existing_media(existing_media, new_entry, media_type, status, descrip
 def load_all_media(session: Session, entries: list[dict]):
     media_cache = preload_media(session)
     content_descriptors_cache = preload_content_descriptors(session)
+    updated_media = []
     for entry in tqdm(entries, desc="Loading media", position=1, leave=False):
         title = entry.get("title")
         type_str = entry.get("type")
@@ -107,6 +109,7 @@ def load_all_media(session: Session, entries: list[dict]):
 
         if media:
             update_existing_media(media, entry, media_type, status, descriptors)
+            updated_media.append(media)
         else:
             media = create_new_media(entry, media_type, status, descriptors)
             session.add(media)
@@ -114,3 +117,6 @@ def load_all_media(session: Session, entries: list[dict]):
 
     session.flush()
     session.commit()
+    # New media have no point yet, only the payloads of the updated ones become stale
+    mark_media_updated(media.media_id for media in updated_media)
+    mark_catalog_updated(MEDIA_CATALOG)
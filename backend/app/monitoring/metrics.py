@@ -0,0 +1,110 @@
+import asyncio
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+
+# Raised when a task is cancelled (e.g. a speculative search) or a generator is closed early, not failures
+NOT_ERRORS = (asyncio.CancelledError, GeneratorExit)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_LATENCY = Histogram(
+    "osusume_recommender_stage_duration_seconds",
+    "Duration of each stage of the recommender pipeline.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "osusume_recommender_stage_errors_total",
+    "Number of recommender pipeline stages that raised an exception.",
+    ["stage"],
+)
+DEPENDENCY_LATENCY = Histogram(
+    "osusume_dependency_request_duration_seconds",
+    "Duration of calls to external dependencies (OpenAI, Qdrant, Postgres).",
+    ["dependency", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+DEPENDENCY_ERRORS = Counter(
+    "osusume_dependency_request_errors_total",
+    "Number of calls to external dependencies that raised an exception.",
+    ["dependency", "operation"],
+)
+CACHE_REQUESTS = Counter(
+    "osusume_cache_requests_total",
+    "Number of cache lookups, by cache and result (hit or miss).",
+    ["cache", "result"],
+)
+COALESCED_CALLS = Counter(
+    "osusume_coalesced_calls_total",
+    "Number of calls that started a computation (leader) or waited for an identical in-flight one (coalesced).",
+    ["flight", "role"],
+)
+QUERY_PROCESSING_PATHS = Counter(
+    "osusume_query_processing_total",
+    "Number of processed queries, by path (prewarmed table, local rule-based extractor or LLM).",
+    ["path"],
+)
+SPECULATIVE_RETRIEVALS = Counter(
+    "osusume_speculative_retrievals_total",
+    "Outcome of speculative retrievals: hit (enough candidates matched the constraints), miss (a filtered search was "
+    "needed), late (the constraints arrived first) or failed.",
+    ["outcome"],
+)
+RETRIEVAL_STRATEGY_LATENCY = Histogram(
+    "osusume_retrieval_strategy_duration_seconds",
+    "Duration of filtered vector searches, by strategy chosen from the number of media matching the filter.",
+    ["strategy"],
+    buckets=LATENCY_BUCKETS,
+)
+OPENAI_TOKENS = Counter(
+    "osusume_openai_tokens_total",
+    "Number of tokens consumed by OpenAI requests.",
+    ["model", "kind"],
+)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """ Measure the duration of a pipeline stage, and count it as an error if it raises. """
+    start = time.perf_counter()
+    try:
+        yield
+    except NOT_ERRORS:
+        raise
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def track_dependency(dependency: str, operation: str):
+    """ Measure the duration of a call to an external dependency, and count it as an error if it raises. """
+    start = time.perf_counter()
+    try:
+        yield
+    except NOT_ERRORS:
+        raise
+    except BaseException:
+        DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+        raise
+    finally:
+        DEPENDENCY_LATENCY.labels(dependency, operation).observe(time.perf_counter() - start)
+
+
+def record_cache_lookup(cache: str, hit: bool, count: int = 1):
+    if count:
+        CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc(count)
+
+
+def record_openai_usage(model: str, usage):
+    """ Count the tokens reported in the usage field of an OpenAI response. """
+    if usage is None:
+        return
+    for kind in ("input_tokens", "output_tokens", "prompt_tokens"):
+        n_tokens = getattr(usage, kind, None)
+        if isinstance(n_tokens, int):
+            OPENAI_TOKENS.labels(model or "unknown", kind.removesuffix("_tokens")).inc(n_tokens)
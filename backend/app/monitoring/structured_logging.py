@@ -0,0 +1,36 @@
+import json
+import logging
+import os
+
+# Attributes of every LogRecord, anything else was passed through `extra` and is logged as a structured field
+_RESERVED_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """ Format log records as one JSON object per line, including the fields passed with `extra`. """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RESERVED_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str | None = None):
+    """
+    Send the application logs to stderr as JSON lines. The level defaults to the LOG_LEVEL environment variable,
+    or INFO: per-stage pipeline logs are emitted at DEBUG level and are skipped entirely by default.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+
+    logger = logging.getLogger("app")
+    logger.handlers = [handler]
+    logger.setLevel(level or os.getenv("LOG_LEVEL", "INFO"))
+    logger.propagate = False
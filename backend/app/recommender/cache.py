@@ -0,0 +1,120 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from app.monitoring.metrics import record_cache_lookup
+from app.services.catalog_service import get_catalog_version
+from app.services.openai_service import sanitize_llm_query
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+RECOMMENDATION_CACHE_MAX_SIZE = 1024
+RECOMMENDATION_CACHE_TTL_SECONDS = 3600
+
+
+class TTLCache:
+    """
+    Thread-safe bounded LRU cache whose entries expire after a time-to-live.
+
+    If a version provider is given, the whole cache is cleared whenever the version it returns changes.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_size: int,
+            ttl_seconds: Optional[float] = None,
+            version_provider: Optional[Callable[[], Hashable]] = None,
+    ):
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.version_provider = version_provider
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._version = version_provider() if version_provider else None
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        if self.version_provider is None:
+            return
+        version = self.version_provider()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                record_cache_lookup(self.name, hit=False)
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                record_cache_lookup(self.name, hit=False)
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache_lookup(self.name, hit=True)
+            return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        """ Whether the key has a live entry, without counting a lookup in the statistics. """
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else float("inf")
+        with self._lock:
+            self._check_version()
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def hash_config(cfg: RecommenderConfiguration) -> str:
+    """ Return a short stable hash of a recommender configuration. """
+    return hashlib.sha256(cfg.model_dump_json().encode("utf-8")).hexdigest()[:16]
+
+
+def make_recommendation_cache_key(user_query: str, cfg: RecommenderConfiguration) -> str:
+    """ Build the cache key of a recommendation from the normalized query and the configuration it was computed with. """
+    return f"{hash_config(cfg)}:{sanitize_llm_query(user_query)}"
+
+
+# Singleton instance, invalidated whenever ingestion or vector database initialization changes the catalog
+recommendation_cache = TTLCache(
+    name="recommendations",
+    max_size=RECOMMENDATION_CACHE_MAX_SIZE,
+    ttl_seconds=RECOMMENDATION_CACHE_TTL_SECONDS,
+    version_provider=get_catalog_version,
+)
@@ -1,18 +1,83 @@
+import logging
+from typing import List
+
+from app.monitoring.metrics import track_stage
 from app.recommender.models import ProcessedRecommenderQuery, EmbeddedRecommenderQuery
-from app.services.openai_service import get_embedding
+from app.recommender.prewarmed_queries import prewarmed_queries
+from app.services.embedding_service import get_embedding, get_embedding_async, get_embeddings
+from app.services.openai_service import sanitize_llm_query
 
+logger = logging.getLogger(__name__)
 
-def embed_processed_query(model:str, dimensions:int, query: ProcessedRecommenderQuery) -> EmbeddedRecommenderQuery:
-    """ Embed a processed query. """
-    print(f"Embedding query...")
+
+def build_embedding_text(query: ProcessedRecommenderQuery) -> str:
+    """ Build the text to embed from a processed query. """
     sorted_keywords = sorted(query.keywords)
-    combined_text = query.embedding_text + ", " + ", ".join(sorted_keywords)
-    embedding = get_embedding(
-        text=combined_text,
-        model=model,
-        dimensions=dimensions,
+    return query.embedding_text + ", " + ", ".join(sorted_keywords)
+
+
+def embed_processed_query(model:str, dimensions:int, query: ProcessedRecommenderQuery) -> EmbeddedRecommenderQuery:
+    """ Embed a processed query, unless its vector was prewarmed. """
+    logger.debug("Embedding query...", extra={"stage": "embed"})
+    with track_stage("embed"):
+        text = build_embedding_text(query)
+        embedding = prewarmed_queries.get_vector(text, model, dimensions) or get_embedding(
+            text=text,
+            model=model,
+            dimensions=dimensions,
+        )
+
+    return EmbeddedRecommenderQuery(
+        vector=embedding,
     )
 
+
+async def embed_processed_query_async(
+        model: str,
+        dimensions: int,
+        query: ProcessedRecommenderQuery
+) -> EmbeddedRecommenderQuery:
+    """ Non-blocking version of embed_processed_query. """
+    logger.debug("Embedding query...", extra={"stage": "embed"})
+    with track_stage("embed"):
+        text = build_embedding_text(query)
+        embedding = prewarmed_queries.get_vector(text, model, dimensions) or await get_embedding_async(
+            text=text,
+            model=model,
+            dimensions=dimensions,
+        )
+
     return EmbeddedRecommenderQuery(
         vector=embedding,
     )
+
+
+async def embed_raw_query_async(model: str, dimensions: int, user_query: str) -> EmbeddedRecommenderQuery:
+    """ Embed the sanitized user query as is, without waiting for it to be processed. """
+    logger.debug("Embedding raw query...", extra={"stage": "embed_raw_query"})
+    with track_stage("embed_raw_query"):
+        embedding = await get_embedding_async(
+            text=sanitize_llm_query(user_query),
+            model=model,
+            dimensions=dimensions,
+        )
+
+    return EmbeddedRecommenderQuery(
+        vector=embedding,
+    )
+
+
+def embed_processed_queries(
+        model: str,
+        dimensions: int,
+        queries: List[ProcessedRecommenderQuery]
+) -> List[EmbeddedRecommenderQuery]:
+    """ Embed several processed queries, packed into as few requests as possible. """
+    logger.debug("Embedding %d queries...", len(queries), extra={"stage": "embed_batch"})
+    with track_stage("embed_batch"):
+        embeddings = get_embeddings(
+            texts=[build_embedding_text(query) for query in queries],
+            model=model,
+            dimensions=dimensions,
+        )
+    return [EmbeddedRecommenderQuery(vector=embedding) for embedding in embeddings]
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+from qdrant_client.http.models import ScoredPoint
+
+from app.monitoring.metrics import track_stage
+from app.recommender.cache import TTLCache
+from app.services.catalog_service import get_catalog_versions, VECTOR_CATALOG
+from app.services.embedding_service import get_embeddings, get_embedding_async
+from app.vector_db.vector_database import get_nearest_content_descriptors, get_nearest_content_descriptors_async
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+logger = logging.getLogger(__name__)
+
+KEYWORD_CACHE_MAX_SIZE = 10_000
+
+
+def get_vector_catalog_version():
+    return get_catalog_versions().get(VECTOR_CATALOG)
+
+
+# The same keywords come up in many queries, and their tags only change when the content descriptors are re-indexed
+keyword_cache = TTLCache(
+    name="keyword_expansions",
+    max_size=KEYWORD_CACHE_MAX_SIZE,
+    version_provider=get_vector_catalog_version,
+)
+
+
+def normalize_keywords(keywords: List[str]) -> List[str]:
+    return list(dict.fromkeys(keyword.strip().lower() for keyword in keywords if keyword.strip()))
+
+
+def make_keyword_cache_key(keyword: str, cfg: RecommenderConfiguration) -> Tuple:
+    expansion = cfg.keyword_expansion
+    return cfg.embedder, cfg.dimensions, expansion.tags_per_keyword, expansion.min_similarity, keyword
+
+
+def get_cached_tags(
+        keywords: List[str],
+        cfg: RecommenderConfiguration
+) -> Tuple[Dict[str, Tuple[str, ...]], List[str]]:
+    """ Return the tags of the keywords found in the cache, and the keywords that are not cached. """
+    resolved = {}
+    missing_keywords = []
+    for keyword in keywords:
+        tags = keyword_cache.get(make_keyword_cache_key(keyword, cfg))
+        if tags is None:
+            missing_keywords.append(keyword)
+        else:
+            resolved[keyword] = tags
+    return resolved, missing_keywords
+
+
+def cache_tags(
+        keywords: List[str],
+        points: List[List[ScoredPoint]],
+        cfg: RecommenderConfiguration,
+        resolved: Dict[str, Tuple[str, ...]]
+):
+    for keyword, keyword_points in zip(keywords, points):
+        tags = tuple(point.payload["content_descriptor"] for point in keyword_points)
+        keyword_cache.set(make_keyword_cache_key(keyword, cfg), tags)
+        resolved[keyword] = tags
+
+
+def merge_tags(keywords: List[str], resolved: Dict[str, Tuple[str, ...]]) -> List[str]:
+    """ Tags of the keywords, in the order of the keywords then of similarity, without duplicates. """
+    return list(dict.fromkeys(tag for keyword in normalize_keywords(keywords) for tag in resolved.get(keyword, ())))
+
+
+# --- Main functions ---
+
+def resolve_keywords(keywords: List[str], cfg: RecommenderConfiguration) -> Dict[str, Tuple[str, ...]]:
+    """
+    Resolve each keyword to its nearest canonical content descriptors. Keywords that are not cached are embedded in
+    one request, and searched in the content descriptors collection with one batch request.
+    :param keywords: Keywords of one or several processed queries.
+    :param cfg: Recommender configuration.
+    :return: The tags of each normalized keyword.
+    """
+    with track_stage("expand_keywords"):
+        resolved, missing_keywords = get_cached_tags(normalize_keywords(keywords), cfg)
+        if missing_keywords:
+            vectors = get_embeddings(texts=missing_keywords, model=cfg.embedder, dimensions=cfg.dimensions)
+            points = get_nearest_content_descriptors(
+                vectors=vectors,
+                k=cfg.keyword_expansion.tags_per_keyword,
+                score_threshold=cfg.keyword_expansion.min_similarity,
+            )
+            cache_tags(missing_keywords, points, cfg, resolved)
+        return resolved
+
+
+async def resolve_keywords_async(keywords: List[str], cfg: RecommenderConfiguration) -> Dict[str, Tuple[str, ...]]:
+    """
+    Non-blocking version of resolve_keywords. The keywords are embedded concurrently, so the micro-batcher sends them
+    in one request, together with any query embedded at the same time.
+    """
+    with track_stage("expand_keywords"):
+        resolved, missing_keywords = get_cached_tags(normalize_keywords(keywords), cfg)
+        if missing_keywords:
+            vectors = await asyncio.gather(*[
+                get_embedding_async(text=keyword, model=cfg.embedder, dimensions=cfg.dimensions)
+                for keyword in missing_keywords
+            ])
+            points = await get_nearest_content_descriptors_async(
+                vectors=list(vectors),
+                k=cfg.keyword_expansion.tags_per_keyword,
+                score_threshold=cfg.keyword_expansion.min_similarity,
+            )
+            cache_tags(missing_keywords, points, cfg, resolved)
+        return resolved
+
+
+def expand_keywords(keywords: List[str], cfg: RecommenderConfiguration) -> List[str]:
+    """
+    Return the content descriptors the keywords of a query resolve to, or an empty list if keyword expansion is
+    disabled or failed: the recommendation is still made from the query alone.
+    """
+    if cfg.keyword_expansion.mode == "off" or not keywords:
+        return []
+    try:
+        return merge_tags(keywords, resolve_keywords(keywords, cfg))
+    except Exception:
+        logger.warning("Keyword expansion failed", exc_info=True, extra={"stage": "expand_keywords"})
+        return []
+
+
+async def expand_keywords_async(keywords: List[str], cfg: RecommenderConfiguration) -> List[str]:
+    """ Non-blocking version of expand_keywords. """
+    if cfg.keyword_expansion.mode == "off" or not keywords:
+        return []
+    try:
+        return merge_tags(keywords, await resolve_keywords_async(keywords, cfg))
+    except Exception:
+        logger.warning("Keyword expansion failed", exc_info=True, extra={"stage": "expand_keywords"})
+        return []
+
+
+async def expand_keywords_batch_async(keyword_lists: List[List[str]], cfg: RecommenderConfiguration) -> List[List[str]]:
+    """ Expand the keywords of several queries, resolving the keywords of all of them together. """
+    if cfg.keyword_expansion.mode == "off":
+        return [[] for _ in keyword_lists]
+    try:
+        resolved = await resolve_keywords_async([keyword for keywords in keyword_lists for keyword in keywords], cfg)
+    except Exception:
+        logger.warning("Keyword expansion failed", exc_info=True, extra={"stage": "expand_keywords"})
+        return [[] for _ in keyword_lists]
+    return [merge_tags(keywords, resolved) for keywords in keyword_lists]
@@ -0,0 +1,381 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from app.db.database import SessionLocal, AsyncSessionLocal
+from app.db.models import ContentDescriptor, MediaType, Status
+from app.monitoring.metrics import track_dependency
+from app.recommender.cache import TTLCache
+from app.services.catalog_service import get_catalog_versions, MEDIA_CATALOG
+
+MAX_KEYWORD_WORDS = 4
+
+# --- Vocabulary ---
+
+TYPE_TERMS = {
+    MediaType.TV: ["tv series", "tv shows", "tv show", "tv"],
+    MediaType.MOVIE: ["movies?", "films?"],
+    MediaType.OVA: ["ovas?"],
+    MediaType.ONA: ["onas?"],
+    MediaType.SPECIAL: ["specials"],
+    MediaType.MANGA: ["mangas?"],
+    MediaType.MANHWA: ["manhwas?", "webtoons?"],
+    MediaType.DOUJINSHI: ["doujinshis?", "doujins?"],
+    MediaType.NOVEL: ["light novels?", "web novels?", "novels?"],
+    MediaType.ARTBOOK: ["artbooks?", "art books?"],
+}
+
+STATUS_TERMS = {
+    Status.UPCOMING: ["upcoming", "unreleased", "not yet released", "not yet aired"],
+    Status.ONGOING: ["currently airing", "still airing", "still running", "currently running", "ongoing", "airing",
+                     "releasing"],
+    Status.FINISHED: ["finished airing", "finished", "completed", "complete", "ended"],
+    Status.SUSPENDED: ["on hiatus", "hiatus", "suspended"],
+    Status.CANCELLED: ["cancelled", "canceled"],
+}
+
+NEGATION = r"(?P<negation>\b(?:but\s+)?(?:not|no|non|without|except|excluding|other than)[\s-]+(?:an?\s+|any\s+)?)?"
+
+DECADE_WORDS = {
+    "fifties": 1950, "sixties": 1960, "seventies": 1970, "eighties": 1980, "nineties": 1990,
+}
+
+SCORE_OPERATORS = {
+    "above": "min", "over": "min", "higher than": "min", "more than": "min", "greater than": "min",
+    "at least": "min", ">=": "min", ">": "min",
+    "below": "max", "under": "max", "less than": "max", "lower than": "max", "at most": "max", "<=": "max", "<": "max",
+}
+
+# Words that carry no meaning of their own in a recommendation query
+FILLER_WORDS = frozenset("""
+    a an the some any me i i'm im my we us you want wanna need looking look find give show recommend recommendations
+    recommendation suggest suggestions please can could would should for with and or of that which who is are was
+    were be to in on from about something anything stuff one ones good great nice best top really very like also
+    more other kind sort type types
+""".split())
+
+# Words naming the medium in general: understood, kept in the embedding text, but not a constraint on their own
+MEDIUM_WORDS = frozenset("""
+    anime animes animation cartoon cartoons series shows title titles story stories comic comics
+""".split())
+
+NEGATION_WORDS = frozenset(["not", "no", "non", "without", "except", "excluding", "but", "never"])
+
+
+def alternation(terms: List[str]) -> str:
+    """ Build a regex alternation that tries the longest terms first. """
+    return "|".join(sorted(terms, key=len, reverse=True))
+
+
+TYPE_PATTERN = re.compile(
+    NEGATION + r"\b(?P<term>" + alternation([t for terms in TYPE_TERMS.values() for t in terms]) + r")\b"
+)
+STATUS_PATTERN = re.compile(
+    NEGATION + r"\b(?P<term>" + alternation([t for terms in STATUS_TERMS.values() for t in terms]) + r")\b"
+)
+
+SCORE_WORDS = r"(?:rated|rating|ratings|scored|scores|score|scoring)"
+SCORE_VALUE = r"(?P<value>\d+(?:\.\d+)?)"
+SCORE_SCALE = r"(?:\s*(?:/\s*10|out of 10))"
+SCORE_OPERATOR = r"(?P<operator>" + alternation([re.escape(o) for o in SCORE_OPERATORS]) + r")"
+SCORE_PATTERNS = [
+    # "rated above 8", "with a score of at least 7.5/10"
+    re.compile(r"\b(?:with\s+an?\s+)?" + SCORE_WORDS + r"\s+(?:of\s+|is\s+)?" + SCORE_OPERATOR + r"\s*" + SCORE_VALUE
+               + SCORE_SCALE + r"?"),
+    # "rated 8 or higher", "score 8+"
+    re.compile(r"\b" + SCORE_WORDS + r"\s+(?:of\s+)?" + SCORE_VALUE + SCORE_SCALE
+               + r"?\s*(?P<suffix>\+|or (?:higher|more|above|better)|or (?:lower|less|below|worse))"),
+    # "above 8/10"
+    re.compile(r"(?<![\w.])" + SCORE_OPERATOR + r"\s*" + SCORE_VALUE + SCORE_SCALE),
+]
+
+YEAR = r"(?:19[4-9]\d|20[0-4]\d)"
+DECADE_MODIFIER = r"(?:(?P<modifier>early|mid|late)[\s-]+)?"
+# "2010 onwards", "2005 and newer", "2015 or earlier": the year is one end of an open range
+LATER = r"(?:onwards?|and\s+(?:up|later|newer|after|beyond)|or\s+(?:later|newer|after|more recent))"
+EARLIER = r"(?:and\s+(?:older|earlier|before)|or\s+(?:earlier|older|before))"
+DATE_PATTERNS = [
+    ("since", re.compile(r"\b(?:(?:released|aired|published)\s+)?(?:(?:from|in|since)\s+)?(?P<year>" + YEAR + r")\s+"
+                         + LATER + r"\b")),
+    ("until", re.compile(r"\b(?:(?:released|aired|published)\s+)?(?:(?:from|in|until)\s+)?(?P<year>" + YEAR + r")\s+"
+                         + EARLIER + r"\b")),
+    ("range", re.compile(r"\b(?:between|from)\s+(?P<start>" + YEAR + r")\s+(?:and|to|until)\s+(?P<end>" + YEAR + r")\b")),
+    ("range", re.compile(r"\b(?P<start>" + YEAR + r")\s*(?:-|–|to)\s*(?P<end>" + YEAR + r")\b")),
+    ("decade", re.compile(r"\b(?:(?:from|in|during|of)\s+)?(?:the\s+)?" + DECADE_MODIFIER
+                          + r"(?:(?P<century>19|20)|')?(?P<decade>\d0)'?s\b")),
+    ("decade", re.compile(r"\b(?:(?:from|in|during|of)\s+)?(?:the\s+)?" + DECADE_MODIFIER
+                          + r"(?P<decade_word>" + alternation(list(DECADE_WORDS)) + r")\b")),
+    ("after", re.compile(r"\b(?:released\s+)?(?:after|newer than|later than|post)\s+(?P<year>" + YEAR + r")\b")),
+    ("since", re.compile(r"\b(?:released\s+)?since\s+(?P<year>" + YEAR + r")\b")),
+    ("before", re.compile(r"\b(?:released\s+)?(?:before|older than|prior to|pre)\s+(?P<year>" + YEAR + r")\b")),
+    ("until", re.compile(r"\b(?:released\s+)?(?:until|up to)\s+(?P<year>" + YEAR + r")\b")),
+    ("year", re.compile(r"\b(?:(?:released|aired|published)\s+)?(?:(?:from|in)\s+)?(?P<year>" + YEAR + r")\b")),
+]
+
+# A year given approximately cannot be turned into a hard constraint safely
+APPROXIMATE_YEAR_PATTERN = re.compile(
+    r"\b(?:around|circa|ca|approximately|roughly|about|near)\s+(?:the\s+year\s+)?" + YEAR + r"\b"
+    + r"|\b" + YEAR + r"(?:\s*-?ish|\s+or\s+so|\s+give\s+or\s+take)\b"
+)
+
+WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9']*")
+
+
+def term_value(term: str, terms_by_value: Dict[Any, List[str]]):
+    """ Return the enum value a matched term stands for. """
+    for value, terms in terms_by_value.items():
+        if any(re.fullmatch(t, term) for t in terms):
+            return value
+    raise KeyError(term)
+
+
+# --- Extraction ---
+
+@dataclass
+class LocalExtraction:
+    """ A processed query built without the LLM, in the same shape as the LLM response, and how sure we are of it. """
+    raw_query: Dict[str, Any]
+    confidence: float
+    unknown_words: List[str] = field(default_factory=list)
+
+
+class QueryText:
+    """ A normalized query whose understood parts are blanked out as the extraction goes on. """
+
+    def __init__(self, query: str):
+        self.text = re.sub(r"\s+", " ", query.lower().replace("’", "'")).strip()
+        self.n_words = len(WORD_PATTERN.findall(self.text))
+        self.remaining = self.text
+        self.uncertain = False  # a part of the query was understood, but not well enough to filter on it
+
+    def consume(self, pattern: re.Pattern):
+        """ Yield the matches of a pattern in what is left of the query, and blank them out. """
+        for match in list(pattern.finditer(self.remaining)):
+            yield match
+            start, end = match.span()
+            self.remaining = self.remaining[:start] + " " * (end - start) + self.remaining[end:]
+
+    def remaining_words(self) -> List[str]:
+        return WORD_PATTERN.findall(self.remaining)
+
+
+def extract_types(query: QueryText) -> Tuple[List[str], List[str]]:
+    include, exclude = [], []
+    for match in query.consume(TYPE_PATTERN):
+        value = term_value(match.group("term"), TYPE_TERMS).value
+        target = exclude if match.group("negation") else include
+        if value not in target:
+            target.append(value)
+    return include, exclude
+
+
+def extract_statuses(query: QueryText) -> Tuple[List[str], List[str]]:
+    include, exclude = [], []
+    for match in query.consume(STATUS_PATTERN):
+        value = term_value(match.group("term"), STATUS_TERMS).value
+        target = exclude if match.group("negation") else include
+        if value not in target:
+            target.append(value)
+    return include, exclude
+
+
+def extract_score_range(query: QueryText) -> Dict[str, Optional[float]]:
+    score_range = {"min": None, "max": None}
+    for pattern in SCORE_PATTERNS:
+        for match in query.consume(pattern):
+            value = float(match.group("value"))
+            if value > 10:
+                continue
+            operator = match.groupdict().get("operator")
+            if operator is not None:
+                bound = SCORE_OPERATORS[operator]
+            else:
+                bound = "max" if re.search(r"lower|less|below|worse", match.group("suffix")) else "min"
+            score_range[bound] = value
+    return score_range
+
+
+def decade_years(match: re.Match) -> Tuple[int, int]:
+    """ First and last year of a (possibly early/mid/late) decade. """
+    groups = match.groupdict()
+    if groups.get("decade_word"):
+        start = DECADE_WORDS[groups["decade_word"]]
+    else:
+        decade = int(groups["decade"])
+        century = groups.get("century")
+        if century:
+            start = int(century) * 100 + decade
+        else:
+            start = (1900 if decade >= 30 else 2000) + decade
+
+    modifier = groups.get("modifier")
+    if modifier == "early":
+        return start, start + 3
+    if modifier == "mid":
+        return start + 3, start + 6
+    if modifier == "late":
+        return start + 6, start + 9
+    return start, start + 9
+
+
+def extract_date_range(query: QueryText) -> Dict[str, Optional[str]]:
+    start, end = None, None
+    years = []
+    if APPROXIMATE_YEAR_PATTERN.search(query.remaining):
+        query.uncertain = True
+    for kind, pattern in DATE_PATTERNS:
+        for match in query.consume(pattern):
+            if kind == "range":
+                start, end = int(match.group("start")), int(match.group("end"))
+            elif kind == "decade":
+                start, end = decade_years(match)
+            elif kind == "after":
+                start = int(match.group("year")) + 1
+            elif kind == "since":
+                start = int(match.group("year"))
+            elif kind == "before":
+                end = int(match.group("year")) - 1
+            elif kind == "until":
+                end = int(match.group("year"))
+            else:
+                years.append(int(match.group("year")))
+    if years:
+        # Several years ("from 2020 2021", "2019 or 2021") span the range between them
+        start, end = min(years), max(years)
+
+    return {
+        "start": f"{start}-01" if start is not None else None,
+        "end": f"{end}-12" if end is not None else None,
+    }
+
+
+def normalize_descriptor(descriptor: str) -> str:
+    return re.sub(r"[\s\-_]+", " ", descriptor.strip().lower())
+
+
+def build_vocabulary_index(vocabulary: FrozenSet[str]) -> Dict[str, str]:
+    """ Map the normalized form of each content descriptor to the descriptor itself. """
+    return {normalize_descriptor(descriptor): descriptor for descriptor in vocabulary}
+
+
+def find_descriptor(words: List[str], index: Dict[str, str]) -> Optional[str]:
+    phrase = " ".join(words)
+    for candidate in (phrase, phrase + "s", phrase.removesuffix("s"), phrase.removesuffix("es")):
+        if candidate in index:
+            return index[candidate]
+    return None
+
+
+def extract_keywords(words: List[str], index: Dict[str, str]) -> Tuple[List[str], List[bool]]:
+    """
+    Greedily match the longest content descriptors in a list of words.
+    :return: The matched descriptors, and for each word whether it is part of one.
+    """
+    keywords = []
+    matched = [False] * len(words)
+    i = 0
+    while i < len(words):
+        for n in range(min(MAX_KEYWORD_WORDS, len(words) - i), 0, -1):
+            descriptor = find_descriptor(words[i:i + n], index)
+            if descriptor is not None and words[i] not in FILLER_WORDS:
+                if descriptor not in keywords:
+                    keywords.append(descriptor)
+                matched[i:i + n] = [True] * n
+                i += n
+                break
+        else:
+            i += 1
+    return keywords, matched
+
+
+def extract_query(user_query: str, vocabulary: FrozenSet[str]) -> LocalExtraction:
+    """
+    Extract the hard constraints and keywords of a recommendation query with deterministic rules.
+
+    Types and statuses are recognized from a list of synonyms (optionally negated), release dates from years and
+    decades, scores from comparisons with a score, and keywords from the content descriptors vocabulary. The
+    confidence is the share of the words of the query that were understood: words that are neither a constraint, a
+    keyword nor a filler word are left for the LLM to interpret.
+    :param user_query: Sanitized user query.
+    :param vocabulary: Content descriptors known to the catalog.
+    :return: The extraction and its confidence.
+    """
+    query = QueryText(user_query)
+
+    # Date ranges are extracted first so that years are not mistaken for scores
+    date_range = extract_date_range(query)
+    score_range = extract_score_range(query)
+    status_include, status_exclude = extract_statuses(query)
+    type_include, type_exclude = extract_types(query)
+
+    words = query.remaining_words()
+    keywords, is_keyword = extract_keywords(words, build_vocabulary_index(vocabulary))
+
+    unknown_words = [
+        word for word, keyword in zip(words, is_keyword)
+        if not keyword and word not in FILLER_WORDS and word not in MEDIUM_WORDS
+    ]
+    description = [word for word, keyword in zip(words, is_keyword) if keyword or word not in FILLER_WORDS]
+
+    has_constraints = any([
+        score_range["min"] is not None, score_range["max"] is not None, date_range["start"], date_range["end"],
+        type_include, type_exclude, status_include, status_exclude,
+    ])
+    if not query.n_words or not (keywords or has_constraints):
+        confidence = 0.0
+    elif any(word in NEGATION_WORDS for word in unknown_words):
+        # A negation that is not attached to a type or a status could flip the meaning of a keyword
+        confidence = 0.0
+    elif query.uncertain:
+        confidence = 0.0
+    else:
+        confidence = 1 - len(unknown_words) / query.n_words
+
+    return LocalExtraction(
+        raw_query={
+            "embedding_text": " ".join(description) or query.text,
+            "keywords": keywords,
+            "hard_constraints": {
+                "score_range": score_range,
+                "type": {"include": type_include, "exclude": type_exclude},
+                "date_range": date_range,
+                "status": {"include": status_include, "exclude": status_exclude},
+            },
+        },
+        confidence=round(confidence, 3),
+        unknown_words=unknown_words,
+    )
+
+
+# --- Content descriptors vocabulary ---
+
+def get_media_catalog_version():
+    return get_catalog_versions().get(MEDIA_CATALOG)
+
+
+# Content descriptors only change on ingestion
+vocabulary_cache = TTLCache(name="content_descriptor_vocabulary", max_size=1, version_provider=get_media_catalog_version)
+
+
+def get_content_descriptor_vocabulary() -> FrozenSet[str]:
+    """ Return every content descriptor of the catalog. """
+    vocabulary = vocabulary_cache.get("vocabulary")
+    if vocabulary is None:
+        with SessionLocal() as db_client:
+            with track_dependency("postgres", "select_content_descriptors"):
+                vocabulary = frozenset(db_client.scalars(select(ContentDescriptor.content_descriptor)).all())
+        vocabulary_cache.set("vocabulary", vocabulary)
+    return vocabulary
+
+
+async def get_content_descriptor_vocabulary_async() -> FrozenSet[str]:
+    """ Non-blocking version of get_content_descriptor_vocabulary. """
+    vocabulary = vocabulary_cache.get("vocabulary")
+    if vocabulary is None:
+        async with AsyncSessionLocal() as db_client:
+            with track_dependency("postgres", "select_content_descriptors"):
+                vocabulary = frozenset((await db_client.scalars(select(ContentDescriptor.content_descriptor))).all())
+        vocabulary_cache.set("vocabulary", vocabulary)
+    return vocabulary
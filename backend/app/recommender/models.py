@@ -1,3 +1,4 @@
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Optional, List
 
@@ -41,3 +42,22 @@ class ProcessedRecommenderQuery(BaseModel):
 
 class EmbeddedRecommenderQuery(BaseModel):
     vector: List[float]
+
+
+@dataclass(slots=True)
+class MediaRecord:
+    """ Compact, read-only view of a media with only the fields needed to build a response. """
+    media_id: int
+    title: str
+    type: str
+    external_url: Optional[str]
+    image_url: Optional[str]
+    status: Optional[str]
+    score: Optional[float]
+
+
+@dataclass
+class BatchRecommendation:
+    query: str
+    media: List[MediaRecord] = field(default_factory=list)
+    error: Optional[str] = None
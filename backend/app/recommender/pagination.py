@@ -0,0 +1,130 @@
+import logging
+import secrets
+from array import array
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from qdrant_client.http.models import ScoredPoint
+
+from app.recommender.cache import TTLCache, make_recommendation_cache_key, RECOMMENDATION_CACHE_MAX_SIZE, \
+    RECOMMENDATION_CACHE_TTL_SECONDS
+from app.recommender.models import ProcessedRecommenderQuery, EmbeddedRecommenderQuery, MediaRecord
+from app.recommender.retriever import retrieve_top_k_async, hydrate_media_async, build_search_params
+from app.services.catalog_service import get_catalog_version
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+logger = logging.getLogger(__name__)
+
+# A session lives as long as the cached recommendation of its query, so that a cached first page can be paginated
+SESSION_STORE_MAX_SIZE = RECOMMENDATION_CACHE_MAX_SIZE
+SESSION_TTL_SECONDS = RECOMMENDATION_CACHE_TTL_SECONDS
+CURSOR_STORE_MAX_SIZE = 10_000
+
+
+@dataclass(frozen=True)
+class RecommendationSession:
+    """ What is needed to serve the next pages of a recommendation without processing or embedding the query again. """
+    processed_query: ProcessedRecommenderQuery
+    vector: array                           # float32, much more compact than a list of floats
+    candidates: Tuple[ScoredPoint, ...]     # every retrieved candidate in reranked order, without its vector
+    required_tags: Optional[Tuple[str, ...]]
+
+
+@dataclass
+class RecommendationPage:
+    media: List[MediaRecord]
+    cursor: Optional[str]                   # None when there are no more results
+
+
+# Sessions are keyed like the recommendation cache, so a cached recommendation can still be paginated. They are
+# dropped whenever the catalog changes, since their candidates may no longer exist.
+session_store = TTLCache(
+    name="recommendation_sessions",
+    max_size=SESSION_STORE_MAX_SIZE,
+    ttl_seconds=SESSION_TTL_SECONDS,
+    version_provider=get_catalog_version,
+)
+
+# Cursors are random tokens pointing to a position in a session: they reveal nothing about the query and cannot be forged
+cursor_store = TTLCache(
+    name="recommendation_cursors",
+    max_size=CURSOR_STORE_MAX_SIZE,
+    ttl_seconds=SESSION_TTL_SECONDS,
+)
+
+
+def save_session(
+        session_key: str,
+        processed_query: ProcessedRecommenderQuery,
+        embedded_query: EmbeddedRecommenderQuery,
+        points: List[ScoredPoint],
+        ranked_media_ids: List[int],
+        required_tags: Optional[List[str]] = None,
+):
+    """ Store what the pipeline computed for a query, so that its next pages can be served from it. """
+    points_by_id = {point.id: point for point in points}
+    session_store.set(session_key, RecommendationSession(
+        processed_query=processed_query,
+        vector=array("f", embedded_query.vector),
+        candidates=tuple(points_by_id[media_id].model_copy(update={"vector": None}) for media_id in ranked_media_ids),
+        required_tags=tuple(required_tags) if required_tags else None,
+    ))
+
+
+def create_cursor(session_key: str, offset: int) -> Optional[str]:
+    """ Return a cursor to the results of a session from the offset on, or None if the session expired. """
+    if session_key not in session_store:
+        return None
+    cursor = secrets.token_urlsafe(16)
+    cursor_store.set(cursor, (session_key, offset))
+    return cursor
+
+
+def create_recommendation_cursor(user_query: str, cfg: RecommenderConfiguration) -> Optional[str]:
+    """ Return a cursor to the results that follow the first page of recommendations of a query. """
+    return create_cursor(make_recommendation_cache_key(user_query, cfg), cfg.n_selected)
+
+
+async def get_next_page_async(cursor: str, cfg: RecommenderConfiguration) -> Optional[RecommendationPage]:
+    """
+    Return the page of recommendations a cursor points to, or None if the cursor is unknown or its session expired.
+
+    Pages are served from the ranked candidates of the session. Past them, the vector database is searched again with
+    the stored vector and an offset, through the same retrieval as the first page, so no LLM or embedding request is
+    ever made.
+    :param cursor: Cursor returned with the previous page.
+    :param cfg: Recommender configuration.
+    """
+    position = cursor_store.get(cursor)
+    session = session_store.get(position[0]) if position is not None else None
+    if session is None:
+        return None
+
+    session_key, offset = position
+    page_size = cfg.n_selected
+    points = list(session.candidates[offset:offset + page_size])
+    exhausted = False
+    if len(points) < page_size:
+        # The first points of the search are the stored candidates, so the search resumes after them
+        k = page_size - len(points)
+        next_points = await retrieve_top_k_async(
+            embedded_query=EmbeddedRecommenderQuery(vector=session.vector.tolist()),
+            processed_query=session.processed_query,
+            k=k,
+            offset=max(offset, len(session.candidates)),
+            required_tags=list(session.required_tags) if session.required_tags else None,
+            hybrid=cfg.hybrid_retrieval,
+            adaptive=cfg.adaptive_search,
+            multi_vector=cfg.multi_vector.enabled,
+            search_params=build_search_params(cfg.media_collection),
+        )
+        next_points = next_points[:k]  # the adaptive search may retrieve more for the reranker
+        exhausted = len(next_points) < k
+        served_ids = {point.id for point in session.candidates}
+        points.extend(point for point in next_points if point.id not in served_ids)
+
+    media = await hydrate_media_async(points=points, media_ids=[point.id for point in points], hydration=cfg.hydration)
+    return RecommendationPage(
+        media=media,
+        cursor=None if exhausted else create_cursor(session_key, offset + page_size),
+    )
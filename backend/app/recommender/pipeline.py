@@ -1,23 +1,396 @@
-from typing import List
+import asyncio
+import logging
+from typing import List, AsyncIterator, Any, Tuple, Optional
 
-from app.db.models import Media
-from app.recommender.embedder import embed_processed_query
-from app.recommender.query_processor import process_query
+from qdrant_client.http.models import ScoredPoint
+
+from app.recommender.cache import recommendation_cache, make_recommendation_cache_key
+from app.monitoring.metrics import SPECULATIVE_RETRIEVALS
+from app.recommender.embedder import embed_processed_query, embed_processed_query_async, embed_processed_queries, \
+    embed_raw_query_async, build_embedding_text
+from app.recommender.keyword_expander import expand_keywords, expand_keywords_async, expand_keywords_batch_async
+from app.recommender.models import BatchRecommendation, MediaRecord, ProcessedRecommenderQuery, \
+    EmbeddedRecommenderQuery
+from app.recommender.pagination import save_session
+from app.recommender.query_processor import process_query, process_query_async
 from app.recommender.reranker import rerank
-from app.recommender.retriever import retrieve_top_k, retrieve_media
+from app.recommender.retriever import retrieve_top_k, retrieve_top_k_async, retrieve_media_async, \
+    retrieve_top_k_batch_async, hydrate_media, hydrate_media_async, get_media_from_payloads, \
+    retrieve_unfiltered_top_k_async, filter_candidates, build_search_params
+from app.recommender.single_flight import SingleFlight
+from app.services.query_log import get_query_log, PrewarmedQuery
 from common.config.recommender.recommender_config import RecommenderConfiguration
 
+logger = logging.getLogger(__name__)
+
+# Identical recommendation requests that arrive while one is being computed share its result
+recommendation_flights = SingleFlight("recommendations")
+
+
+def get_required_tags(tags: List[str], cfg: RecommenderConfiguration) -> Optional[List[str]]:
+    """ Tags that candidates must have one of, when keyword expansion is used as a filter. """
+    return tags if cfg.keyword_expansion.mode == "filter" and tags else None
+
+
+def get_rerank_keywords(processed_query: ProcessedRecommenderQuery, tags: List[str]) -> List[str]:
+    """ Keywords the reranker matches against the content descriptors: the query keywords and the tags they resolve to. """
+    return [*processed_query.keywords, *tags]
+
+
+def embed_and_retrieve(
+        processed_query: ProcessedRecommenderQuery,
+        cfg: RecommenderConfiguration
+) -> Tuple[List[ScoredPoint], List[str], EmbeddedRecommenderQuery]:
+    """ Embed the processed query, expand its keywords, and retrieve the closest points. """
+    tags                = expand_keywords(keywords=processed_query.keywords, cfg=cfg)
+    embedded_query      = embed_processed_query(model=cfg.embedder, dimensions=cfg.dimensions, query=processed_query)
+    k_closest_points    = retrieve_top_k(
+        embedded_query=embedded_query, processed_query=processed_query, k=cfg.top_k,
+        required_tags=get_required_tags(tags, cfg), hybrid=cfg.hybrid_retrieval, adaptive=cfg.adaptive_search,
+        multi_vector=cfg.multi_vector.enabled, search_params=build_search_params(cfg.media_collection),
+    )
+    return k_closest_points, tags, embedded_query
+
+
+async def embed_and_retrieve_async(
+        processed_query: ProcessedRecommenderQuery,
+        cfg: RecommenderConfiguration
+) -> Tuple[List[ScoredPoint], List[str], EmbeddedRecommenderQuery]:
+    """
+    Non-blocking version of embed_and_retrieve. The keywords are expanded while the query is embedded (their
+    embeddings share its request), and in boost mode while the vector database is searched, so keyword expansion
+    adds no sequential round trip. In filter mode the search waits for the tags.
+    """
+    expansion = asyncio.create_task(expand_keywords_async(keywords=processed_query.keywords, cfg=cfg))
+    try:
+        embedded_query  = await embed_processed_query_async(model=cfg.embedder, dimensions=cfg.dimensions, query=processed_query)
+        required_tags   = get_required_tags(await expansion, cfg) if cfg.keyword_expansion.mode == "filter" else None
+        k_closest_points = await retrieve_top_k_async(
+            embedded_query=embedded_query, processed_query=processed_query, k=cfg.top_k, required_tags=required_tags,
+            hybrid=cfg.hybrid_retrieval, adaptive=cfg.adaptive_search, multi_vector=cfg.multi_vector.enabled,
+            search_params=build_search_params(cfg.media_collection),
+        )
+        return k_closest_points, await expansion, embedded_query
+    finally:
+        expansion.cancel()  # no-op once it is done
+
+
+def save_recommendation_session(
+        cache_key: str,
+        processed_query: ProcessedRecommenderQuery,
+        embedded_query: EmbeddedRecommenderQuery,
+        points: List[ScoredPoint],
+        selected_media_ids: List[int],
+        tags: List[str],
+        cfg: RecommenderConfiguration,
+):
+    """
+    Save the session the next pages are served from: the first page, then the other candidates reranked on their own,
+    so that ranking them does not change the first page. Every path that caches a recommendation saves its session
+    right after, so that a cached first page can always be paginated and its session does not expire before it.
+    """
+    selected = set(selected_media_ids)
+    remaining_points = [point for point in points if point.id not in selected]
+    next_media_ids = rerank(
+        points=remaining_points, n_selected=len(remaining_points),
+        keywords=get_rerank_keywords(processed_query, tags), cfg=cfg.reranker,
+    ) if remaining_points else []
+    save_session(
+        cache_key, processed_query, embedded_query, points, [*selected_media_ids, *next_media_ids],
+        get_required_tags(tags, cfg),
+    )
+
 
-def get_recommendations(user_query:str, cfg:RecommenderConfiguration) -> List[Media]:
+def get_recommendations(user_query:str, cfg:RecommenderConfiguration) -> List[MediaRecord]:
     """
     Get media recommendations for a user query.
     :param user_query: User recommendation query.
     :param cfg: Recommender configuration.
-    :return: A list of Media objects from the database.
+    :return: A list of media records.
     """
-    processed_query     = process_query(user_query=user_query, prompt_id=cfg.prompt_id)
-    embedded_query      = embed_processed_query(model=cfg.embedder, dimensions=cfg.dimensions, query=processed_query)
-    k_closest_points    = retrieve_top_k(embedded_query=embedded_query, processed_query=processed_query, k=cfg.top_k)
-    selected_media_ids  = rerank(points=k_closest_points, n_selected=cfg.n_selected)
-    selected_media      = retrieve_media(media_ids=selected_media_ids)
-    return selected_media
+    cache_key = make_recommendation_cache_key(user_query, cfg)
+    cached_media = recommendation_cache.get(cache_key)
+    if cached_media is not None:
+        return list(cached_media)
+
+    def compute_recommendations():
+        processed_query     = process_query(
+            user_query=user_query, prompt_id=cfg.prompt_id, local_min_confidence=cfg.local_query_min_confidence
+        )
+        k_closest_points, tags, embedded_query = embed_and_retrieve(processed_query=processed_query, cfg=cfg)
+        selected_media_ids  = rerank(
+            points=k_closest_points, n_selected=cfg.n_selected,
+            keywords=get_rerank_keywords(processed_query, tags), cfg=cfg.reranker,
+        )
+        selected_media      = hydrate_media(points=k_closest_points, media_ids=selected_media_ids, hydration=cfg.hydration)
+
+        recommendation_cache.set(cache_key, tuple(selected_media))
+        save_recommendation_session(
+            cache_key, processed_query, embedded_query, k_closest_points, selected_media_ids, tags, cfg
+        )
+        return tuple(selected_media)
+
+    return list(recommendation_flights.do(cache_key, compute_recommendations))
+
+
+async def get_recommendations_async(user_query: str, cfg: RecommenderConfiguration) -> List[MediaRecord]:
+    """
+    Non-blocking version of get_recommendations: every outbound call (LLM, embedding, vector database, database)
+    is awaited, so a single worker can serve many recommendations concurrently.
+    :param user_query: User recommendation query.
+    :param cfg: Recommender configuration.
+    :return: A list of media records.
+    """
+    cache_key = make_recommendation_cache_key(user_query, cfg)
+    cached_media = recommendation_cache.get(cache_key)
+    if cached_media is not None:
+        return list(cached_media)
+
+    async def compute_recommendations():
+        if cfg.speculative_retrieval:
+            processed_query, k_closest_points, tags, embedded_query = await process_and_retrieve_speculatively(
+                user_query=user_query, cfg=cfg
+            )
+        else:
+            processed_query     = await process_query_async(
+                user_query=user_query, prompt_id=cfg.prompt_id, local_min_confidence=cfg.local_query_min_confidence
+            )
+            k_closest_points, tags, embedded_query = await embed_and_retrieve_async(
+                processed_query=processed_query, cfg=cfg
+            )
+        selected_media_ids  = rerank(
+            points=k_closest_points, n_selected=cfg.n_selected,
+            keywords=get_rerank_keywords(processed_query, tags), cfg=cfg.reranker,
+        )
+        selected_media      = await hydrate_media_async(points=k_closest_points, media_ids=selected_media_ids, hydration=cfg.hydration)
+
+        recommendation_cache.set(cache_key, tuple(selected_media))
+        save_recommendation_session(
+            cache_key, processed_query, embedded_query, k_closest_points, selected_media_ids, tags, cfg
+        )
+        return tuple(selected_media)
+
+    return list(await recommendation_flights.do_async(cache_key, compute_recommendations))
+
+
+async def retrieve_speculative_candidates(
+        user_query: str,
+        cfg: RecommenderConfiguration
+) -> Tuple[List[ScoredPoint], EmbeddedRecommenderQuery]:
+    """ Search the vector database with the raw user query, without constraints and with a larger k. """
+    embedded_query = await embed_raw_query_async(model=cfg.embedder, dimensions=cfg.dimensions, user_query=user_query)
+    candidates = await retrieve_unfiltered_top_k_async(
+        embedded_query=embedded_query, k=cfg.top_k * cfg.speculative_k_factor,
+        search_params=build_search_params(cfg.media_collection),
+    )
+    return candidates, embedded_query
+
+
+async def process_and_retrieve_speculatively(
+        user_query: str,
+        cfg: RecommenderConfiguration
+) -> Tuple[ProcessedRecommenderQuery, List[ScoredPoint], List[str], EmbeddedRecommenderQuery]:
+    """
+    Process the user query while speculatively retrieving candidates with the raw query, so that the LLM call and
+    the vector search overlap instead of adding up. Once the constraints are known, the speculative candidates are
+    filtered locally, and the regular filtered search only runs if fewer than top_k of them match.
+    :param user_query: User recommendation query.
+    :param cfg: Recommender configuration.
+    :return: The processed query, the top-k closest points that satisfy its constraints, the expanded keywords, and
+        the embedded query the points were retrieved with.
+    """
+    speculation = asyncio.create_task(retrieve_speculative_candidates(user_query, cfg))
+    try:
+        processed_query = await process_query_async(
+            user_query=user_query, prompt_id=cfg.prompt_id, local_min_confidence=cfg.local_query_min_confidence
+        )
+    except BaseException:
+        speculation.cancel()
+        raise
+
+    if not speculation.done():
+        # The constraints arrived first (e.g. the query was processed locally), so the regular search, which uses the
+        # processed query, costs no more than waiting for the speculative one
+        speculation.cancel()
+        outcome = "late"
+    elif speculation.exception() is not None:
+        logger.warning("Speculative retrieval failed: %r", speculation.exception(), extra={"stage": "speculation"})
+        outcome = "failed"
+    else:
+        candidates, embedded_query = speculation.result()
+        tags = await expand_keywords_async(keywords=processed_query.keywords, cfg=cfg)
+        matching_candidates = filter_candidates(
+            candidates, processed_query.hard_constraints, get_required_tags(tags, cfg)
+        )
+        # When the speculative search returned fewer points than requested, it already saw the whole collection
+        exhaustive = len(candidates) < cfg.top_k * cfg.speculative_k_factor
+        if len(matching_candidates) >= cfg.top_k or exhaustive:
+            SPECULATIVE_RETRIEVALS.labels("hit").inc()
+            return processed_query, matching_candidates[:cfg.top_k], tags, embedded_query
+        outcome = "miss"
+
+    SPECULATIVE_RETRIEVALS.labels(outcome).inc()
+    k_closest_points, tags, embedded_query = await embed_and_retrieve_async(processed_query=processed_query, cfg=cfg)
+    return processed_query, k_closest_points, tags, embedded_query
+
+
+async def stream_recommendations(
+        user_query: str,
+        cfg: RecommenderConfiguration
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Run the recommendation pipeline and yield (event, data) pairs as soon as each stage completes:
+    the parsed hard constraints, then the retrieved candidates, then the selected media.
+    :param user_query: User recommendation query.
+    :param cfg: Recommender configuration.
+    """
+    processed_query     = await process_query_async(
+        user_query=user_query, prompt_id=cfg.prompt_id, local_min_confidence=cfg.local_query_min_confidence
+    )
+    yield "constraints", processed_query.hard_constraints
+
+    k_closest_points, tags, embedded_query = await embed_and_retrieve_async(processed_query=processed_query, cfg=cfg)
+    yield "candidates", k_closest_points
+
+    selected_media_ids  = rerank(
+        points=k_closest_points, n_selected=cfg.n_selected,
+        keywords=get_rerank_keywords(processed_query, tags), cfg=cfg.reranker,
+    )
+    selected_media      = await hydrate_media_async(points=k_closest_points, media_ids=selected_media_ids, hydration=cfg.hydration)
+    cache_key = make_recommendation_cache_key(user_query, cfg)
+    recommendation_cache.set(cache_key, tuple(selected_media))
+    save_recommendation_session(cache_key, processed_query, embedded_query, k_closest_points, selected_media_ids, tags, cfg)
+    yield "media", selected_media
+
+
+async def get_recommendations_batch(
+        user_queries: List[str],
+        cfg: RecommenderConfiguration,
+        max_concurrency: int = 8,
+) -> List[BatchRecommendation]:
+    """
+    Get media recommendations for many user queries at once.
+
+    Queries are processed by the LLM with at most max_concurrency calls in flight, then every stage after that is
+    shared by the whole batch: the query vectors are embedded in packed requests, the vector database is searched
+    with batched requests, and all selected media are fetched with a single database query.
+    :param user_queries: User recommendation queries.
+    :param cfg: Recommender configuration.
+    :param max_concurrency: Maximum number of concurrent LLM calls.
+    :return: One BatchRecommendation per query, in the same order.
+    """
+    results = [BatchRecommendation(query=user_query) for user_query in user_queries]
+
+    # Serve what we can from the cache, and only compute the rest
+    pending = []
+    for result in results:
+        try:
+            cache_key = make_recommendation_cache_key(result.query, cfg)
+        except Exception as e:
+            result.error = str(e)
+            continue
+        cached_media = recommendation_cache.get(cache_key)
+        if cached_media is not None:
+            result.media = list(cached_media)
+        else:
+            pending.append((result, cache_key))
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def process_query_bounded(user_query):
+        async with semaphore:
+            return await process_query_async(
+                user_query=user_query, prompt_id=cfg.prompt_id, local_min_confidence=cfg.local_query_min_confidence
+            )
+
+    processed_queries = await asyncio.gather(
+        *[process_query_bounded(result.query) for result, _ in pending],
+        return_exceptions=True,
+    )
+
+    processed = []
+    for (result, cache_key), processed_query in zip(pending, processed_queries):
+        if isinstance(processed_query, Exception):
+            result.error = str(processed_query)
+        else:
+            processed.append((result, cache_key, processed_query))
+
+    if not processed:
+        return results
+
+    processed_queries = [processed_query for _, _, processed_query in processed]
+    # The keywords of every query are expanded together while the queries are embedded
+    embedded_queries, tags = await asyncio.gather(
+        asyncio.to_thread(
+            embed_processed_queries, model=cfg.embedder, dimensions=cfg.dimensions, queries=processed_queries
+        ),
+        expand_keywords_batch_async(keyword_lists=[query.keywords for query in processed_queries], cfg=cfg),
+    )
+    k_closest_points = await retrieve_top_k_batch_async(
+        embedded_queries=embedded_queries, processed_queries=processed_queries, k=cfg.top_k,
+        required_tags=[get_required_tags(query_tags, cfg) for query_tags in tags], hybrid=cfg.hybrid_retrieval,
+        search_params=build_search_params(cfg.media_collection),
+    )
+    selected_media_ids = [
+        rerank(
+            points=points, n_selected=cfg.n_selected,
+            keywords=get_rerank_keywords(processed_query, query_tags), cfg=cfg.reranker,
+        )
+        for points, processed_query, query_tags in zip(k_closest_points, processed_queries, tags)
+    ]
+
+    all_media_ids = list(dict.fromkeys(media_id for media_ids in selected_media_ids for media_id in media_ids))
+    if cfg.hydration == "payload":
+        all_points = [point for points in k_closest_points for point in points]
+        media_by_id, stale_media_ids = get_media_from_payloads(all_points, all_media_ids)
+    else:
+        media_by_id, stale_media_ids = {}, all_media_ids
+    if stale_media_ids:
+        media_by_id.update({media.media_id: media for media in await retrieve_media_async(media_ids=stale_media_ids)})
+
+    for (result, cache_key, processed_query), embedded_query, points, query_tags, media_ids in zip(
+            processed, embedded_queries, k_closest_points, tags, selected_media_ids
+    ):
+        result.media = [media_by_id[media_id] for media_id in media_ids if media_id in media_by_id]
+        recommendation_cache.set(cache_key, tuple(result.media))
+        save_recommendation_session(cache_key, processed_query, embedded_query, points, media_ids, query_tags, cfg)
+
+    return results
+
+
+def prewarm_queries(cfg: RecommenderConfiguration, top_n: int) -> int:
+    """
+    Process and embed the top_n most frequent queries of the query log, and store them for the API to load into its
+    prewarmed query table. Queries that fail to be processed are skipped.
+    :param cfg: Recommender configuration, the prewarmed queries are only used with the same prompt and embedder.
+    :param top_n: Number of queries to prewarm.
+    :return: The number of prewarmed queries.
+    """
+    query_log = get_query_log()
+    query_log.prune()
+
+    queries, processed_queries = [], []
+    for query, _ in query_log.top_queries(top_n):
+        try:
+            processed_queries.append(process_query(
+                user_query=query, prompt_id=cfg.prompt_id, local_min_confidence=cfg.local_query_min_confidence
+            ))
+            queries.append(query)
+        except Exception:
+            logger.warning("Could not prewarm query %r", query, exc_info=True, extra={"stage": "prewarm"})
+
+    embedded_queries = embed_processed_queries(model=cfg.embedder, dimensions=cfg.dimensions, queries=processed_queries)
+    query_log.save_prewarmed(
+        [
+            PrewarmedQuery(
+                query=query,
+                processed_query=processed_query.model_dump(mode="json"),
+                embedding_text=build_embedding_text(processed_query),
+                vector=embedded_query.vector,
+            )
+            for query, processed_query, embedded_query in zip(queries, processed_queries, embedded_queries)
+        ],
+        prompt_id=cfg.prompt_id, model=cfg.embedder, dimensions=cfg.dimensions,
+    )
+    return len(queries)
+
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from app.monitoring.metrics import record_cache_lookup
+from app.recommender.models import ProcessedRecommenderQuery
+from app.services.query_log import get_query_log, normalize_query
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+logger = logging.getLogger(__name__)
+
+
+class PrewarmedQueryTable:
+    """
+    In-memory table of the processed queries and vectors of the most frequent queries, prewarmed by
+    `osusume recommend prewarm`. Lookups are plain dictionary reads: hot queries never leave the process.
+
+    The table is replaced as a whole when it is reloaded, so lookups never see a partially loaded table.
+    """
+
+    def __init__(self):
+        self._processed_queries: Dict[Tuple[str, str], ProcessedRecommenderQuery] = {}
+        self._vectors: Dict[Tuple[str, str, int], List[float]] = {}
+
+    def load(self, cfg: RecommenderConfiguration) -> int:
+        """ Load the queries prewarmed for the prompt and embedder of the configuration, return how many. """
+        entries = get_query_log().load_prewarmed(cfg.prompt_id, cfg.embedder, cfg.dimensions)
+        self._processed_queries = {
+            (entry.query, cfg.prompt_id): ProcessedRecommenderQuery.model_validate(entry.processed_query)
+            for entry in entries
+        }
+        self._vectors = {(entry.embedding_text, cfg.embedder, cfg.dimensions): entry.vector for entry in entries}
+        logger.info("Loaded %d prewarmed queries", len(entries), extra={"stage": "prewarm"})
+        return len(entries)
+
+    def get_processed_query(self, user_query: str, prompt_id: str) -> Optional[ProcessedRecommenderQuery]:
+        if not self._processed_queries:
+            return None
+        query = normalize_query(user_query)
+        processed_query = self._processed_queries.get((query, prompt_id)) if query is not None else None
+        record_cache_lookup("prewarmed_queries", hit=processed_query is not None)
+        return processed_query
+
+    def get_vector(self, text: str, model: str, dimensions: int) -> Optional[List[float]]:
+        if not self._vectors:
+            return None
+        vector = self._vectors.get((text, model, dimensions))
+        record_cache_lookup("prewarmed_vectors", hit=vector is not None)
+        return vector
+
+    async def refresh_periodically(self, cfg: RecommenderConfiguration, interval_seconds: float):
+        """ Reload the table every interval_seconds, so a new prewarm job is picked up without a restart. """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.load, cfg)
+            except Exception:
+                logger.warning("Could not reload the prewarmed queries", exc_info=True, extra={"stage": "prewarm"})
+
+    def clear(self) -> None:
+        self._processed_queries = {}
+        self._vectors = {}
+
+    def __len__(self):
+        return len(self._processed_queries)
+
+
+# Singleton instance, loaded at API startup
+prewarmed_queries = PrewarmedQueryTable()
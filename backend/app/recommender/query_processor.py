@@ -1,10 +1,24 @@
+import logging
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional, FrozenSet
+
+from sqlalchemy.exc import SQLAlchemyError
 
 from app.db.models import MediaType, Status
+from app.recommender.local_query_extractor import extract_query, get_content_descriptor_vocabulary, \
+    get_content_descriptor_vocabulary_async
 from app.recommender.models import ScoreRange, TypeConstraints, DateRange, StatusConstraints, \
     RecommenderQueryHardConstraints, ProcessedRecommenderQuery
-from app.services.openai_service import get_processed_recommender_query
+from app.monitoring.metrics import track_stage, QUERY_PROCESSING_PATHS
+from app.recommender.prewarmed_queries import prewarmed_queries
+from app.recommender.single_flight import SingleFlight
+from app.services.openai_service import get_processed_recommender_query, get_processed_recommender_query_async, \
+    sanitize_llm_query, QueryValidationError, QueryTooLongError
+
+logger = logging.getLogger(__name__)
+
+# Identical queries processed concurrently share a single LLM call
+query_processing_flights = SingleFlight("query_processing")
 
 
 # --- Converter functions ---
@@ -43,16 +57,125 @@ def parse_hard_constraints(data: Dict[str, Any]) -> RecommenderQueryHardConstrai
     )
 
 
-# --- Main function ---
-
-def process_query(user_query, prompt_id) -> ProcessedRecommenderQuery:
-    """ Process the user recommendation query using an LLM and return it as an object. """
-    print(f"Processing query: {user_query}")
-    raw_query = get_processed_recommender_query(user_query, prompt_id)
-    processed_query = ProcessedRecommenderQuery(
+def build_processed_query(raw_query: Dict[str, Any]) -> ProcessedRecommenderQuery:
+    return ProcessedRecommenderQuery(
         embedding_text=raw_query["embedding_text"],
         keywords=raw_query["keywords"],
         hard_constraints=parse_hard_constraints(raw_query["hard_constraints"])
     )
-    print(f"Query successfully processed: {processed_query}")
+
+
+def get_query_processing_key(user_query, prompt_id):
+    """ Key under which identical in-flight query processing calls are coalesced, None if the query is invalid. """
+    try:
+        return sanitize_llm_query(user_query), prompt_id
+    except (QueryValidationError, QueryTooLongError):
+        return None
+
+
+def get_prewarmed_query(user_query, prompt_id) -> Optional[ProcessedRecommenderQuery]:
+    """ Return the processed query if it was prewarmed, None otherwise. """
+    processed_query = prewarmed_queries.get_processed_query(user_query, prompt_id)
+    if processed_query is not None:
+        QUERY_PROCESSING_PATHS.labels("prewarmed").inc()
+    return processed_query
+
+
+def process_query_locally(
+        user_query,
+        vocabulary: FrozenSet[str],
+        min_confidence: float
+) -> Optional[ProcessedRecommenderQuery]:
+    """ Process the user query with the local rule-based extractor, None if it is not confident enough. """
+    try:
+        clean_query = sanitize_llm_query(user_query)
+    except (QueryValidationError, QueryTooLongError):
+        return None  # Let the LLM path report the error
+
+    extraction = extract_query(clean_query, vocabulary)
+    if extraction.confidence < min_confidence:
+        logger.debug(
+            "Local extraction not confident enough (%s), unknown words: %s", extraction.confidence,
+            extraction.unknown_words, extra={"stage": "process_query"}
+        )
+        return None
+
+    processed_query = build_processed_query(extraction.raw_query)
+    QUERY_PROCESSING_PATHS.labels("local").inc()
+    logger.debug("Query processed locally: %s", processed_query, extra={"stage": "process_query"})
     return processed_query
+
+
+# --- Main functions ---
+
+def process_query(user_query, prompt_id, local_min_confidence: Optional[float] = None) -> ProcessedRecommenderQuery:
+    """
+    Process the user recommendation query and return it as an object.
+    :param user_query: User recommendation query.
+    :param prompt_id: ID of the LLM prompt used to process the query.
+    :param local_min_confidence: Confidence above which the local rule-based extractor is trusted instead of the
+    LLM. None to always use the LLM.
+    Prewarmed queries (see prewarmed_queries) are served from memory before either is tried.
+    """
+    def compute_processed_query():
+        logger.debug("Processing query: %s", user_query, extra={"stage": "process_query"})
+        raw_query = get_processed_recommender_query(user_query, prompt_id)
+        processed_query = build_processed_query(raw_query)
+        QUERY_PROCESSING_PATHS.labels("llm").inc()
+        logger.debug("Query successfully processed: %s", processed_query, extra={"stage": "process_query"})
+        return processed_query
+
+    with track_stage("process_query"):
+        processed_query = get_prewarmed_query(user_query, prompt_id)
+        if processed_query is not None:
+            return processed_query
+
+        if local_min_confidence is not None:
+            try:
+                vocabulary = get_content_descriptor_vocabulary()
+            except SQLAlchemyError:
+                logger.warning("Could not load the content descriptors, falling back to the LLM", exc_info=True)
+            else:
+                processed_query = process_query_locally(user_query, vocabulary, local_min_confidence)
+                if processed_query is not None:
+                    return processed_query
+
+        key = get_query_processing_key(user_query, prompt_id)
+        if key is None:
+            return compute_processed_query()
+        return query_processing_flights.do(key, compute_processed_query)
+
+
+async def process_query_async(
+        user_query,
+        prompt_id,
+        local_min_confidence: Optional[float] = None
+) -> ProcessedRecommenderQuery:
+    """ Non-blocking version of process_query. """
+    async def compute_processed_query():
+        logger.debug("Processing query: %s", user_query, extra={"stage": "process_query"})
+        raw_query = await get_processed_recommender_query_async(user_query, prompt_id)
+        processed_query = build_processed_query(raw_query)
+        QUERY_PROCESSING_PATHS.labels("llm").inc()
+        logger.debug("Query successfully processed: %s", processed_query, extra={"stage": "process_query"})
+        return processed_query
+
+    with track_stage("process_query"):
+        processed_query = get_prewarmed_query(user_query, prompt_id)
+        if processed_query is not None:
+            return processed_query
+
+        if local_min_confidence is not None:
+            try:
+                vocabulary = await get_content_descriptor_vocabulary_async()
+            except SQLAlchemyError:
+                logger.warning("Could not load the content descriptors, falling back to the LLM", exc_info=True)
+            else:
+                processed_query = process_query_locally(user_query, vocabulary, local_min_confidence)
+                if processed_query is not None:
+                    return processed_query
+
+        key = get_query_processing_key(user_query, prompt_id)
+        if key is None:
+            return await compute_processed_query()
+        return await query_processing_flights.do_async(key, compute_processed_query)
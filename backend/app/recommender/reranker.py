@@ -1,9 +1,126 @@
-from typing import List
+import logging
+from typing import List, Optional, Sequence
 
+import numpy as np
 from qdrant_client.http.models import ScoredPoint
 
+from app.monitoring.metrics import track_stage
+from common.config.recommender.recommender_config import RerankerConfiguration
 
-def rerank(points: List[ScoredPoint], n_selected: int) -> List[int]:
-    print("Re-ranking vectors...")
-    """ Return the media_id for the top n_selected recommendations. """
-    return [point.id for point in points[:n_selected]]
+logger = logging.getLogger(__name__)
+
+MAX_SCORE = 10.0
+
+
+def get_point_vector(point: ScoredPoint) -> Optional[List[float]]:
+    """ Return the dense vector of a point, if it was retrieved. """
+    vector = point.vector
+    if isinstance(vector, dict):  # named vectors
+        vector = next((v for v in vector.values() if isinstance(v, list) and v and isinstance(v[0], float)), None)
+    return vector or None
+
+
+def build_unit_vectors(points: List[ScoredPoint]) -> Optional[np.ndarray]:
+    """ Stack the vectors of the points into a matrix of unit rows, None if some points have no vector. """
+    vectors = [get_point_vector(point) for point in points]
+    if any(vector is None for vector in vectors):
+        return None
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def keyword_overlap(points: List[ScoredPoint], keywords: Sequence[str]) -> np.ndarray:
+    """ Share of the query keywords found in the content descriptors of each point. """
+    wanted = {keyword.strip().lower() for keyword in keywords}
+    if not wanted:
+        return np.zeros(len(points), dtype=np.float32)
+    counts = [
+        len(wanted.intersection(d.lower() for d in (point.payload or {}).get("content_descriptors") or []))
+        for point in points
+    ]
+    return np.asarray(counts, dtype=np.float32) / len(wanted)
+
+
+def score_prior(points: List[ScoredPoint]) -> np.ndarray:
+    """
+    Score of each point scaled to [0, 1]. Points without a score get the mean of the others, so they are neither
+    favored nor penalized.
+    """
+    scores = np.asarray([(point.payload or {}).get("score") for point in points], dtype=np.float32)  # None is nan
+    known = ~np.isnan(scores)
+    if not known.any():
+        return np.zeros(len(points), dtype=np.float32)
+    scores[~known] = scores[known].mean()
+    return np.clip(scores / MAX_SCORE, 0.0, 1.0)
+
+
+def maximal_marginal_relevance(
+        relevance: np.ndarray,
+        unit_vectors: Optional[np.ndarray],
+        n_selected: int,
+        mmr_lambda: float
+) -> List[int]:
+    """
+    Greedily select the candidates that maximize mmr_lambda * relevance - (1 - mmr_lambda) * (highest cosine
+    similarity to an already selected candidate).
+    :return: Indices of the selected candidates, in order of selection.
+    """
+    n_selected = min(n_selected, len(relevance))
+    if unit_vectors is None or mmr_lambda >= 1:
+        return list(np.argsort(-relevance, kind="stable")[:n_selected])
+
+    selected = []
+    max_similarity = np.full(len(relevance), -np.inf, dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    for _ in range(n_selected):
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        mmr = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        # Only the similarities to the newly selected candidate are needed to update the redundancy
+        np.maximum(max_similarity, unit_vectors @ unit_vectors[best], out=max_similarity)
+    return selected
+
+
+def rerank(
+        points: List[ScoredPoint],
+        n_selected: int,
+        keywords: Sequence[str] = (),
+        cfg: Optional[RerankerConfiguration] = None
+) -> List[int]:
+    """
+    Return the media_id for the top n_selected recommendations.
+
+    The relevance of each candidate combines its similarity to the query (the score of the vector search, relative to
+    the best one), the share of the query keywords among its content descriptors, and its score. The most relevant candidates are then
+    selected with Maximal Marginal Relevance, which trades relevance for diversity using the candidate vectors when
+    they were retrieved.
+    :param points: Candidates returned by the vector search.
+    :param n_selected: Number of media to select.
+    :param keywords: Keywords of the processed query.
+    :param cfg: Reranker weights.
+    """
+    logger.debug("Re-ranking vectors...", extra={"stage": "rerank"})
+    with track_stage("rerank"):
+        if not points:
+            return []
+        cfg = cfg or RerankerConfiguration()
+
+        similarity = np.asarray([point.score for point in points], dtype=np.float32)
+        # Relative to the best candidate, so that cosine similarities and fused (RRF) scores weigh the same
+        if similarity.max() > 0:
+            similarity /= similarity.max()
+        relevance = (
+            cfg.similarity_weight * similarity
+            + cfg.keyword_weight * keyword_overlap(points, keywords)
+            + cfg.score_weight * score_prior(points)
+        )
+
+        # Diversification only considers the most relevant candidates, which also bounds the vectors to convert
+        pool = np.argsort(-relevance, kind="stable")[:max(cfg.mmr_pool_size, n_selected)]
+        pool_points = [points[i] for i in pool]
+        selected = maximal_marginal_relevance(relevance[pool], build_unit_vectors(pool_points), n_selected, cfg.mmr_lambda)
+        return [pool_points[i].id for i in selected]
@@ -1,17 +1,37 @@
-from typing import Optional, List
+import logging
+import math
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Tuple
 
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import MatchValue, FieldCondition, Range, Filter, DatetimeRange, ScoredPoint
+from qdrant_client.http.models import MatchValue, FieldCondition, Range, Filter, DatetimeRange, ScoredPoint, MatchAny, \
+    SearchParams, QuantizationSearchParams
 from sqlalchemy import select
 
-from app.db.database import SessionLocal
+from app.db.database import SessionLocal, AsyncSessionLocal
 from app.db.models import Media
-from app.recommender.models import EmbeddedRecommenderQuery, ProcessedRecommenderQuery, RecommenderQueryHardConstraints
-from app.vector_db.vector_database import DEFAULT_MEDIA_COLLECTION_NAME, get_top_k_from_media
+from app.monitoring.metrics import track_stage, track_dependency, RETRIEVAL_STRATEGY_LATENCY
+from app.recommender.cache import TTLCache
+from app.recommender.embedder import build_embedding_text
+from app.recommender.models import EmbeddedRecommenderQuery, ProcessedRecommenderQuery, RecommenderQueryHardConstraints, \
+    MediaRecord
+from app.services.catalog_service import get_catalog_versions, get_media_update_times, MEDIA_CATALOG, VECTOR_CATALOG
+from app.vector_db.sparse_encoder import encode_query
+from app.vector_db.vector_database import DEFAULT_MEDIA_COLLECTION_NAME, get_top_k_from_media, \
+    get_top_k_from_media_async, get_top_k_batch_from_media_async, count_media, count_media_async, \
+    get_top_k_multi_vector_from_media, get_top_k_multi_vector_from_media_async
+from common.config.recommender.recommender_config import AdaptiveSearchConfiguration, MediaCollectionConfiguration
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_MAX_SIZE = 10_000
+CARDINALITY_CACHE_MAX_SIZE = 10_000
 
 
 def build_filter_from_constraints(
-        constraints: RecommenderQueryHardConstraints
+        constraints: RecommenderQueryHardConstraints,
+        required_tags: Optional[List[str]] = None,
 ) -> Optional[Filter]:
     must_clauses = []
     must_not_clauses = []
@@ -96,6 +116,15 @@ def build_filter_from_constraints(
             ]
         )
 
+    # Content descriptors filter (keyword expansion)
+    if required_tags:
+        must_clauses.append(
+            FieldCondition(
+                key="content_descriptors",
+                match=MatchAny(any=list(required_tags)),
+            )
+        )
+
     if not (must_clauses or must_not_clauses or should_clauses):
         return None
 
@@ -106,27 +135,470 @@ def build_filter_from_constraints(
     )
 
 
+# --- Search parameters ---
+
+def build_search_params(collection: MediaCollectionConfiguration) -> Optional[SearchParams]:
+    """ Search parameters matching the media collection settings, None when the Qdrant defaults apply. """
+    quantization = None
+    if collection.quantization != "none":
+        quantization = QuantizationSearchParams(rescore=collection.rescore, oversampling=collection.oversampling)
+    if collection.search_hnsw_ef is None and quantization is None:
+        return None
+    return SearchParams(hnsw_ef=collection.search_hnsw_ef, quantization=quantization)
+
+
+def merge_search_params(
+        base: Optional[SearchParams],
+        override: Optional[SearchParams]
+) -> Optional[SearchParams]:
+    """
+    Search parameters of the collection, overridden by those of the search strategy. Exact searches score the original
+    vectors: they are only chosen when few media match, where the quantized ones would only cost recall.
+    """
+    if override is None:
+        return base
+    if base is None:
+        return override
+    if override.exact:
+        return override.model_copy(update={"quantization": QuantizationSearchParams(ignore=True)}) \
+            if base.quantization is not None else override
+    return base.model_copy(update=override.model_dump(exclude_none=True))
+
+
+# --- Adaptive search ---
+
+@dataclass(frozen=True)
+class SearchStrategy:
+    name: str
+    k: int
+    search_params: Optional[SearchParams] = None
+
+
+def get_vector_catalog_version():
+    return get_catalog_versions().get(VECTOR_CATALOG)
+
+
+# Queries share a small number of constraint combinations, and the counts only change when the media are re-indexed
+cardinality_cache = TTLCache(
+    name="filter_cardinality",
+    max_size=CARDINALITY_CACHE_MAX_SIZE,
+    version_provider=get_vector_catalog_version,
+)
+
+
+def make_cardinality_cache_key(vdb_filter: Optional[Filter]) -> str:
+    return vdb_filter.model_dump_json(exclude_none=True) if vdb_filter is not None else ""
+
+
+def get_cardinalities(vdb_filter: Filter) -> Tuple[int, int]:
+    """ Return the number of media matching the filter, and the size of the collection. """
+    counts = []
+    for key_filter in (vdb_filter, None):
+        key = make_cardinality_cache_key(key_filter)
+        count = cardinality_cache.get(key)
+        if count is None:
+            count = count_media(key_filter)
+            cardinality_cache.set(key, count)
+        counts.append(count)
+    return counts[0], counts[1]
+
+
+async def get_cardinalities_async(vdb_filter: Filter) -> Tuple[int, int]:
+    """ Non-blocking version of get_cardinalities. """
+    counts = []
+    for key_filter in (vdb_filter, None):
+        key = make_cardinality_cache_key(key_filter)
+        count = cardinality_cache.get(key)
+        if count is None:
+            count = await count_media_async(key_filter)
+            cardinality_cache.set(key, count)
+        counts.append(count)
+    return counts[0], counts[1]
+
+
+def choose_search_strategy(
+        cardinality: Optional[int],
+        collection_size: int,
+        k: int,
+        cfg: AdaptiveSearchConfiguration
+) -> SearchStrategy:
+    """
+    Choose how to search from the number of media matching the filter (None without a filter).
+
+    - empty: nothing matches, no search is needed.
+    - exact: few media match, scoring all of them (found through the payload index) is fast and returns every match,
+      where the HNSW graph restricted to them is sparse, slow to explore and may return fewer than k.
+    - selective: a small share of the collection matches, the HNSW beam is widened to keep recall.
+    - loose: most media match (or there is no filter), the default search is fast and more candidates are retrieved
+      for the reranker.
+    """
+    if cardinality == 0:
+        return SearchStrategy(name="empty", k=0)
+    if cardinality is not None and cardinality <= cfg.exact_max_candidates:
+        return SearchStrategy(name="exact", k=k, search_params=SearchParams(exact=True))
+    if cardinality is not None and cardinality < cfg.selective_fraction * collection_size:
+        return SearchStrategy(name="selective", k=k, search_params=SearchParams(hnsw_ef=max(cfg.selective_hnsw_ef, k)))
+    return SearchStrategy(name="loose", k=max(k, math.ceil(k * cfg.loose_k_factor)))
+
+
+def get_search_strategy(vdb_filter: Optional[Filter], k: int, cfg: AdaptiveSearchConfiguration) -> SearchStrategy:
+    if vdb_filter is None:
+        return choose_search_strategy(None, 0, k, cfg)
+    return choose_search_strategy(*get_cardinalities(vdb_filter), k, cfg)
+
+
+async def get_search_strategy_async(
+        vdb_filter: Optional[Filter],
+        k: int,
+        cfg: AdaptiveSearchConfiguration
+) -> SearchStrategy:
+    """ Non-blocking version of get_search_strategy. """
+    if vdb_filter is None:
+        return choose_search_strategy(None, 0, k, cfg)
+    return choose_search_strategy(*await get_cardinalities_async(vdb_filter), k, cfg)
+
+
+# --- Retrieval ---
+
 def retrieve_top_k(
         embedded_query: EmbeddedRecommenderQuery,
         processed_query: ProcessedRecommenderQuery,
-        k: int
+        k: int,
+        required_tags: Optional[List[str]] = None,
+        hybrid: bool = False,
+        adaptive: Optional[AdaptiveSearchConfiguration] = None,
+        multi_vector: bool = False,
+        search_params: Optional[SearchParams] = None,
+        offset: int = 0,
 ) -> List[ScoredPoint]:
     """
     Retrieve the top-k closest vectors to the embedded query from the vector database,
-    applying filtering based on processed query's hard constraints.
+    applying filtering based on processed query's hard constraints, and on required_tags if given (media must have
+    at least one of them). The vectors are returned so the reranker can diversify the results.
+    With hybrid, a lexical (sparse) search on the same text runs in the same request, and both rankings are fused.
+    With adaptive, the search strategy depends on the number of media matching the filter (see choose_search_strategy).
+    With multi_vector, the tag and summary chunk vectors of the media are searched too, and each media keeps its best
+    similarity. search_params are those of the collection (see build_search_params), refined by the search strategy.
+    The offset closest points are skipped, to serve the next pages of a search.
     """
-    print("Retrieving top-k vectors from vector database...")
-    vdb_filter = build_filter_from_constraints(processed_query.hard_constraints)
-    return get_top_k_from_media(vector=embedded_query.vector, k=k, vdb_filter=vdb_filter)
+    logger.debug("Retrieving top-k vectors from vector database...", extra={"stage": "retrieve_top_k"})
+    with track_stage("retrieve_top_k"):
+        vdb_filter = build_filter_from_constraints(processed_query.hard_constraints, required_tags)
+        strategy = get_search_strategy(vdb_filter, k, adaptive) if adaptive and adaptive.enabled else \
+            SearchStrategy(name="default", k=k)
+        with RETRIEVAL_STRATEGY_LATENCY.labels(strategy.name).time():
+            if not strategy.k:
+                return []
+            search = get_top_k_multi_vector_from_media if multi_vector else get_top_k_from_media
+            return search(
+                vector=embedded_query.vector, k=strategy.k, vdb_filter=vdb_filter, with_vectors=True,
+                sparse_vector=encode_query(build_embedding_text(processed_query)) if hybrid else None,
+                search_params=merge_search_params(search_params, strategy.search_params), offset=offset,
+            )
+
+
+async def retrieve_top_k_async(
+        embedded_query: EmbeddedRecommenderQuery,
+        processed_query: ProcessedRecommenderQuery,
+        k: int,
+        required_tags: Optional[List[str]] = None,
+        hybrid: bool = False,
+        adaptive: Optional[AdaptiveSearchConfiguration] = None,
+        multi_vector: bool = False,
+        search_params: Optional[SearchParams] = None,
+        offset: int = 0,
+) -> List[ScoredPoint]:
+    """ Non-blocking version of retrieve_top_k. """
+    logger.debug("Retrieving top-k vectors from vector database...", extra={"stage": "retrieve_top_k"})
+    with track_stage("retrieve_top_k"):
+        vdb_filter = build_filter_from_constraints(processed_query.hard_constraints, required_tags)
+        strategy = await get_search_strategy_async(vdb_filter, k, adaptive) if adaptive and adaptive.enabled else \
+            SearchStrategy(name="default", k=k)
+        with RETRIEVAL_STRATEGY_LATENCY.labels(strategy.name).time():
+            if not strategy.k:
+                return []
+            search = get_top_k_multi_vector_from_media_async if multi_vector else get_top_k_from_media_async
+            return await search(
+                vector=embedded_query.vector, k=strategy.k, vdb_filter=vdb_filter, with_vectors=True,
+                sparse_vector=encode_query(build_embedding_text(processed_query)) if hybrid else None,
+                search_params=merge_search_params(search_params, strategy.search_params), offset=offset,
+            )
+
+
+async def retrieve_unfiltered_top_k_async(
+        embedded_query: EmbeddedRecommenderQuery,
+        k: int,
+        search_params: Optional[SearchParams] = None,
+) -> List[ScoredPoint]:
+    """ Retrieve the top-k closest vectors without any constraint, to be filtered locally once they are known. """
+    logger.debug("Retrieving unfiltered top-k vectors from vector database...", extra={"stage": "retrieve_unfiltered"})
+    with track_stage("retrieve_unfiltered"):
+        return await get_top_k_from_media_async(
+            vector=embedded_query.vector, k=k, vdb_filter=None, with_vectors=True, search_params=search_params,
+        )
+
+
+async def retrieve_top_k_batch_async(
+        embedded_queries: List[EmbeddedRecommenderQuery],
+        processed_queries: List[ProcessedRecommenderQuery],
+        k: int,
+        required_tags: Optional[List[List[str]]] = None,
+        hybrid: bool = False,
+        search_params: Optional[SearchParams] = None,
+) -> List[List[ScoredPoint]]:
+    """ Retrieve the top-k closest vectors of several queries with batched vector database requests. """
+    if required_tags is None:
+        required_tags = [None] * len(processed_queries)
+    logger.debug(
+        "Retrieving top-k vectors of %d queries from vector database...", len(embedded_queries),
+        extra={"stage": "retrieve_top_k_batch"},
+    )
+    with track_stage("retrieve_top_k_batch"):
+        return await get_top_k_batch_from_media_async(
+            vectors=[embedded_query.vector for embedded_query in embedded_queries],
+            k=k,
+            vdb_filters=[
+                build_filter_from_constraints(query.hard_constraints, tags)
+                for query, tags in zip(processed_queries, required_tags)
+            ],
+            with_vectors=True,
+            sparse_vectors=[encode_query(build_embedding_text(query)) for query in processed_queries] if hybrid else None,
+            search_params=search_params,
+        )
 
 
-def retrieve_media(media_ids: List[int]) -> List[Media]:
-    print("Retrieving media from database...")
+MEDIA_RECORD_COLUMNS = (
+    Media.media_id, Media.title, Media.type, Media.external_url, Media.image_url, Media.status, Media.score
+)
+
+
+def get_media_catalog_version():
+    return get_catalog_versions().get(MEDIA_CATALOG)
+
+
+# Recommendations favor a small set of titles, so their records are kept in memory until the next ingestion
+media_cache = TTLCache(
+    name="media",
+    max_size=MEDIA_CACHE_MAX_SIZE,
+    version_provider=get_media_catalog_version,
+)
+
+
+def convert_media_row(row) -> MediaRecord:
+    return MediaRecord(
+        media_id=row.media_id,
+        title=row.title,
+        type=row.type.value,
+        external_url=row.external_url,
+        image_url=row.image_url,
+        status=row.status.value if row.status is not None else None,
+        score=row.score,
+    )
+
+
+def get_cached_media(media_ids: List[int]) -> Tuple[Dict[int, MediaRecord], List[int]]:
+    """ Return the cached media records, and the ids of the media that are not cached. """
+    media_by_id = {}
+    missing_media_ids = []
+    for media_id in dict.fromkeys(media_ids):
+        record = media_cache.get(media_id)
+        if record is None:
+            missing_media_ids.append(media_id)
+        else:
+            media_by_id[media_id] = record
+    return media_by_id, missing_media_ids
+
+
+def cache_media_rows(rows, media_by_id: Dict[int, MediaRecord]):
+    for row in rows:
+        record = convert_media_row(row)
+        media_cache.set(record.media_id, record)
+        media_by_id[record.media_id] = record
+
+
+def retrieve_media(media_ids: List[int]) -> List[MediaRecord]:
+    """ Return the media records with the given ids, in the same order. Only uncached media are read from the database. """
+    logger.debug("Retrieving media from database...", extra={"stage": "retrieve_media"})
     if not media_ids:
         return []
 
-    with SessionLocal() as db_client:
-        query = select(Media).where(Media.media_id.in_(media_ids))
-        results = db_client.execute(query).scalars().all()  # scalars() returns single elements instead of row objects
-        print(f"Retrieved media: {results}")
+    with track_stage("retrieve_media"):
+        media_by_id, missing_media_ids = get_cached_media(media_ids)
+        if missing_media_ids:
+            with SessionLocal() as db_client:
+                query = select(*MEDIA_RECORD_COLUMNS).where(Media.media_id.in_(missing_media_ids))
+                with track_dependency("postgres", "select_media"):
+                    rows = db_client.execute(query).all()
+            cache_media_rows(rows, media_by_id)
+
+        results = [media_by_id[media_id] for media_id in media_ids if media_id in media_by_id]
+        logger.debug("Retrieved media: %s", results, extra={"stage": "retrieve_media"})
         return results
+
+
+async def retrieve_media_async(media_ids: List[int]) -> List[MediaRecord]:
+    """ Non-blocking version of retrieve_media. """
+    logger.debug("Retrieving media from database...", extra={"stage": "retrieve_media"})
+    if not media_ids:
+        return []
+
+    with track_stage("retrieve_media"):
+        media_by_id, missing_media_ids = get_cached_media(media_ids)
+        if missing_media_ids:
+            async with AsyncSessionLocal() as db_client:
+                query = select(*MEDIA_RECORD_COLUMNS).where(Media.media_id.in_(missing_media_ids))
+                with track_dependency("postgres", "select_media"):
+                    rows = (await db_client.execute(query)).all()
+            cache_media_rows(rows, media_by_id)
+
+        results = [media_by_id[media_id] for media_id in media_ids if media_id in media_by_id]
+        logger.debug("Retrieved media: %s", results, extra={"stage": "retrieve_media"})
+        return results
+
+
+# --- Local filtering ---
+
+def parse_payload_datetime(value) -> Optional[datetime]:
+    """ Parse a date stored in a payload, as a naive UTC datetime like the bounds of the constraints. """
+    if value is None:
+        return None
+    try:
+        parsed = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def matches_constraints(
+        payload: Optional[dict],
+        constraints: RecommenderQueryHardConstraints,
+        required_tags: Optional[List[str]] = None,
+) -> bool:
+    """
+    Whether a point satisfies the hard constraints, with the same semantics as the filter built by
+    build_filter_from_constraints: every range must match, no excluded value may match, at least one of the
+    included types or statuses must match, and at least one of the required tags must be present.
+    """
+    payload = payload or {}
+
+    score_min = constraints.score_range.min
+    score_max = constraints.score_range.max
+    if score_min is not None or score_max is not None:
+        score = payload.get("score")
+        if score is None:
+            return False
+        if (score_min is not None and score < score_min) or (score_max is not None and score > score_max):
+            return False
+
+    date_start = constraints.date_range.start
+    date_end = constraints.date_range.end
+    if date_start is not None or date_end is not None:
+        start_date = parse_payload_datetime(payload.get("start_date"))
+        if start_date is None:
+            return False
+        if (date_start is not None and start_date < date_start) or (date_end is not None and start_date > date_end):
+            return False
+
+    if payload.get("type") in {t.value for t in constraints.type.excluded_types}:
+        return False
+    if payload.get("status") in {s.value for s in constraints.status.excluded_statuses}:
+        return False
+
+    should = [("type", t.value) for t in constraints.type.included_types]
+    should += [("status", s.value) for s in constraints.status.included_statuses]
+    if should and not any(payload.get(key) == value for key, value in should):
+        return False
+
+    if required_tags and not set(required_tags).intersection(payload.get("content_descriptors") or []):
+        return False
+
+    return True
+
+
+def filter_candidates(
+        points: List[ScoredPoint],
+        constraints: RecommenderQueryHardConstraints,
+        required_tags: Optional[List[str]] = None,
+) -> List[ScoredPoint]:
+    """ Keep the points that satisfy the hard constraints, in their original order. """
+    return [point for point in points if matches_constraints(point.payload, constraints, required_tags)]
+
+
+# --- Hydration ---
+
+PAYLOAD_MEDIA_FIELDS = ("title", "type", "external_url", "image_url", "status", "score", "indexed_at")
+
+
+def is_payload_fresh(payload: Optional[dict], media_updated_at: float) -> bool:
+    """
+    A payload can replace the database row if it holds every field of a response and was indexed after the last
+    ingestion of its media, otherwise the row may have changed since.
+    """
+    if not payload or any(field not in payload for field in PAYLOAD_MEDIA_FIELDS):
+        return False
+    return payload["indexed_at"] >= media_updated_at
+
+
+def convert_payload(media_id: int, payload: dict) -> MediaRecord:
+    return MediaRecord(
+        media_id=media_id,
+        title=payload["title"],
+        type=payload["type"],
+        external_url=payload["external_url"],
+        image_url=payload["image_url"],
+        status=payload["status"],
+        score=payload["score"],
+    )
+
+
+def get_media_from_payloads(
+        points: List[ScoredPoint],
+        media_ids: List[int],
+) -> Tuple[Dict[int, MediaRecord], List[int]]:
+    """ Build media from the payloads of the points that are fresh, and return the ids of the stale ones. """
+    media_update_times = get_media_update_times()
+    payloads = {point.id: point.payload for point in points}
+
+    media_by_id = {}
+    stale_media_ids = []
+    for media_id in media_ids:
+        payload = payloads.get(media_id)
+        if is_payload_fresh(payload, media_update_times.get(media_id, 0.0)):
+            media_by_id[media_id] = convert_payload(media_id, payload)
+        else:
+            stale_media_ids.append(media_id)
+
+    return media_by_id, stale_media_ids
+
+
+def hydrate_media(points: List[ScoredPoint], media_ids: List[int], hydration: str) -> List[MediaRecord]:
+    """
+    Return the selected media, in the order of media_ids. With the "payload" hydration mode, media are built from the
+    vector database payloads and the database is only queried for stale payloads.
+    """
+    if hydration == "payload":
+        media_by_id, stale_media_ids = get_media_from_payloads(points, media_ids)
+    else:
+        media_by_id, stale_media_ids = {}, media_ids
+
+    if stale_media_ids:
+        media_by_id.update({media.media_id: media for media in retrieve_media(media_ids=stale_media_ids)})
+    return [media_by_id[media_id] for media_id in media_ids if media_id in media_by_id]
+
+
+async def hydrate_media_async(
+        points: List[ScoredPoint],
+        media_ids: List[int],
+        hydration: str
+) -> List[MediaRecord]:
+    """ Non-blocking version of hydrate_media. """
+    if hydration == "payload":
+        media_by_id, stale_media_ids = get_media_from_payloads(points, media_ids)
+    else:
+        media_by_id, stale_media_ids = {}, media_ids
+
+    if stale_media_ids:
+        media_by_id.update({media.media_id: media for media in await retrieve_media_async(media_ids=stale_media_ids)})
+    return [media_by_id[media_id] for media_id in media_ids if media_id in media_by_id]
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+
+from app.monitoring.metrics import COALESCED_CALLS
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that compute the same value.
+
+    The first caller for a key (the leader) runs the computation, and every caller that arrives while it is still in
+    flight waits for the leader's result instead of starting its own computation. The shared result is held in a
+    thread-safe future, so blocking callers (threads) and async callers (coroutines) can wait on each other.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable) -> tuple[Future, bool]:
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                COALESCED_CALLS.labels(self.name, "coalesced").inc()
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.leaders += 1
+            COALESCED_CALLS.labels(self.name, "leader").inc()
+            return future, True
+
+    def _leave(self, key: Hashable):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """ Run fn, or wait for the in-flight call with the same key to complete. """
+        future, is_leader = self._join(key)
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave(key)
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Async version of do: await fn(), or the in-flight call with the same key.
+
+        fn() runs in its own task, which the leader awaits through a shield: if the leader is cancelled (e.g. its client
+        disconnected), the computation carries on for the callers waiting on it.
+        """
+        future, is_leader = self._join(key)
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+
+        task = asyncio.ensure_future(fn())
+        self._tasks.add(task)  # the event loop only keeps weak references to tasks
+
+        def settle(done: asyncio.Task):
+            self._tasks.discard(done)
+            self._leave(key)
+            if done.cancelled():
+                future.set_exception(asyncio.CancelledError())
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+
+        task.add_done_callback(settle)
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._in_flight),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,85 @@
+import json
+import os
+import time
+from typing import Dict, Iterable
+
+# The API and the CLI run in different processes, so catalog changes are signalled through a small shared file
+CATALOG_VERSION_FILE = os.getenv("CATALOG_VERSION_FILE", "catalog_version.json")
+
+MEDIA_CATALOG = "media"       # Media rows in the database (ingestion)
+VECTOR_CATALOG = "vectors"    # Points in the vector database (vector database initialization)
+
+# Media updated by ingestion since their points were last indexed, so that only their payloads are distrusted
+MEDIA_UPDATES_FILE = os.getenv("MEDIA_UPDATES_FILE", "media_updates.json")
+
+_versions_cache = {"mtime_ns": None, "versions": {}}
+_media_updates_cache = {"mtime_ns": None, "updates": {}}
+
+
+def get_catalog_version() -> int:
+    """ Return an opaque version that changes every time any part of the catalog is updated. """
+    try:
+        return os.stat(CATALOG_VERSION_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def get_catalog_versions() -> Dict[str, float]:
+    """ Return the last update time (UNIX timestamp) of each part of the catalog. """
+    mtime_ns = get_catalog_version()
+    if mtime_ns != _versions_cache["mtime_ns"]:
+        try:
+            with open(CATALOG_VERSION_FILE, "r", encoding="utf-8") as f:
+                versions = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            versions = {}
+        _versions_cache.update(mtime_ns=mtime_ns, versions=versions)
+    return dict(_versions_cache["versions"])
+
+
+def mark_catalog_updated(catalog: str) -> None:
+    """ Signal that a part of the catalog changed, so that caches built on top of it are invalidated. """
+    versions = get_catalog_versions()
+    versions[catalog] = time.time()
+
+    _write_json(CATALOG_VERSION_FILE, versions)
+
+
+def get_media_update_times() -> Dict[int, float]:
+    """ Return the last ingestion time (UNIX timestamp) of the media updated since they were last indexed. """
+    try:
+        mtime_ns = os.stat(MEDIA_UPDATES_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = 0
+    if mtime_ns != _media_updates_cache["mtime_ns"]:
+        try:
+            with open(MEDIA_UPDATES_FILE, "r", encoding="utf-8") as f:
+                updates = {int(media_id): updated_at for media_id, updated_at in json.load(f).items()}
+        except (FileNotFoundError, json.JSONDecodeError):
+            updates = {}
+        _media_updates_cache.update(mtime_ns=mtime_ns, updates=updates)
+    return _media_updates_cache["updates"]
+
+
+def mark_media_updated(media_ids: Iterable[int]) -> None:
+    """ Signal that the rows of these media changed, so that their indexed payloads are not trusted any more. """
+    updates = dict(get_media_update_times())
+    now = time.time()
+    updates.update((media_id, now) for media_id in media_ids)
+    _write_json(MEDIA_UPDATES_FILE, updates)
+
+
+def clear_media_updates(indexed_since: float) -> None:
+    """ Forget the updates made before an indexing run started, once it indexed every media again. """
+    updates = get_media_update_times()
+    remaining = {media_id: updated_at for media_id, updated_at in updates.items() if updated_at >= indexed_since}
+    if len(remaining) != len(updates):
+        _write_json(MEDIA_UPDATES_FILE, remaining)
+
+
+def _write_json(path: str, data: dict) -> None:
+    # Write to a temporary file first so that readers never see a partially written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
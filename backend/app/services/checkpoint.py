@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Iterable, Set, Union
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "checkpoints")
+COMPACT_EVERY_N_LINES = 1000
+
+ItemId = Union[int, str]
+
+
+class CheckpointLog:
+    """
+    Append-only log of the ids of the items a long job has committed, to resume it after a crash.
+
+    Each committed batch appends one line (the JSON list of its ids) and is flushed to disk, so checkpointing costs the
+    size of the batch rather than of the whole run. A line torn by a crash is ignored when the log is read. Once the
+    log reaches compact_every lines, it is rewritten as a single line.
+    """
+
+    def __init__(self, path: Union[str, Path], compact_every: int = COMPACT_EVERY_N_LINES):
+        self.path = Path(path)
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._n_lines = None
+        self._torn = False  # the last line was cut by a crash and lacks its newline
+
+    def load(self) -> Set[ItemId]:
+        """ Return the ids committed so far. """
+        with self._lock:
+            ids, self._n_lines = self._read()
+            return ids
+
+    def append(self, ids: Iterable[ItemId]) -> None:
+        """ Record the ids of a committed batch. """
+        line = json.dumps(list(ids), separators=(",", ":"))
+        with self._lock:
+            if self._n_lines is None:
+                _, self._n_lines = self._read()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(("\n" if self._torn else "") + line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._torn = False
+            self._n_lines += 1
+            if self._n_lines >= self.compact_every:
+                self._compact()
+
+    def clear(self) -> None:
+        """ Forget every id, once the job completed. """
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+            self._n_lines, self._torn = 0, False
+
+    def _read(self):
+        ids, n_lines = set(), 0
+        self._torn = False
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    self._torn = not line.endswith("\n")
+                    try:
+                        ids.update(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # torn last line of a crashed run, its batch is redone
+                    n_lines += 1
+        except FileNotFoundError:
+            pass
+        return ids, n_lines
+
+    def _compact(self) -> None:
+        ids, _ = self._read()
+        # Write to a temporary file first so that a crash never loses the committed ids
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.write(json.dumps(sorted(ids, key=str), separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._n_lines = 1
+
+
+def get_checkpoint(job: str, *scope) -> CheckpointLog:
+    """
+    Return the checkpoint log of a job, scoped by anything its progress depends on (e.g. a collection and an embedding
+    model), so that runs with a different scope never skip each other's items.
+    """
+    name = "-".join(re.sub(r"[^\w.]+", "_", str(part)) for part in (job, *scope))
+    return CheckpointLog(Path(CHECKPOINT_DIR) / f"{name}.log")
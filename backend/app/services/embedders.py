@@ -0,0 +1,157 @@
+import math
+import os
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.clients.openai_client import openai_client, MAXIMUM_EMBEDDING_REQUESTS_PER_MINUTE
+from app.services.openai_service import request_embeddings
+from common.config.recommender.recommender_config import get_recommender_config
+
+ONNX_PREFIX = "onnx:"
+HASHING_PREFIX = "hashing"
+
+
+class Embedder(ABC):
+    """
+    Backend that turns texts into vectors.
+
+    The class attributes tune how query embeddings are micro-batched (see EmbeddingMicroBatcher) and whether vectors
+    are kept in the embedding store, since network, CPU and trivial backends need very different settings.
+    """
+    batch_window_ms: Optional[float] = 10       # None embeds queries inline, without micro-batching
+    max_batch_size: int = 64                    # texts per request (or forward pass)
+    max_requests_per_minute: Optional[int] = None
+    max_concurrent_requests: int = 1
+    store_embeddings: bool = True               # worth it when computing a vector costs more than reading it
+
+    @abstractmethod
+    def embed_texts(self, texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+        """ Embed texts in one request (or forward pass). """
+
+    def embed_many(self, texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+        """ Embed any number of texts, in batches of max_batch_size. """
+        embeddings = []
+        for start in range(0, len(texts), self.max_batch_size):
+            embeddings.extend(self.embed_texts(texts[start:start + self.max_batch_size], model, dimensions))
+        return embeddings
+
+
+class OpenAIEmbedder(Embedder):
+    """ OpenAI embeddings API: requests are slow and rate limited, so they are batched and several are kept in flight. """
+    max_requests_per_minute = MAXIMUM_EMBEDDING_REQUESTS_PER_MINUTE
+    max_concurrent_requests = 4
+
+    def __init__(self, batch_window_ms: float = 10, max_batch_size: int = 64):
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_size = max_batch_size
+
+    def embed_texts(self, texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+        return openai_client.get_embeddings(texts=texts, model=model, dimensions=dimensions)
+
+    def embed_many(self, texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+        return request_embeddings(texts, model, dimensions)  # packs texts by token count
+
+
+class OnnxEmbedder(Embedder):
+    """
+    Sentence embedding model run in-process on the CPU with ONNX Runtime. The model directory holds model.onnx (a
+    transformer exported with input_ids / attention_mask inputs) and the tokenizer.json of its tokenizer.
+
+    A forward pass already uses every core, so batches are sent one at a time, after a short window.
+    """
+    batch_window_ms = 2
+    max_batch_size = 32
+    max_concurrent_requests = 1
+
+    def __init__(self, model_dir: str, num_threads: Optional[int] = None):
+        try:
+            import numpy as np
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx embedder needs the onnxruntime and tokenizers packages") from e
+
+        model_dir = Path(model_dir)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        self._np = np
+        self._session = onnxruntime.InferenceSession(
+            str(model_dir / "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+        self._tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self._tokenizer.enable_padding()
+        self._tokenizer.enable_truncation(max_length=512)
+
+    def embed_texts(self, texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+        np = self._np
+        encodings = self._tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.asarray([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.asarray([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.asarray([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        inputs = {name: value for name, value in inputs.items() if name in self._input_names}
+        token_embeddings = self._session.run(None, inputs)[0]
+
+        # Mean pooling over the tokens of each text, then truncation to the requested dimensions (Matryoshka style)
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if dimensions > embeddings.shape[1]:
+            raise ValueError(f"The model produces {embeddings.shape[1]} dimensions, {dimensions} were requested")
+        embeddings = embeddings[:, :dimensions]
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings.tolist()
+
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic feature hashing of words and word bigrams, for tests and benchmarks: no network, no model, and texts
+    sharing words get similar vectors. Embedding is cheaper than a batcher round trip or a store lookup.
+    """
+    batch_window_ms = None
+    max_batch_size = 1024
+    store_embeddings = False
+
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def embed_text(self, text: str, dimensions: int) -> List[float]:
+        words = self.TOKEN_PATTERN.findall(text.lower())
+        vector = [0.0] * dimensions
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % dimensions] += 1.0 if h & 0x80000000 else -1.0  # the sign bit spreads collisions
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed_texts(self, texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+        return [self.embed_text(text, dimensions) for text in texts]
+
+
+_embedders: Dict[str, Embedder] = {}
+_embedders_lock = threading.Lock()
+
+
+def create_embedder(model: str) -> Embedder:
+    if model.startswith(ONNX_PREFIX):
+        return OnnxEmbedder(model[len(ONNX_PREFIX):])
+    if model.startswith(HASHING_PREFIX):
+        return HashingEmbedder()
+
+    cfg = get_recommender_config()
+    return OpenAIEmbedder(batch_window_ms=cfg.embedding_batch_window_ms, max_batch_size=cfg.embedding_batch_max_size)
+
+
+def get_embedder(model: str) -> Embedder:
+    """
+    Return the backend of an embedding model, created on first use:
+    "onnx:<model directory>" runs a local model on the CPU, "hashing" hashes words, anything else is an OpenAI model.
+    """
+    with _embedders_lock:
+        if model not in _embedders:
+            _embedders[model] = create_embedder(model)
+        return _embedders[model]
@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.clients.openai_client import MAXIMUM_EMBEDDING_REQUESTS_PER_MINUTE
+from app.services.embedders import Embedder
+
+EmbedTexts = Callable[[List[str], str, int], List[List[float]]]
+
+
+@dataclass
+class PendingEmbedding:
+    text: str
+    model: str
+    dimensions: int
+    future: Future
+
+
+class EmbeddingMicroBatcher:
+    """
+    Collect texts submitted by concurrent callers and embed them together in a single request.
+
+    A batch is sent once it holds max_batch_size texts, or window_ms after its first text arrived. Requests are spaced
+    to stay under max_requests_per_minute: while a batch waits for the next request slot, it keeps collecting texts,
+    so batches grow with the load instead of the number of requests.
+    """
+
+    def __init__(
+            self,
+            embed_texts: EmbedTexts,
+            window_ms: float = 10,
+            max_batch_size: int = 64,
+            max_requests_per_minute: Optional[int] = MAXIMUM_EMBEDDING_REQUESTS_PER_MINUTE,
+            max_concurrent_requests: int = 4,
+    ):
+        self.embed_texts = embed_texts
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.min_request_interval = 60 / max_requests_per_minute if max_requests_per_minute else 0.0
+        self.requests_sent = 0
+        self.texts_embedded = 0
+        self._queue: "queue.Queue[PendingEmbedding]" = queue.Queue()
+        self._next_request_time = 0.0
+        self._executor = ThreadPoolExecutor(max_concurrent_requests, thread_name_prefix="embedding-batcher")
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str, model: str, dimensions: int) -> Future:
+        """ Queue a text to embed, and return a future that resolves to its embedding. """
+        self._ensure_started()
+        future = Future()
+        self._queue.put(PendingEmbedding(text=text, model=model, dimensions=dimensions, future=future))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = max(time.monotonic() + self.window, self._next_request_time)
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # Drain whatever else is already waiting, up to the batch size
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._send(batch)
+
+    def _wait_for_request_slot(self):
+        wait = self._next_request_time - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._next_request_time = time.monotonic() + self.min_request_interval
+
+    def _send(self, batch: List[PendingEmbedding]):
+        groups: Dict[Tuple[str, int], List[PendingEmbedding]] = {}
+        for pending in batch:
+            groups.setdefault((pending.model, pending.dimensions), []).append(pending)
+
+        for (model, dimensions), pending_embeddings in groups.items():
+            self._wait_for_request_slot()
+            self.requests_sent += 1
+            self.texts_embedded += len(pending_embeddings)
+            self._executor.submit(self._embed_group, pending_embeddings, model, dimensions)
+
+    def _embed_group(self, pending_embeddings: List[PendingEmbedding], model: str, dimensions: int):
+        unique_texts = list(dict.fromkeys(pending.text for pending in pending_embeddings))
+        try:
+            vectors = dict(zip(unique_texts, self.embed_texts(unique_texts, model, dimensions)))
+        except Exception as e:
+            for pending in pending_embeddings:
+                pending.future.set_exception(e)
+            return
+
+        for pending in pending_embeddings:
+            pending.future.set_result(vectors[pending.text])
+
+    def stats(self) -> dict:
+        return {
+            "requests_sent": self.requests_sent,
+            "texts_embedded": self.texts_embedded,
+            "average_batch_size": self.texts_embedded / self.requests_sent if self.requests_sent else 0.0,
+        }
+
+
+_query_embedding_batchers: Dict[str, EmbeddingMicroBatcher] = {}
+_query_embedding_batchers_lock = threading.Lock()
+
+
+def get_query_embedding_batcher(model: str, embedder: Embedder) -> EmbeddingMicroBatcher:
+    """ Return the batcher shared by all query embeddings of a model, created on first use with its backend's tuning. """
+    with _query_embedding_batchers_lock:
+        if model not in _query_embedding_batchers:
+            _query_embedding_batchers[model] = EmbeddingMicroBatcher(
+                embed_texts=embedder.embed_texts,
+                window_ms=embedder.batch_window_ms or 0,
+                max_batch_size=embedder.max_batch_size,
+                max_requests_per_minute=embedder.max_requests_per_minute,
+                max_concurrent_requests=embedder.max_concurrent_requests,
+            )
+        return _query_embedding_batchers[model]
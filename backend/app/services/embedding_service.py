@@ -0,0 +1,69 @@
+import asyncio
+from typing import List
+
+from app.services.embedders import get_embedder
+from app.services.embedding_batcher import get_query_embedding_batcher
+from app.services.embedding_store import get_embedding_store
+
+
+def get_embedding(text: str, model, dimensions) -> List[float]:
+    """ Embed a single text with the backend of the model. Concurrent calls are micro-batched into shared requests. """
+    embedder = get_embedder(model)
+    if not embedder.store_embeddings:
+        return embedder.embed_texts([text], model, dimensions)[0]
+
+    store = get_embedding_store()
+    stored_embedding = store.get(text, model, dimensions)
+    if stored_embedding is not None:
+        return stored_embedding
+
+    if embedder.batch_window_ms is None:
+        response = embedder.embed_texts([text], model, dimensions)[0]
+    else:
+        response = get_query_embedding_batcher(model, embedder).submit(text=text, model=model, dimensions=dimensions).result()
+    store.put(text, response, model, dimensions)
+    return response
+
+
+async def get_embedding_async(text: str, model, dimensions) -> List[float]:
+    """ Non-blocking version of get_embedding. """
+    embedder = get_embedder(model)
+    if not embedder.store_embeddings:
+        response = await asyncio.to_thread(embedder.embed_texts, [text], model, dimensions)
+        return response[0]
+
+    # The store does SQLite I/O, kept off the event loop
+    store = get_embedding_store()
+    stored_embedding = await asyncio.to_thread(store.get, text, model, dimensions)
+    if stored_embedding is not None:
+        return stored_embedding
+
+    if embedder.batch_window_ms is None:
+        response = await asyncio.to_thread(embedder.embed_texts, [text], model, dimensions)
+        response = response[0]
+    else:
+        future = get_query_embedding_batcher(model, embedder).submit(text=text, model=model, dimensions=dimensions)
+        response = await asyncio.wrap_future(future)
+    await asyncio.to_thread(store.put, text, response, model, dimensions)
+    return response
+
+
+def get_embeddings(texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+    """
+    Embed a list of texts with the backend of the model. Embeddings already in the embedding store are reused, and
+    duplicate texts are only embedded once.
+    """
+    embedder = get_embedder(model)
+    if not embedder.store_embeddings:
+        return embedder.embed_many(texts, model, dimensions)
+
+    store = get_embedding_store()
+    unique_texts = list(dict.fromkeys(texts))  # keeps the order of first occurrence
+    embeddings = store.get_many(unique_texts, model, dimensions)
+    missing_texts = [text for text in unique_texts if text not in embeddings]
+
+    new_embeddings = dict(zip(missing_texts, embedder.embed_many(missing_texts, model, dimensions)))
+    store.put_many(new_embeddings, model, dimensions)
+    embeddings.update(new_embeddings)
+
+    return [embeddings[text] for text in texts]
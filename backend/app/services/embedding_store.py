@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from app.monitoring.metrics import record_cache_lookup
+
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "embedding_store.sqlite3")
+EMBEDDING_STORE_MAX_ENTRIES = int(os.getenv("EMBEDDING_STORE_MAX_ENTRIES", 500_000))
+
+SQLITE_MAX_VARIABLES = 900  # stay below SQLite's limit on the number of parameters of a single statement
+TOUCH_FLUSH_SIZE = 1000  # pending last_used updates written at once by a read
+
+
+def make_embedding_key(text: str, model: str, dimensions: int) -> str:
+    """ Content address of an embedding: the same text embedded with the same model always has the same key. """
+    return hashlib.sha256(f"{model}\x00{dimensions}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Disk-backed embedding store keyed by the hash of (model, dimensions, text).
+
+    Vectors are stored as float32 blobs in SQLite, which can be shared by the API and the CLI.
+    When the store grows beyond max_entries, the least recently used embeddings are evicted. Reads do not write the
+    last use time of the embeddings they hit: it is kept in memory and written with the next write, before an eviction,
+    or once touch_flush_size embeddings are pending.
+    """
+
+    def __init__(
+            self, path: str, max_entries: int = EMBEDDING_STORE_MAX_ENTRIES, touch_flush_size: int = TOUCH_FLUSH_SIZE,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_flush_size = touch_flush_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending_touches: Dict[str, float] = {}  # key -> last use time not written yet
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        self._count = self._count_entries()
+
+    def get_many(self, texts: Iterable[str], model: str, dimensions: int) -> Dict[str, List[float]]:
+        """ Return the stored embeddings of the given texts, keyed by text. Texts that are not stored are omitted. """
+        keys = {make_embedding_key(text, model, dimensions): text for text in texts}
+        found = {}
+        with self._lock:
+            key_list = list(keys)
+            for start in range(0, len(key_list), SQLITE_MAX_VARIABLES):
+                chunk = key_list[start:start + SQLITE_MAX_VARIABLES]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                now = time.time()
+                for key, blob in rows:
+                    found[keys[key]] = array("f", blob).tolist()
+                    self._pending_touches[key] = now
+
+            if len(self._pending_touches) >= self.touch_flush_size:
+                self._flush_touches()
+                self._connection.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        record_cache_lookup("embedding_store", hit=True, count=len(found))
+        record_cache_lookup("embedding_store", hit=False, count=len(keys) - len(found))
+        return found
+
+    def get(self, text: str, model: str, dimensions: int) -> Optional[List[float]]:
+        return self.get_many([text], model, dimensions).get(text)
+
+    def put_many(self, embeddings: Dict[str, List[float]], model: str, dimensions: int) -> None:
+        if not embeddings:
+            return
+        now = time.time()
+        rows = [
+            (make_embedding_key(text, model, dimensions), array("f", vector).tobytes(), now)
+            for text, vector in embeddings.items()
+        ]
+        with self._lock:
+            self._flush_touches()
+            cursor = self._connection.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._count += max(cursor.rowcount, 0)
+            if self._count > self.max_entries:
+                self._evict()
+            self._connection.commit()
+
+    def put(self, text: str, vector: List[float], model: str, dimensions: int) -> None:
+        self.put_many({text: vector}, model, dimensions)
+
+    def _flush_touches(self):
+        if self._pending_touches:
+            self._connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._pending_touches.items()],
+            )
+            self._pending_touches.clear()
+
+    def _count_entries(self) -> int:
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return count
+
+    def _evict(self):
+        # The running count is approximate when several processes share the store, so recount before evicting
+        excess = self._count_entries() - self.max_entries
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+        self._count = self._count_entries()
+
+    def __len__(self):
+        with self._lock:
+            return self._count_entries()
+
+    def stats(self, since: Optional[dict] = None) -> dict:
+        """ Hits and misses of the process, or only those since a previous stats() snapshot. """
+        hits = self.hits - (since["hits"] if since else 0)
+        misses = self.misses - (since["misses"] if since else 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+_embedding_store: Optional[EmbeddingStore] = None
+_embedding_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """ Return the shared embedding store, opening it on first use. """
+    global _embedding_store
+    with _embedding_store_lock:
+        if _embedding_store is None:
+            _embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH)
+        return _embedding_store
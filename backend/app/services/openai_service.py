@@ -5,7 +5,7 @@ from typing import List
 import tiktoken
 from tqdm import tqdm
 
-from app.clients.openai_client import openai_client
+from app.clients.openai_client import openai_client, async_openai_client
 
 
 class QueryValidationError(Exception):
@@ -41,16 +41,11 @@ def get_openai_response(query: str):
         return make_message(response.output_text)
 
 
-def get_embedding(text: str, model, dimensions) -> List[float]:
-    response = openai_client.get_embedding(
-        text=text,
-        model=model,
-        dimensions=dimensions,
-    )
-    return response
+def request_embeddings(texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+    """ Embed texts with the API, packing them into batches that stay under the token limit of a request. """
+    if not texts:
+        return []
 
-
-def get_embeddings(texts: List[str], model: str, dimensions: int) -> List[List[float]]:
     max_tokens_per_batch = 8192
     tokenizer = tiktoken.encoding_for_model(model)
 
@@ -124,17 +119,35 @@ def sanitize_llm_query(query: str) -> str:
     return query
 
 
+def parse_processed_recommender_query(response: str) -> dict:
+    """ Parse the JSON returned by the query processing prompt. """
+    try:
+        return json.loads(response.strip())
+    except json.JSONDecodeError as e:
+        raise LLMResponseError(f"Failed to parse JSON from LLM response: {response}. Exception: {e}")
+
+
 def get_processed_recommender_query(user_query, reusable_prompt_id):
     try:
         clean_query = sanitize_llm_query(user_query)
-        reusable_prompt_id = reusable_prompt_id
         response = openai_client.get_response_from_prompt_id(user_input=clean_query, prompt_id=reusable_prompt_id)
+        return parse_processed_recommender_query(response)
+
+    except (QueryValidationError, LLMResponseError) as e:
+        return f"Error while processing user query: {str(e)}"
+    except Exception as e:
+        # Catch-all to avoid unhandled server errors
+        return f"Unexpected error: {str(e)}"
+
 
-        try:
-            response_dict = json.loads(response.strip())
-            return response_dict
-        except json.JSONDecodeError as e:
-            raise LLMResponseError(f"Failed to parse JSON from LLM response: {response}. Exception: {e}")
+async def get_processed_recommender_query_async(user_query, reusable_prompt_id):
+    try:
+        clean_query = sanitize_llm_query(user_query)
+        response = await async_openai_client.get_response_from_prompt_id(
+            user_input=clean_query,
+            prompt_id=reusable_prompt_id
+        )
+        return parse_processed_recommender_query(response)
 
     except (QueryValidationError, LLMResponseError) as e:
         return f"Error while processing user query: {str(e)}"
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.services.openai_service import sanitize_llm_query, QueryValidationError, QueryTooLongError
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "query_log.sqlite3")
+QUERY_LOG_RETENTION_SECONDS = 30 * 24 * 3600
+QUERY_LOG_FLUSH_SECONDS = 10
+
+
+def normalize_query(user_query: str) -> Optional[str]:
+    """ Form under which near-identical queries are counted and prewarmed together, None if the query is invalid. """
+    try:
+        return sanitize_llm_query(user_query).lower().rstrip(" .!?")
+    except (QueryValidationError, QueryTooLongError):
+        return None
+
+
+@dataclass
+class PrewarmedQuery:
+    query: str                  # normalized query
+    processed_query: dict       # ProcessedRecommenderQuery, as JSON
+    embedding_text: str
+    vector: List[float]
+
+
+class QueryLog:
+    """
+    Count of each normalized user query, and the prewarmed processing of the most frequent ones, in SQLite so that
+    the API (which logs queries) and the CLI (which prewarms them) can share it.
+
+    Queries are logged on the request path, so record only counts them in memory: the counts are written in one
+    transaction by flush, which the API calls periodically and readers of the counts call first.
+
+    Prewarmed queries are stored per prompt, embedder and dimensions, since their processing depends on all three.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending: Dict[str, Tuple[int, float]] = {}  # query -> (count, last seen) not written yet
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, count INTEGER NOT NULL, last_seen REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS prewarmed_queries ("
+            "prompt_id TEXT NOT NULL, model TEXT NOT NULL, dimensions INTEGER NOT NULL, query TEXT NOT NULL, "
+            "processed_query TEXT NOT NULL, embedding_text TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (prompt_id, model, dimensions, query))"
+        )
+        self._connection.commit()
+
+    def record(self, user_query: str) -> None:
+        """ Count one occurrence of a user query, in memory until the next flush. """
+        query = normalize_query(user_query)
+        if query is None:
+            return
+        with self._pending_lock:
+            count, _ = self._pending.get(query, (0, 0.0))
+            self._pending[query] = (count + 1, time.time())
+
+    def flush(self) -> None:
+        """ Write the counts recorded since the last flush. """
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO queries VALUES (?, ?, ?) "
+                    "ON CONFLICT (query) DO UPDATE SET count = count + excluded.count, last_seen = excluded.last_seen",
+                    [(query, count, last_seen) for query, (count, last_seen) in pending.items()],
+                )
+
+    async def flush_periodically(self, interval_seconds: float = QUERY_LOG_FLUSH_SECONDS):
+        """ Flush the counts every interval_seconds, off the event loop. """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.warning("Could not flush the query log", exc_info=True, extra={"stage": "query_log"})
+
+    def top_queries(self, n: int) -> List[Tuple[str, int]]:
+        """ Return the n most frequent queries with their count. """
+        self.flush()
+        with self._lock:
+            return self._connection.execute(
+                "SELECT query, count FROM queries ORDER BY count DESC, last_seen DESC LIMIT ?", (n,)
+            ).fetchall()
+
+    def prune(self, max_age_seconds: float = QUERY_LOG_RETENTION_SECONDS) -> int:
+        """ Forget the queries not seen for max_age_seconds, so that the counts follow the traffic. """
+        self.flush()
+        with self._lock:
+            cursor = self._connection.execute("DELETE FROM queries WHERE last_seen < ?", (time.time() - max_age_seconds,))
+            self._connection.commit()
+            return cursor.rowcount
+
+    def save_prewarmed(self, entries: List[PrewarmedQuery], prompt_id: str, model: str, dimensions: int) -> None:
+        """ Replace the prewarmed queries of a prompt, embedder and dimensions. """
+        rows = [
+            (prompt_id, model, dimensions, entry.query, json.dumps(entry.processed_query), entry.embedding_text,
+             array("f", entry.vector).tobytes())
+            for entry in entries
+        ]
+        with self._lock:
+            with self._connection:  # one transaction, readers never see a partial table
+                self._connection.execute(
+                    "DELETE FROM prewarmed_queries WHERE prompt_id = ? AND model = ? AND dimensions = ?",
+                    (prompt_id, model, dimensions),
+                )
+                self._connection.executemany("INSERT INTO prewarmed_queries VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def load_prewarmed(self, prompt_id: str, model: str, dimensions: int) -> List[PrewarmedQuery]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT query, processed_query, embedding_text, vector FROM prewarmed_queries "
+                "WHERE prompt_id = ? AND model = ? AND dimensions = ?",
+                (prompt_id, model, dimensions),
+            ).fetchall()
+        return [
+            PrewarmedQuery(
+                query=query, processed_query=json.loads(processed_query), embedding_text=embedding_text,
+                vector=array("f", blob).tolist(),
+            )
+            for query, processed_query, embedding_text, blob in rows
+        ]
+
+
+_query_log: Optional[QueryLog] = None
+_query_log_lock = threading.Lock()
+
+
+def get_query_log() -> QueryLog:
+    """ Return the shared query log, opening it on first use. """
+    global _query_log
+    with _query_log_lock:
+        if _query_log is None:
+            _query_log = QueryLog(QUERY_LOG_PATH)
+        return _query_log
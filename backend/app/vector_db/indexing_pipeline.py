@@ -0,0 +1,193 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, List, Optional, Set
+
+from tqdm import tqdm
+
+from app.services.checkpoint import CheckpointLog
+
+_DONE = object()  # sentinel closing a stage queue, one per consumer
+
+
+@dataclass
+class StageStats:
+    name: str
+    n_items: int = 0
+    busy_seconds: float = 0.0                   # summed over the workers of the stage
+    finished_at: Optional[float] = None         # perf_counter time at which the last item left the stage
+
+    def report(self, started_at: float) -> str:
+        elapsed = (self.finished_at or time.perf_counter()) - started_at
+        rate = self.n_items / elapsed if elapsed > 0 else 0.0
+        return f"{self.name}: {self.n_items} media in {elapsed:.1f}s ({rate:.1f} media/s, {self.busy_seconds:.1f}s busy)"
+
+
+class IndexingPipeline:
+    """
+    Index media in overlapping stages connected by bounded queues, so that reading the database, embedding and upserting
+    into Qdrant run at the same time instead of taking turns:
+
+    - read and pack (one thread): iterate over the media, skip the checkpointed ones and those without text, and group
+      the rest into batches;
+    - embed (n_embedding_workers threads): embed the batches and build their points, several requests in flight;
+    - upsert (n_upload_workers threads): send the points without waiting for Qdrant to index them, then checkpoint.
+
+    Bounded queues keep memory flat: a slow stage blocks the stages before it instead of piling batches up. A batch
+    that fails to embed or upsert is skipped and left out of the checkpoint; any other error (e.g. writing the
+    checkpoint) stops the pipeline: the reader stops, the other workers drain their queue so nothing stays blocked,
+    and run raises the error.
+    """
+
+    def __init__(
+            self,
+            vdb_client,
+            collection_name: str,
+            build_points,
+            has_text,
+            checkpoint: CheckpointLog,
+            processed_ids: Set[int],
+            batch_size: int = 1000,
+            n_embedding_workers: int = 4,
+            n_upload_workers: int = 2,
+            queue_size: int = 4,
+    ):
+        self.vdb_client = vdb_client
+        self.collection_name = collection_name
+        self.build_points = build_points
+        self.has_text = has_text
+        self.checkpoint = checkpoint
+        self.processed_ids = processed_ids
+        self.batch_size = batch_size
+        self.n_embedding_workers = n_embedding_workers
+        self.n_upload_workers = n_upload_workers
+        self.n_failed_batches = 0
+        self.latest_update: Optional[datetime] = None  # most recent updated_at of the media read
+        self.stats = {name: StageStats(name) for name in ("read", "pack", "embed", "upsert")}
+        self._batches = queue.Queue(maxsize=queue_size)
+        self._points = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._aborted = threading.Event()
+        self._progress: Optional[tqdm] = None
+
+    def run(self, media: Iterable) -> int:
+        """ Index the media, return the number of batches that failed (their media are not checkpointed). """
+        started_at = time.perf_counter()
+        self._progress = tqdm(total=len(media) if hasattr(media, "__len__") else None, desc="Initializing media")
+
+        packer = threading.Thread(target=self._pack, args=(media,), name="indexing-pack")
+        embedders = [
+            threading.Thread(target=self._embed, name=f"indexing-embed-{i}") for i in range(self.n_embedding_workers)
+        ]
+        uploaders = [
+            threading.Thread(target=self._upsert, name=f"indexing-upsert-{i}") for i in range(self.n_upload_workers)
+        ]
+        for thread in [packer, *embedders, *uploaders]:
+            thread.start()
+
+        # Each stage is closed once the stage before it is done
+        packer.join()
+        for _ in embedders:
+            self._batches.put(_DONE)
+        for thread in embedders:
+            thread.join()
+        for _ in uploaders:
+            self._points.put(_DONE)
+        for thread in uploaders:
+            thread.join()
+        self._progress.close()
+
+        for stats in self.stats.values():
+            print(stats.report(started_at))
+        if self._error is not None:
+            raise self._error
+        return self.n_failed_batches
+
+    def _record(self, stage: str, n_items: int, busy_seconds: float):
+        with self._lock:
+            stats = self.stats[stage]
+            stats.n_items += n_items
+            stats.busy_seconds += busy_seconds
+            stats.finished_at = time.perf_counter()
+
+    def _abort(self, error: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._aborted.set()
+
+    def _pack(self, media: Iterable):
+        try:
+            iterator = iter(media)
+            batch = []
+            while not self._aborted.is_set():
+                start = time.perf_counter()
+                item = next(iterator, _DONE)
+                self._record("read", 0 if item is _DONE else 1, time.perf_counter() - start)
+                if item is _DONE:
+                    break
+                updated_at = getattr(item, "updated_at", None)
+                if updated_at is not None and (self.latest_update is None or updated_at > self.latest_update):
+                    self.latest_update = updated_at
+
+                start = time.perf_counter()
+                if item.media_id in self.processed_ids or not self.has_text(item):
+                    self._progress.update(1)
+                else:
+                    batch.append(item)
+                self._record("pack", 0, time.perf_counter() - start)
+                if len(batch) >= self.batch_size:
+                    self._put_batch(batch)
+                    batch = []
+            if batch and not self._aborted.is_set():
+                self._put_batch(batch)
+        except BaseException as e:  # surfaced by run, once the queued batches are indexed
+            self._abort(e)
+
+    def _put_batch(self, batch: List):
+        self._record("pack", len(batch), 0.0)
+        self._batches.put(batch)  # blocks while the embedding stage is behind
+
+    def _embed(self):
+        while (batch := self._batches.get()) is not _DONE:
+            if self._aborted.is_set():
+                continue  # drained, so that the reader never blocks on a full queue
+            try:
+                start = time.perf_counter()
+                try:
+                    points = self.build_points(batch)
+                except Exception as e:
+                    print(f"Embedding failed for a batch of {len(batch)} media: {e}")
+                    self._fail(batch)
+                    continue
+                self._record("embed", len(batch), time.perf_counter() - start)
+                self._points.put(points)
+            except BaseException as e:
+                self._abort(e)
+
+    def _upsert(self):
+        while (points := self._points.get()) is not _DONE:
+            if self._aborted.is_set():
+                continue  # drained, so that the embedding workers never block on a full queue
+            try:
+                start = time.perf_counter()
+                try:
+                    # wait=False returns once Qdrant has written the points to its WAL, without waiting for indexing
+                    self.vdb_client.upsert(collection_name=self.collection_name, points=points, wait=False)
+                except Exception as e:
+                    print(f"Upsert failed for a batch of {len(points)} media: {e}")
+                    self._fail(points)
+                    continue
+                self.checkpoint.append(point.id for point in points)
+                self._record("upsert", len(points), time.perf_counter() - start)
+                self._progress.update(len(points))
+            except BaseException as e:
+                self._abort(e)
+
+    def _fail(self, batch: List):
+        with self._lock:
+            self.n_failed_batches += 1
+        self._progress.update(len(batch))
@@ -1,21 +1,30 @@
-import json
-import os
-from typing import List
+import hashlib
+import time
+from typing import List, Dict, Optional
 
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import Distance, VectorParams, PointStruct, SparseVectorParams, Modifier, MultiVectorConfig, \
+    MultiVectorComparator, HnswConfigDiff, ScalarQuantization, ScalarQuantizationConfig, ScalarType, BinaryQuantization, \
+    BinaryQuantizationConfig
 from sqlalchemy.orm import selectinload
-from tqdm import tqdm
 
-from app.db.models import Media, ContentDescriptor
-from app.services.openai_service import get_embeddings
+from app.db.models import ContentDescriptor
+from app.services.catalog_service import mark_catalog_updated, clear_media_updates, VECTOR_CATALOG
+from app.services.checkpoint import get_checkpoint
+from app.services.embedding_store import get_embedding_store
+from app.services.embedders import get_embedder
+from app.services.embedding_service import get_embeddings
 
 import re
 import string
 
-from app.vector_db.vector_database import DEFAULT_MEDIA_COLLECTION_NAME, DEFAULT_CD_COLLECTION_NAME
-from common.config.recommender.recommender_config import RecommenderConfiguration, get_recommender_config
-
-RECOVERY_FILE = "qdrant_processed_media_ids.json"
+from app.vector_db.indexing_pipeline import IndexingPipeline
+from app.vector_db.sparse_encoder import encode_document, average_document_length
+from app.vector_db.media_reader import stream_media
+from app.vector_db.sync_state import save_sync_state, SyncState
+from app.vector_db.vector_database import DEFAULT_MEDIA_COLLECTION_NAME, DEFAULT_CD_COLLECTION_NAME, SPARSE_VECTOR_NAME, \
+    DENSE_VECTOR_NAME, TAGS_VECTOR_NAME, SUMMARY_CHUNKS_VECTOR_NAME
+from common.config.recommender.recommender_config import RecommenderConfiguration, get_recommender_config, \
+    MultiVectorConfiguration, MediaCollectionConfiguration
 
 
 def sanitize_text(text: str | None) -> str:
@@ -30,27 +39,197 @@ def sanitize_text(text: str | None) -> str:
     return text
 
 
+def build_lexical_text(media) -> str:
+    """ Text of the sparse vector of a media: its title, sanitized summary and tags. """
+    tags = " ".join(media.tags)
+    return " ".join([media.title or "", sanitize_text(media.summary), tags])
+
+
+SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+
+
+def chunk_summary(summary: str, chunk_words: int, max_chunks: int) -> List[str]:
+    """
+    Split a long sanitized summary into at most max_chunks chunks of at most chunk_words words, cut between sentences
+    when possible. Summaries of at most chunk_words words are not chunked: the main vector represents them well.
+    """
+    if len(summary.split()) <= chunk_words:
+        return []
+
+    chunks, current = [], []
+    for sentence in SENTENCE_END.split(summary):
+        sentence_words = sentence.split()
+        if current and len(current) + len(sentence_words) > chunk_words:
+            chunks.append(" ".join(current))
+            current = []
+        current.extend(sentence_words)
+        while len(current) > chunk_words:  # a sentence longer than a chunk
+            chunks.append(" ".join(current[:chunk_words]))
+            current = current[chunk_words:]
+        if len(chunks) >= max_chunks:
+            break
+    if current:
+        chunks.append(" ".join(current))
+    return chunks[:max_chunks]
+
+
+def build_named_vector_texts(
+        sanitized_summary: str,
+        sorted_tags: List[str],
+        multi_vector: MultiVectorConfiguration
+) -> Dict[str, List[str]]:
+    """ Texts of the named vectors of a media: its tags alone, and the chunks of its summary if it is long. """
+    texts = {}
+    if sorted_tags:
+        texts[TAGS_VECTOR_NAME] = [", ".join(sorted_tags)]
+    chunks = chunk_summary(sanitized_summary, multi_vector.summary_chunk_words, multi_vector.max_summary_chunks)
+    if chunks:
+        texts[SUMMARY_CHUNKS_VECTOR_NAME] = chunks
+    return texts
+
+
+def build_media_vectors_config(config: RecommenderConfiguration):
+    on_disk = config.media_collection.on_disk
+    dense_params = VectorParams(size=config.dimensions, distance=Distance.COSINE, on_disk=on_disk)
+    if not config.multi_vector.enabled:
+        return dense_params
+    return {
+        DENSE_VECTOR_NAME: dense_params,
+        TAGS_VECTOR_NAME: VectorParams(size=config.dimensions, distance=Distance.COSINE, on_disk=on_disk),
+        SUMMARY_CHUNKS_VECTOR_NAME: VectorParams(
+            size=config.dimensions,
+            distance=Distance.COSINE,
+            on_disk=on_disk,
+            multivector_config=MultiVectorConfig(comparator=MultiVectorComparator.MAX_SIM),
+        ),
+    }
+
+
+def build_quantization_config(collection: MediaCollectionConfiguration):
+    """
+    Scalar quantization stores each dimension in one byte (4x less memory), binary quantization in one bit (32x less,
+    only accurate for high-dimensional embeddings such as OpenAI's, with rescoring).
+    """
+    if collection.quantization == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8,
+            quantile=collection.quantization_quantile,
+            always_ram=collection.quantization_always_ram,
+        ))
+    if collection.quantization == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=collection.quantization_always_ram))
+    return None
+
+
+def build_media_collection_params(config: RecommenderConfiguration) -> dict:
+    """ Parameters of create_collection for the media collection. """
+    collection = config.media_collection
+    return {
+        # A dense vector (and the tag and summary chunk vectors in multi-vector mode), and a sparse lexical vector whose
+        # IDF is computed by Qdrant
+        "vectors_config": build_media_vectors_config(config),
+        "sparse_vectors_config": {
+            SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF),
+        },
+        "hnsw_config": HnswConfigDiff(m=collection.hnsw_m, ef_construct=collection.hnsw_ef_construct),
+        "quantization_config": build_quantization_config(collection),
+    }
+
+
+def build_media_text(media) -> str:
+    """ Text of the main dense vector of a media: its sanitized summary and sorted tags. """
+    sanitized_summary = sanitize_text(media.summary)
+    sorted_tags = sorted(media.tags)
+    return sanitized_summary + ", " + ", ".join(sorted_tags) if sanitized_summary else ", ".join(sorted_tags)
+
+
+def hash_media_text(text: str) -> str:
+    """ Hash of the exact embedding input of a media, kept in its payload so that syncs only re-embed changed texts. """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_media_payload(media, indexed_at: float) -> dict:
+    return {
+        "title": media.title,
+        "score": media.score,
+        "type": media.type,
+        "start_date": media.start_date,
+        "status": media.status,
+        "external_url": media.external_url,
+        "image_url": media.image_url,
+        "content_descriptors": list(media.tags),
+        "text_hash": hash_media_text(build_media_text(media)),
+        "indexed_at": indexed_at,  # lets query time detect payloads older than the last ingestion
+    }
+
+
+def embed_media_points(media_list, config: RecommenderConfiguration, avg_doc_length: float) -> List[PointStruct]:
+    """ Embed media whose text is not empty and build their points, with the named vectors in multi-vector mode. """
+    media_data_to_embed = [build_media_text(media) for media in media_list]
+    named_vector_texts = []
+    if config.multi_vector.enabled:
+        for media in media_list:
+            sorted_tags = sorted(media.tags)
+            named_vector_texts.append(
+                build_named_vector_texts(sanitize_text(media.summary), sorted_tags, config.multi_vector)
+            )
+
+    # The texts of the named vectors are embedded in the same requests, after the main texts
+    named_texts = [text for texts in named_vector_texts for name in texts for text in texts[name]]
+    vectors = get_embeddings(
+        texts=media_data_to_embed + named_texts,
+        model=config.embedder,
+        dimensions=config.dimensions,
+    )
+
+    named_vectors = [{} for _ in media_list]
+    position = len(media_list)
+    for media_named_vectors, texts in zip(named_vectors, named_vector_texts):
+        for name, name_texts in texts.items():
+            name_vectors = vectors[position:position + len(name_texts)]
+            media_named_vectors[name] = name_vectors if name == SUMMARY_CHUNKS_VECTOR_NAME else name_vectors[0]
+            position += len(name_texts)
+
+    indexed_at = time.time()
+    return [
+        PointStruct(
+            id=media.media_id,
+            vector={
+                DENSE_VECTOR_NAME: vectors[idx],
+                SPARSE_VECTOR_NAME: encode_document(build_lexical_text(media), avg_doc_length),
+                **named_vectors[idx],
+            },
+            payload=build_media_payload(media, indexed_at),
+        )
+        for idx, media in enumerate(media_list)
+    ]
+
+
 def initialize_all_media(
         db_client, vdb_client,
         collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
         batch_size=1000,
         config: RecommenderConfiguration = None,
+        n_embedding_workers: Optional[int] = None,
+        n_upload_workers: int = 2,
 ):
     if config is None:
         config = get_recommender_config()
 
-    all_media: List[Media] = (
-        db_client
-        .query(Media)
-        .options(selectinload(Media.content_descriptors))
-        .all()
+    # BM25 length normalization needs the average document of the whole collection before the first point is encoded,
+    # so the media are streamed twice rather than held in memory
+    avg_doc_length = average_document_length(
+        build_lexical_text(media) for media in stream_media(db_client, batch_size=batch_size)
     )
     return initialize_media(
-        all_media,
+        stream_media(db_client, batch_size=batch_size),
         vdb_client,
         collection_name=collection_name,
         batch_size=batch_size,
-        config=config
+        config=config,
+        n_embedding_workers=n_embedding_workers,
+        n_upload_workers=n_upload_workers,
+        avg_doc_length=avg_doc_length,
     )
 
 
@@ -59,86 +238,58 @@ def initialize_media(
         vdb_client,
         collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
         batch_size=1000,
-        config: RecommenderConfiguration = None
+        config: RecommenderConfiguration = None,
+        n_embedding_workers: Optional[int] = None,
+        n_upload_workers: int = 2,
+        avg_doc_length: Optional[float] = None,
 ):
+    """
+    Index media into a new collection, resuming from the checkpoint of an interrupted run. media_list can be a stream
+    (see stream_media) when the average lexical document length is given.
+    """
     if config is None:
         config = get_recommender_config()
+    store_stats = get_embedding_store().stats()
+    started_at = time.time()
 
-    # Create collection in VDB
-    vdb_client.create_collection(
-        collection_name=collection_name,
-        vectors_config=VectorParams(
-            size=config.dimensions,
-            distance=Distance.COSINE,
-        )
-    )
-
-    # Load already processed IDs for recovery
-    if os.path.exists(RECOVERY_FILE):
-        with open(RECOVERY_FILE, "r") as f:
-            processed_ids = set(json.load(f))
-    else:
+    # Media already indexed by an interrupted run into the same collection with the same embedder are skipped
+    checkpoint = get_checkpoint("vdb_init", collection_name, config.embedder, config.dimensions)
+    processed_ids = checkpoint.load()
+    if not processed_ids or not vdb_client.collection_exists(collection_name):
         processed_ids = set()
+        vdb_client.create_collection(collection_name=collection_name, **build_media_collection_params(config))
 
-    media_list = [m for m in media_list if m.media_id not in processed_ids]
-
-    for i in tqdm(range(0, len(media_list), batch_size), desc="Initializing media"):
-        batch = media_list[i:i + batch_size]
-        media_data_to_embed = []
-        valid_media = []
-
-        # Embed media in batch
-        for media in batch:
-            # Process string
-            sanitized_summary = sanitize_text(media.summary)
-            sorted_tags = sorted(cd.content_descriptor for cd in media.content_descriptors)
-            combined_text = sanitized_summary + ", " + ", ".join(sorted_tags) if sanitized_summary \
-                else ", ".join(sorted_tags)
-
-            # Add media to the list of valid media to process if the text to embed is not empty
-            if combined_text.strip():
-                media_data_to_embed.append(combined_text)
-                valid_media.append(media)
-
-        if not valid_media:
-            continue
-
-        try:
-            vectors = get_embeddings(
-                texts=media_data_to_embed,
-                model=config.embedder,
-                dimensions=config.dimensions,
-            )
-        except Exception as e:
-            print(f"Embedding failed for batch {i // batch_size}: {e}")
-            continue
-
-        media_points = [
-            PointStruct(
-                id=media.media_id,
-                vector=vectors[idx],
-                payload={
-                    "title": media.title,
-                    "score": media.score,
-                    "type": media.type,
-                    "start_date": media.start_date,
-                    "status": media.status,
-                    "content_descriptors": [tag.content_descriptor for tag in media.content_descriptors],
-                }
-            )
-            for idx, media in enumerate(valid_media)
-        ]
+    # BM25 length normalization is relative to the average document of the whole collection
+    if avg_doc_length is None:
+        avg_doc_length = average_document_length([build_lexical_text(media) for media in media_list])
 
-        try:
-            vdb_client.upsert(collection_name=collection_name, points=media_points)
-        except Exception as e:
-            print(f"Upsert failed for batch {i // batch_size}: {e}")
-            continue
+    # Several embedding requests are kept in flight, as many as the backend of the embedder handles well
+    if n_embedding_workers is None:
+        n_embedding_workers = get_embedder(config.embedder).max_concurrent_requests
+    pipeline = IndexingPipeline(
+        vdb_client,
+        collection_name,
+        build_points=lambda batch: embed_media_points(batch, config, avg_doc_length),
+        has_text=lambda media: bool(build_media_text(media).strip()),
+        checkpoint=checkpoint,
+        processed_ids=processed_ids,
+        batch_size=batch_size,
+        n_embedding_workers=n_embedding_workers,
+        n_upload_workers=n_upload_workers,
+    )
+    n_failed_batches = pipeline.run(media_list)
 
-        # Save progress
-        processed_ids.update(m.media_id for m in valid_media)
-        with open(RECOVERY_FILE, "w") as f:
-            json.dump(list(processed_ids), f)
+    # Later syncs start from the most recent update indexed here, and reuse the average document length
+    save_sync_state(collection_name, SyncState(watermark=pipeline.latest_update, avg_doc_length=avg_doc_length))
+    if n_failed_batches:
+        print(f"{n_failed_batches} batches failed, run the initialization again to resume from the checkpoint.")
+    else:
+        checkpoint.clear()
+        # Every payload was written by this run, unless it resumed an earlier one that may predate recent ingestions
+        if not processed_ids:
+            clear_media_updates(indexed_since=started_at)
+    mark_catalog_updated(VECTOR_CATALOG)
+    print(f"Embedding store usage for this run: {get_embedding_store().stats(since=store_stats)}")
 
 
 def initialize_all_content_descriptors(
@@ -166,6 +317,7 @@ def initialize_content_descriptors(
 ):
     if config is None:
         config = get_recommender_config()
+    store_stats = get_embedding_store().stats()
 
     vdb_client.create_collection(
         collection_name=collection_name,
@@ -196,3 +348,5 @@ def initialize_content_descriptors(
     ]
 
     vdb_client.upsert(collection_name=collection_name, points=cd_points)
+    mark_catalog_updated(VECTOR_CATALOG)
+    print(f"Embedding store usage for this run: {get_embedding_store().stats(since=store_stats)}")
@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Iterator, List, Optional
+
+from sqlalchemy import select, func, Select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from app.db.models import Media, ContentDescriptor, media_content_descriptors, MediaType, Status
+
+
+@dataclass(slots=True)
+class IndexedMedia:
+    """ Columns of a media needed to index it, with its tags as plain strings. """
+    media_id: int
+    type: MediaType
+    title: str
+    summary: Optional[str]
+    start_date: Optional[date]
+    status: Optional[Status]
+    score: Optional[float]
+    external_url: Optional[str]
+    image_url: Optional[str]
+    updated_at: Optional[datetime]
+    tags: List[str]
+
+
+def build_media_records_query(updated_since: Optional[datetime] = None) -> Select:
+    """
+    One row per media with only the indexed columns, and its tags aggregated into a sorted array by the database
+    instead of being loaded as ORM relationships.
+    """
+    tag = ContentDescriptor.content_descriptor
+    # Media without tags get a NULL from the outer join, removed from the array
+    tags = func.array_remove(func.array_agg(aggregate_order_by(tag, tag)), None).label("tags")
+    query = (
+        select(
+            Media.media_id, Media.type, Media.title, Media.summary, Media.start_date, Media.status, Media.score,
+            Media.external_url, Media.image_url, Media.updated_at, tags,
+        )
+        .outerjoin(media_content_descriptors, media_content_descriptors.c.media_id == Media.media_id)
+        .outerjoin(
+            ContentDescriptor,
+            ContentDescriptor.content_descriptor_id == media_content_descriptors.c.content_descriptor_id,
+        )
+        .group_by(Media.media_id)
+        .order_by(Media.media_id)
+    )
+    if updated_since is not None:
+        query = query.where(Media.updated_at >= updated_since)
+    return query
+
+
+def stream_media(db_client, batch_size: int = 1000, updated_since: Optional[datetime] = None) -> Iterator[IndexedMedia]:
+    """
+    Iterate over the media (updated since a time, if given) through a server-side cursor, batch_size rows at a time,
+    so that memory stays flat whatever the size of the catalog.
+    """
+    # yield_per also enables stream_results: rows are fetched from the cursor as they are consumed
+    result = db_client.execute(build_media_records_query(updated_since).execution_options(yield_per=batch_size))
+    for row in result:
+        yield IndexedMedia(
+            media_id=row.media_id, type=row.type, title=row.title, summary=row.summary, start_date=row.start_date,
+            status=row.status, score=row.score, external_url=row.external_url, image_url=row.image_url,
+            updated_at=row.updated_at, tags=list(row.tags or []),
+        )
+
+
+def stream_media_ids(db_client, batch_size: int = 10_000) -> Iterator[int]:
+    """ Iterate over the ids of all the media through a server-side cursor. """
+    yield from db_client.execute(select(Media.media_id).execution_options(yield_per=batch_size)).scalars()
@@ -0,0 +1,69 @@
+import re
+import zlib
+from collections import Counter
+from typing import Iterable, List
+
+from qdrant_client.models import SparseVector
+
+# BM25 parameters: K1 controls how fast repeated terms saturate, B how much long documents are penalized
+K1 = 1.2
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+    a about after again against all also an and any are as at be because been before being between both but by can
+    could did do does doing down during each few for from further had has have having he her here hers him his how i
+    if in into is it its itself just me more most my no nor not of off on once only or other our out over own same
+    she should so some such than that the their them then there these they this those through to too under until up
+    very was we were what when where which while who whom why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """ Split a text into lowercase terms, without stopwords. """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def term_index(term: str) -> int:
+    """ Stable index of a term in the sparse vector space, so that no vocabulary has to be stored. """
+    return zlib.crc32(term.encode("utf-8"))
+
+
+def build_sparse_vector(weights: dict) -> SparseVector:
+    indices = sorted(weights)
+    return SparseVector(indices=indices, values=[float(weights[index]) for index in indices])
+
+
+def count_terms(text: str) -> Counter:
+    counts = Counter()
+    for term in tokenize(text):
+        counts[term_index(term)] += 1  # the rare hash collisions simply add up
+    return counts
+
+
+def average_document_length(texts: Iterable[str]) -> float:
+    """ Average number of terms of the texts, computed in one pass so that they can be streamed. """
+    total_length = n_texts = 0
+    for text in texts:
+        total_length += len(tokenize(text))
+        n_texts += 1
+    return total_length / n_texts if n_texts else 1.0
+
+
+def encode_document(text: str, avg_doc_length: float) -> SparseVector:
+    """
+    Encode a document as the BM25 term frequency component of each of its terms. The inverse document frequency is
+    applied by Qdrant at query time (IDF modifier of the sparse vector), so it stays correct as the collection changes.
+    :param text: Text of the document.
+    :param avg_doc_length: Average number of terms of the documents of the collection.
+    """
+    counts = count_terms(text)
+    doc_length = sum(counts.values())
+    length_norm = K1 * (1 - B + B * doc_length / max(avg_doc_length, 1.0))
+    return build_sparse_vector({index: tf * (K1 + 1) / (tf + length_norm) for index, tf in counts.items()})
+
+
+def encode_query(text: str) -> SparseVector:
+    """ Encode a query: every distinct term weighs 1, the document weights and IDF do the rest. """
+    return build_sparse_vector({index: 1.0 for index in count_terms(text)})
@@ -0,0 +1,53 @@
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+# Progress of the vector database syncs, per collection, kept next to the catalog version file
+SYNC_STATE_FILE = os.getenv("VDB_SYNC_STATE_FILE", "vdb_sync_state.json")
+
+
+@dataclass
+class SyncState:
+    watermark: Optional[datetime]   # most recent media update already reflected in the collection
+    avg_doc_length: float           # average lexical document length the sparse vectors were encoded with
+
+
+def get_latest_update(media_list) -> Optional[datetime]:
+    """ Return the most recent updated_at of the media, None if none is known. """
+    updates = [media.updated_at for media in media_list if getattr(media, "updated_at", None) is not None]
+    return max(updates, default=None)
+
+
+def load_sync_state(collection_name: str) -> Optional[SyncState]:
+    """ Return the sync state of a collection, None if the collection was never initialized or synced. """
+    try:
+        with open(SYNC_STATE_FILE, "r", encoding="utf-8") as f:
+            states = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    state = states.get(collection_name)
+    if state is None:
+        return None
+    watermark = datetime.fromisoformat(state["watermark"]) if state["watermark"] else None
+    return SyncState(watermark=watermark, avg_doc_length=state["avg_doc_length"])
+
+
+def save_sync_state(collection_name: str, state: SyncState) -> None:
+    try:
+        with open(SYNC_STATE_FILE, "r", encoding="utf-8") as f:
+            states = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        states = {}
+    states[collection_name] = {
+        "watermark": state.watermark.isoformat() if state.watermark else None,
+        "avg_doc_length": state.avg_doc_length,
+    }
+
+    # Write to a temporary file first so that a crash never leaves a partially written file
+    tmp_path = f"{SYNC_STATE_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(states, f)
+    os.replace(tmp_path, SYNC_STATE_FILE)
@@ -0,0 +1,181 @@
+import time
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, Iterator, Set
+
+from qdrant_client.models import PointIdsList, SetPayloadOperation, SetPayload, UpdateVectorsOperation, UpdateVectors, \
+    PointVectors
+from tqdm import tqdm
+
+from app.services.catalog_service import mark_catalog_updated, clear_media_updates, VECTOR_CATALOG
+from app.services.embedding_store import get_embedding_store
+from app.vector_db.initialize_vdb import build_media_text, hash_media_text, build_media_payload, embed_media_points, \
+    build_lexical_text, initialize_all_media
+from app.vector_db.media_reader import stream_media, stream_media_ids, IndexedMedia
+from app.vector_db.sparse_encoder import encode_document, average_document_length
+from app.vector_db.sync_state import load_sync_state, save_sync_state, SyncState, get_latest_update
+from app.vector_db.vector_database import DEFAULT_MEDIA_COLLECTION_NAME, SPARSE_VECTOR_NAME
+from common.config.recommender.recommender_config import RecommenderConfiguration, get_recommender_config
+
+
+@dataclass
+class SyncReport:
+    n_embedded: int = 0         # new media, or media whose embedding text changed
+    n_updated: int = 0          # media whose metadata changed, updated in place
+    n_deleted: int = 0          # media removed from the database, or whose embedding text became empty
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.n_embedded or self.n_updated or self.n_deleted)
+
+
+def sync_all_media(
+        db_client, vdb_client,
+        collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+        batch_size=1000,
+        config: RecommenderConfiguration = None,
+) -> SyncReport:
+    """
+    Reflect the media updated since the last initialization or sync in the collection, initializing it if it does not
+    exist yet.
+    """
+    if config is None:
+        config = get_recommender_config()
+
+    if not vdb_client.collection_exists(collection_name):
+        initialize_all_media(db_client, vdb_client, collection_name=collection_name, batch_size=batch_size, config=config)
+        return SyncReport()
+
+    state = load_sync_state(collection_name)
+    if state is None:  # collection initialized before syncs existed, every media is synced
+        state = SyncState(
+            watermark=None,
+            avg_doc_length=average_document_length(
+                build_lexical_text(media) for media in stream_media(db_client, batch_size=batch_size)
+            ),
+        )
+    media_ids = set(stream_media_ids(db_client))
+    # Media updated at the watermark itself are read again, syncing them twice is harmless
+    changed_media = stream_media(db_client, batch_size=batch_size, updated_since=state.watermark)
+    return sync_media(changed_media, media_ids, vdb_client, collection_name, batch_size, config, state)
+
+
+def sync_media(
+        changed_media: Iterable[IndexedMedia],
+        media_ids: Set[int],
+        vdb_client,
+        collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+        batch_size=1000,
+        config: RecommenderConfiguration = None,
+        state: SyncState = None,
+) -> SyncReport:
+    """
+    Sync the points of changed media with the database: media whose embedding text changed (according to the text hash
+    in their payload) are re-embedded, the others only get their payload and sparse vector updated in place. Points of
+    media not in media_ids any more are deleted.
+
+    The watermark only moves forward once every batch succeeded, so a failed sync is simply run again.
+    """
+    if config is None:
+        config = get_recommender_config()
+    store_stats = get_embedding_store().stats()
+    started_at = time.time()
+
+    report = SyncReport()
+    synced_ids = set()
+    latest_update = state.watermark
+    for batch in tqdm(iterate_batches(changed_media, batch_size), desc="Syncing media", unit="batch"):
+        synced_ids.update(media.media_id for media in batch)
+        batch_latest_update = get_latest_update(batch)
+        if batch_latest_update is not None and (latest_update is None or batch_latest_update > latest_update):
+            latest_update = batch_latest_update
+        stored_points = vdb_client.retrieve(
+            collection_name=collection_name,
+            ids=[media.media_id for media in batch],
+            with_payload=["text_hash"],
+            with_vectors=False,
+        )
+        stored_hashes = {point.id: (point.payload or {}).get("text_hash") for point in stored_points}
+
+        media_to_embed, media_to_update, ids_to_delete = [], [], []
+        for media in batch:
+            text = build_media_text(media)
+            if not text.strip():
+                if media.media_id in stored_hashes:
+                    ids_to_delete.append(media.media_id)
+            elif stored_hashes.get(media.media_id) == hash_media_text(text):
+                media_to_update.append(media)
+            else:
+                media_to_embed.append(media)
+
+        if media_to_embed:
+            points = embed_media_points(media_to_embed, config, state.avg_doc_length)
+            vdb_client.upsert(collection_name=collection_name, points=points)
+        if media_to_update:
+            vdb_client.batch_update_points(
+                collection_name=collection_name,
+                update_operations=build_metadata_updates(media_to_update, state.avg_doc_length),
+            )
+        if ids_to_delete:
+            vdb_client.delete(collection_name=collection_name, points_selector=PointIdsList(points=ids_to_delete))
+
+        report.n_embedded += len(media_to_embed)
+        report.n_updated += len(media_to_update)
+        report.n_deleted += len(ids_to_delete)
+
+    # Media removed from the database
+    removed_ids = [
+        point_id for point_id in iterate_point_ids(vdb_client, collection_name, batch_size)
+        if point_id not in media_ids and point_id not in synced_ids  # media created while syncing are kept
+    ]
+    if removed_ids:
+        vdb_client.delete(collection_name=collection_name, points_selector=PointIdsList(points=removed_ids))
+        report.n_deleted += len(removed_ids)
+
+    save_sync_state(collection_name, SyncState(watermark=latest_update, avg_doc_length=state.avg_doc_length))
+    # Media ingested before the sync started are past the previous watermark, their payloads were all rewritten
+    clear_media_updates(indexed_since=started_at)
+
+    if report.changed:
+        mark_catalog_updated(VECTOR_CATALOG)
+    print(f"Embedding store usage for this run: {get_embedding_store().stats(since=store_stats)}")
+    return report
+
+
+def iterate_batches(items: Iterable, batch_size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def build_metadata_updates(media_list, avg_doc_length: float) -> list:
+    """ Operations replacing the payload and the sparse vector (which includes the title) of media, in place. """
+    indexed_at = time.time()
+    operations = []
+    for media in media_list:
+        operations.append(SetPayloadOperation(
+            set_payload=SetPayload(payload=build_media_payload(media, indexed_at), points=[media.media_id]),
+        ))
+        operations.append(UpdateVectorsOperation(
+            update_vectors=UpdateVectors(points=[PointVectors(
+                id=media.media_id,
+                vector={SPARSE_VECTOR_NAME: encode_document(build_lexical_text(media), avg_doc_length)},
+            )]),
+        ))
+    return operations
+
+
+def iterate_point_ids(vdb_client, collection_name: str, batch_size: int) -> Iterator[int]:
+    """ Iterate over the ids of all the points of a collection, without their payloads or vectors. """
+    offset = None
+    while True:
+        points, offset = vdb_client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        yield from (point.id for point in points)
+        if offset is None:
+            return
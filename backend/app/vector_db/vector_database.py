@@ -1,21 +1,311 @@
-from typing import Optional, List
+from typing import Optional, List, Tuple, Any
 
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, ScoredPoint
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.models import Filter, ScoredPoint, QueryRequest, SparseVector, Prefetch, FusionQuery, Fusion, \
+    SearchParams
+
+from app.monitoring.metrics import track_dependency
 
 DEFAULT_MEDIA_COLLECTION_NAME = "media"
 DEFAULT_CD_COLLECTION_NAME = "content_descriptors"
+QUERY_BATCH_SIZE = 64  # maximum number of searches sent in one batch request
+DENSE_VECTOR_NAME = ""  # default dense vector of the media collection, embedding of the summary and tags together
+SPARSE_VECTOR_NAME = "sparse"  # lexical (BM25) vector of the media collection, next to the default dense vector
+TAGS_VECTOR_NAME = "tags"  # embedding of the tags alone
+SUMMARY_CHUNKS_VECTOR_NAME = "summary_chunks"  # embeddings of the chunks of long summaries, compared with max-sim
+HYBRID_PREFETCH_FACTOR = 2  # each side of a hybrid search prefetches k * HYBRID_PREFETCH_FACTOR candidates
+RRF_K = 60  # rank offset of Reciprocal Rank Fusion, higher values flatten the contribution of the top ranks
 
 vector_database_client = QdrantClient(host="qdrant", port=6333)
+async_vector_database_client = AsyncQdrantClient(host="qdrant", port=6333)
+
+
+def select_vectors(with_vectors: bool):
+    """ Only the default dense vector is returned with the points, the reranker needs nothing else. """
+    return [DENSE_VECTOR_NAME] if with_vectors else False
+
+
+def build_media_query(
+        vector,
+        k,
+        vdb_filter: Optional[Filter],
+        sparse_vector: Optional[SparseVector],
+        search_params: Optional[SearchParams] = None,
+) -> Tuple[Any, Optional[List[Prefetch]], Optional[Filter], Optional[SearchParams]]:
+    """
+    Return the query, prefetches, filter and search parameters of a media search. With a sparse vector, the dense and
+    sparse searches are prefetched with the filter and fused with Reciprocal Rank Fusion in the same request, and the
+    search parameters apply to the dense prefetch.
+    """
+    if sparse_vector is None or not sparse_vector.indices:
+        return vector, None, vdb_filter, search_params
+
+    prefetch = [
+        Prefetch(query=vector, filter=vdb_filter, params=search_params, limit=k * HYBRID_PREFETCH_FACTOR),
+        Prefetch(query=sparse_vector, using=SPARSE_VECTOR_NAME, filter=vdb_filter, limit=k * HYBRID_PREFETCH_FACTOR),
+    ]
+    return FusionQuery(fusion=Fusion.RRF), prefetch, None, None
+
+
+def get_top_k_from_media(
+        vector,
+        k,
+        vdb_filter: Optional[Filter]=None,
+        with_vectors: bool=False,
+        sparse_vector: Optional[SparseVector]=None,
+        search_params: Optional[SearchParams]=None,
+        offset: int=0,
+) -> List[ScoredPoint]:
+    """
+    Returns the k closest points from the given vector (and sparse vector, if any) in the media collection, skipping
+    the offset closest ones.
+    """
+
+    query, prefetch, query_filter, params = build_media_query(vector, k + offset, vdb_filter, sparse_vector, search_params)
+    with track_dependency("qdrant", "query_points"):
+        response = vector_database_client.query_points(
+            collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+            query=query,
+            prefetch=prefetch,
+            limit=k,
+            offset=offset,
+            query_filter=query_filter,
+            search_params=params,
+            with_vectors=select_vectors(with_vectors),
+        )
+
+    return response.points
+
+async def get_top_k_from_media_async(
+        vector,
+        k,
+        vdb_filter: Optional[Filter]=None,
+        with_vectors: bool=False,
+        sparse_vector: Optional[SparseVector]=None,
+        search_params: Optional[SearchParams]=None,
+        offset: int=0,
+) -> List[ScoredPoint]:
+    """ Non-blocking version of get_top_k_from_media. """
+
+    query, prefetch, query_filter, params = build_media_query(vector, k + offset, vdb_filter, sparse_vector, search_params)
+    with track_dependency("qdrant", "query_points"):
+        response = await async_vector_database_client.query_points(
+            collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+            query=query,
+            prefetch=prefetch,
+            limit=k,
+            offset=offset,
+            query_filter=query_filter,
+            search_params=params,
+            with_vectors=select_vectors(with_vectors),
+        )
+
+    return response.points
+
+
+async def get_top_k_batch_from_media_async(
+        vectors: List[List[float]],
+        k: int,
+        vdb_filters: List[Optional[Filter]],
+        with_vectors: bool = False,
+        sparse_vectors: Optional[List[Optional[SparseVector]]] = None,
+        search_params: Optional[SearchParams] = None,
+) -> List[List[ScoredPoint]]:
+    """ Returns the k closest points of each vector in the media collection, sending the searches in batches. """
+
+    if sparse_vectors is None:
+        sparse_vectors = [None] * len(vectors)
+
+    requests = []
+    for vector, vdb_filter, sparse_vector in zip(vectors, vdb_filters, sparse_vectors):
+        query, prefetch, query_filter, params = build_media_query(vector, k, vdb_filter, sparse_vector, search_params)
+        requests.append(QueryRequest(
+            query=query, prefetch=prefetch, limit=k, filter=query_filter, params=params, with_payload=True,
+            with_vector=select_vectors(with_vectors),
+        ))
+
+    results = []
+    for start in range(0, len(requests), QUERY_BATCH_SIZE):
+        with track_dependency("qdrant", "query_batch_points"):
+            responses = await async_vector_database_client.query_batch_points(
+                collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+                requests=requests[start:start + QUERY_BATCH_SIZE],
+            )
+        results.extend(response.points for response in responses)
+
+    return results
+
+
+def fuse_max_scores(results: List[List[ScoredPoint]], k: int) -> List[ScoredPoint]:
+    """ Merge searches whose scores are comparable (cosine similarities), scoring each point with its best score. """
+    best = {}
+    for points in results:
+        for point in points:
+            if point.id not in best or point.score > best[point.id].score:
+                best[point.id] = point
+    return sorted(best.values(), key=lambda point: point.score, reverse=True)[:k]
+
+
+def fuse_reciprocal_ranks(rankings: List[List[ScoredPoint]], k: int) -> List[ScoredPoint]:
+    """ Merge rankings whose scores are not comparable, scoring each point with the sum of 1 / (RRF_K + rank). """
+    scores, points = {}, {}
+    for ranking in rankings:
+        for rank, point in enumerate(ranking, start=1):
+            scores[point.id] = scores.get(point.id, 0.0) + 1 / (RRF_K + rank)
+            points.setdefault(point.id, point)
+    best_ids = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [points[point_id].model_copy(update={"score": scores[point_id]}) for point_id in best_ids]
+
+
+def build_multi_vector_requests(
+        vector,
+        k,
+        vdb_filter: Optional[Filter],
+        with_vectors: bool,
+        sparse_vector: Optional[SparseVector],
+        search_params: Optional[SearchParams],
+) -> List[QueryRequest]:
+    """ One search per dense vector of the media (and the sparse vector, if any), to be sent in one batch request. """
+    dense_queries = [
+        (vector, DENSE_VECTOR_NAME),
+        (vector, TAGS_VECTOR_NAME),
+        ([vector], SUMMARY_CHUNKS_VECTOR_NAME),  # a one-vector multivector, max-sim gives the best chunk's similarity
+    ]
+    requests = [
+        QueryRequest(
+            query=query, using=using, limit=k, filter=vdb_filter, params=search_params, with_payload=True,
+            with_vector=select_vectors(with_vectors),
+        )
+        for query, using in dense_queries
+    ]
+    if sparse_vector is not None and sparse_vector.indices:
+        requests.append(QueryRequest(
+            query=sparse_vector, using=SPARSE_VECTOR_NAME, limit=k, filter=vdb_filter, with_payload=True,
+            with_vector=select_vectors(with_vectors),
+        ))
+    return requests
+
+
+def fuse_multi_vector_results(results: List[List[ScoredPoint]], k: int) -> List[ScoredPoint]:
+    """ Each media scores its best dense similarity, and the sparse ranking (if any) is fused with reciprocal ranks. """
+    dense_points = fuse_max_scores(results[:3], k)
+    if len(results) == 3:
+        return dense_points
+    return fuse_reciprocal_ranks([dense_points, results[3]], k)
+
+
+def get_top_k_multi_vector_from_media(
+        vector,
+        k,
+        vdb_filter: Optional[Filter]=None,
+        with_vectors: bool=False,
+        sparse_vector: Optional[SparseVector]=None,
+        search_params: Optional[SearchParams]=None,
+        offset: int=0,
+) -> List[ScoredPoint]:
+    """
+    Returns the k closest points from the given vector in the media collection, comparing it with the main vector,
+    the tag vector and the summary chunk vectors of each media (named vectors), and keeping the best similarity. The
+    offset closest ones are skipped.
+    """
+    requests = build_multi_vector_requests(vector, k + offset, vdb_filter, with_vectors, sparse_vector, search_params)
+    with track_dependency("qdrant", "query_batch_points"):
+        responses = vector_database_client.query_batch_points(
+            collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+            requests=requests,
+        )
+    return fuse_multi_vector_results([response.points for response in responses], k + offset)[offset:]
+
+
+async def get_top_k_multi_vector_from_media_async(
+        vector,
+        k,
+        vdb_filter: Optional[Filter]=None,
+        with_vectors: bool=False,
+        sparse_vector: Optional[SparseVector]=None,
+        search_params: Optional[SearchParams]=None,
+        offset: int=0,
+) -> List[ScoredPoint]:
+    """ Non-blocking version of get_top_k_multi_vector_from_media. """
+    requests = build_multi_vector_requests(vector, k + offset, vdb_filter, with_vectors, sparse_vector, search_params)
+    with track_dependency("qdrant", "query_batch_points"):
+        responses = await async_vector_database_client.query_batch_points(
+            collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+            requests=requests,
+        )
+    return fuse_multi_vector_results([response.points for response in responses], k + offset)[offset:]
+
+
+def count_media(vdb_filter: Optional[Filter] = None) -> int:
+    """ Returns the number of points of the media collection that match the filter. """
+
+    with track_dependency("qdrant", "count"):
+        response = vector_database_client.count(
+            collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+            count_filter=vdb_filter,
+            exact=True,
+        )
+
+    return response.count
+
+
+async def count_media_async(vdb_filter: Optional[Filter] = None) -> int:
+    """ Non-blocking version of count_media. """
+
+    with track_dependency("qdrant", "count"):
+        response = await async_vector_database_client.count(
+            collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+            count_filter=vdb_filter,
+            exact=True,
+        )
+
+    return response.count
+
+
+def build_content_descriptor_requests(vectors: List[List[float]], k: int, score_threshold: Optional[float]):
+    return [
+        QueryRequest(query=vector, limit=k, score_threshold=score_threshold, with_payload=["content_descriptor"])
+        for vector in vectors
+    ]
+
+
+def get_nearest_content_descriptors(
+        vectors: List[List[float]],
+        k: int,
+        score_threshold: Optional[float] = None,
+) -> List[List[ScoredPoint]]:
+    """ Returns the k closest content descriptors of each vector, sending the searches in batches. """
+
+    requests = build_content_descriptor_requests(vectors, k, score_threshold)
+
+    results = []
+    for start in range(0, len(requests), QUERY_BATCH_SIZE):
+        with track_dependency("qdrant", "query_batch_points"):
+            responses = vector_database_client.query_batch_points(
+                collection_name=DEFAULT_CD_COLLECTION_NAME,
+                requests=requests[start:start + QUERY_BATCH_SIZE],
+            )
+        results.extend(response.points for response in responses)
+
+    return results
+
+
+async def get_nearest_content_descriptors_async(
+        vectors: List[List[float]],
+        k: int,
+        score_threshold: Optional[float] = None,
+) -> List[List[ScoredPoint]]:
+    """ Non-blocking version of get_nearest_content_descriptors. """
 
-def get_top_k_from_media(vector, k, vdb_filter: Optional[Filter]=None) -> List[ScoredPoint]:
-    """ Returns the k closest points from the given vector in the media collection. """
+    requests = build_content_descriptor_requests(vectors, k, score_threshold)
 
-    response = vector_database_client.query_points(
-        collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
-        query=vector,
-        limit=k,
-        query_filter=vdb_filter
-    )
+    results = []
+    for start in range(0, len(requests), QUERY_BATCH_SIZE):
+        with track_dependency("qdrant", "query_batch_points"):
+            responses = await async_vector_database_client.query_batch_points(
+                collection_name=DEFAULT_CD_COLLECTION_NAME,
+                requests=requests[start:start + QUERY_BATCH_SIZE],
+            )
+        results.extend(response.points for response in responses)
 
-    return response.points
\ No newline at end of file
+    return results
@@ -0,0 +1,7 @@
+import typer
+
+from cli.recommender import batch, prewarm
+
+app = typer.Typer()
+app.add_typer(batch.app, name="batch")
+app.add_typer(prewarm.app, name="prewarm")
@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+import typer
+
+from app.api.models import convert_media
+from app.recommender.pipeline import get_recommendations_batch
+from common.config.recommender.recommender_config import get_recommender_config
+
+app = typer.Typer()
+
+
+@app.command()
+def from_file(
+        path: str = typer.Argument(..., help="Text file with one query per line"),
+        output_path: str = typer.Option(
+            default="recommendations.jsonl",
+            help="Path of the JSONL file where recommendations will be written."
+        ),
+        max_concurrency: int = typer.Option(
+            default=8,
+            help="Maximum number of concurrent LLM calls."
+        ),
+):
+    """Generate recommendations for every query of a file and write them to a JSONL file."""
+    with open(path, "r", encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    print(f"Generating recommendations for {len(queries)} queries...")
+    results = asyncio.run(get_recommendations_batch(queries, get_recommender_config(), max_concurrency=max_concurrency))
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps({
+                "query": result.query,
+                "recommendations": [convert_media(media).model_dump(mode="json") for media in result.media],
+                "error": result.error,
+            }) + "\n")
+
+    n_failed = sum(1 for result in results if result.error)
+    print(f"✅ Recommendations written to {output_path} ({n_failed} failed queries).")
@@ -0,0 +1,15 @@
+import typer
+
+from app.recommender.pipeline import prewarm_queries
+from common.config.recommender.recommender_config import get_recommender_config
+
+app = typer.Typer()
+
+
+@app.command()
+def top(
+        n: int = typer.Option(default=500, help="Number of most frequent queries to prewarm."),
+):
+    """Process and embed the most frequent queries of the query log, for the API to serve them from memory."""
+    n_prewarmed = prewarm_queries(get_recommender_config(), top_n=n)
+    print(f"✅ {n_prewarmed} queries prewarmed. Running APIs load them at their next refresh.")
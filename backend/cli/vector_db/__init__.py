@@ -1,6 +1,7 @@
 import typer
 
-from cli.vector_db import initialize_collection
+from cli.vector_db import initialize_collection, sync_collection
 
 app = typer.Typer()
-app.add_typer(initialize_collection.app, name="init")
\ No newline at end of file
+app.add_typer(initialize_collection.app, name="init")
+app.add_typer(sync_collection.app, name="sync")
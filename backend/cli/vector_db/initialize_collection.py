@@ -1,3 +1,5 @@
+from typing import Optional
+
 import typer
 
 from app.db.database import SessionLocal
@@ -12,10 +14,21 @@ app = typer.Typer()
 def media(
         collection_name: str = typer.Option(default=DEFAULT_MEDIA_COLLECTION_NAME),
         batch_size: int = typer.Option(default=1000, ),
+        embedding_workers: Optional[int] = typer.Option(
+            default=None, help="Concurrent embedding batches, defaults to what the embedder backend handles well."
+        ),
+        upload_workers: int = typer.Option(default=2, help="Concurrent upserts into the vector database."),
 ):
     """Embed all media in database to initialize vector database collection."""
     with SessionLocal() as db_client:
-        initialize_all_media(db_client, vector_database_client, collection_name=collection_name, batch_size=batch_size)
+        initialize_all_media(
+            db_client,
+            vector_database_client,
+            collection_name=collection_name,
+            batch_size=batch_size,
+            n_embedding_workers=embedding_workers,
+            n_upload_workers=upload_workers,
+        )
 
 
 @app.command()
@@ -0,0 +1,20 @@
+import typer
+
+from app.db.database import SessionLocal
+from app.vector_db.sync_vdb import sync_all_media
+from app.vector_db.vector_database import vector_database_client, DEFAULT_MEDIA_COLLECTION_NAME
+
+app = typer.Typer()
+
+
+@app.command()
+def media(
+        collection_name: str = typer.Option(default=DEFAULT_MEDIA_COLLECTION_NAME),
+        batch_size: int = typer.Option(default=1000, ),
+):
+    """Reflect the media updated since the last initialization or sync in the vector database collection."""
+    with SessionLocal() as db_client:
+        report = sync_all_media(db_client, vector_database_client, collection_name=collection_name, batch_size=batch_size)
+    print(
+        f"✅ {report.n_embedded} media embedded, {report.n_updated} updated in place, {report.n_deleted} deleted."
+    )
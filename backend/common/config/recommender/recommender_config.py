@@ -1,15 +1,72 @@
 from pathlib import Path
+from typing import Literal, Optional
 
 import yaml
 from openai import BaseModel
+from pydantic import Field
+
+
+class RerankerConfiguration(BaseModel):
+    similarity_weight: float = 1.0      # search score of the candidate, relative to the best one
+    keyword_weight: float = 0.3         # share of the query keywords among the candidate's content descriptors
+    score_weight: float = 0.2           # candidate score, scaled to [0, 1]
+    mmr_lambda: float = 0.7             # 1 ranks by relevance only, lower values favor diversity
+    mmr_pool_size: int = 50             # number of most relevant candidates considered for diversification
+
+
+class KeywordExpansionConfiguration(BaseModel):
+    mode: Literal["off", "boost", "filter"] = "off"     # boost reranks with the resolved tags, filter requires one of them
+    tags_per_keyword: int = 3           # number of nearest content descriptors each keyword resolves to
+    min_similarity: float = 0.5         # content descriptors less similar to the keyword are ignored
+
+
+class AdaptiveSearchConfiguration(BaseModel):
+    enabled: bool = False               # estimate how many media match the filter and adapt the search strategy
+    exact_max_candidates: int = 1000    # filters matching at most this many media are searched exactly (no HNSW)
+    selective_fraction: float = 0.1     # filters matching less than this share of the collection widen the HNSW beam
+    selective_hnsw_ef: int = 256        # HNSW beam width of selective filtered searches
+    loose_k_factor: float = 1.0         # loose or no filters retrieve top_k * loose_k_factor candidates for the reranker
+
+
+class MultiVectorConfiguration(BaseModel):
+    enabled: bool = False               # index tag and summary chunk vectors, and search them with max-sim fusion
+    summary_chunk_words: int = 200      # summaries longer than this are also embedded in chunks of this many words
+    max_summary_chunks: int = 4         # bounds the embeddings of very long summaries
+
+
+class MediaCollectionConfiguration(BaseModel):
+    # Storage and indexing settings, applied when the media collection is created
+    on_disk: bool = False               # memory-map the original vectors from disk instead of keeping them in RAM
+    quantization: Literal["none", "scalar", "binary"] = "none"  # compressed copy of the vectors, searched in RAM
+    quantization_quantile: float = 0.99 # scalar quantization bounds ignore this share of extreme values
+    quantization_always_ram: bool = True    # keep the quantized vectors in RAM even when the originals are on disk
+    hnsw_m: int = 16                    # edges per node of the HNSW graph, more improves recall and costs memory
+    hnsw_ef_construct: int = 100        # beam width when building the graph, more improves recall and slows indexing
+    # Search settings, applied to every search
+    search_hnsw_ef: Optional[int] = None    # beam width at search time, None for the Qdrant default
+    rescore: bool = True                # re-score the candidates found with quantized vectors using the original vectors
+    oversampling: float = 2.0           # quantized searches fetch k * oversampling candidates before rescoring
 
 
 class RecommenderConfiguration(BaseModel):
-    embedder: str
+    embedder: str                               # OpenAI model, "onnx:<model directory>" (local CPU model) or "hashing"
     dimensions: int
     prompt_id: str
     top_k: int
     n_selected: int
+    embedding_batch_window_ms: float = 10       # how long a query embedding waits for others to share its request
+    embedding_batch_max_size: int = 64          # maximum number of query embeddings sent in one request
+    hydration: Literal["database", "payload"] = "database"  # where recommended media details are read from
+    hybrid_retrieval: bool = False              # fuse dense and sparse (BM25) searches, needs a media collection with sparse vectors
+    speculative_retrieval: bool = False         # search with the raw query while the LLM processes it
+    speculative_k_factor: int = 5               # the speculative search retrieves top_k * speculative_k_factor candidates
+    reranker: RerankerConfiguration = Field(default_factory=RerankerConfiguration)
+    keyword_expansion: KeywordExpansionConfiguration = Field(default_factory=KeywordExpansionConfiguration)
+    adaptive_search: AdaptiveSearchConfiguration = Field(default_factory=AdaptiveSearchConfiguration)
+    multi_vector: MultiVectorConfiguration = Field(default_factory=MultiVectorConfiguration)   # needs a re-indexed media collection
+    media_collection: MediaCollectionConfiguration = Field(default_factory=MediaCollectionConfiguration)
+    prewarm_refresh_seconds: float = 300        # how often the API reloads the prewarmed queries
+    local_query_min_confidence: Optional[float] = 0.8   # skip the LLM when the local extractor is this confident, None to always use the LLM
 
 
 def load_recommender_config(path: str | Path) -> RecommenderConfiguration:
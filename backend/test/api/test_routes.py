@@ -0,0 +1,60 @@
+import json
+
+from fastapi.testclient import TestClient
+from qdrant_client.http.models import ScoredPoint
+
+from app.api.routes import app, MAX_BATCH_QUERIES, MAX_BATCH_CONCURRENCY
+from app.db.models import Media, MediaType, Status
+from app.recommender.models import ScoreRange
+
+
+def test_recommend_stream(monkeypatch):
+    async def fake_stream_recommendations(user_query, cfg):
+        yield "constraints", ScoreRange(min=8.0, max=None)
+        yield "candidates", [ScoredPoint(id=1, version=0, score=0.9, payload={"title": "Gundam"})]
+        yield "media", [Media(title="Gundam", type=MediaType.TV, status=Status.FINISHED, score=8.456)]
+
+    monkeypatch.setattr("app.api.routes.stream_recommendations", fake_stream_recommendations)
+
+    with TestClient(app) as client:
+        response = client.post("/recommend/stream", json={"query": "mecha"})
+
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [event["event"] for event in events] == ["constraints", "candidates", "media"]
+    assert events[0]["data"] == {"min": 8.0, "max": None}
+    assert events[1]["data"] == [{"media_id": 1, "title": "Gundam"}]
+    assert events[2]["data"][0]["title"] == "Gundam"
+    assert events[2]["data"][0]["score"] == 8.46
+
+
+def test_recommend_stream_reports_errors(monkeypatch):
+    async def failing_stream_recommendations(user_query, cfg):
+        raise RuntimeError("LLM unavailable")
+        yield  # makes this function an async generator
+
+    monkeypatch.setattr("app.api.routes.stream_recommendations", failing_stream_recommendations)
+
+    with TestClient(app) as client:
+        response = client.post("/recommend/stream", json={"query": "mecha"})
+
+    assert json.loads(response.text) == {"event": "error", "data": "LLM unavailable"}
+
+
+def test_recommend_more_rejects_unknown_cursor():
+    with TestClient(app) as client:
+        response = client.post("/recommend/more", json={"cursor": "unknown"})
+
+    assert response.status_code == 404
+
+
+def test_recommend_batch_rejects_invalid_requests():
+    client = TestClient(app)
+    for body in [
+        {"queries": ["mecha"], "max_concurrency": 0},
+        {"queries": ["mecha"], "max_concurrency": -1},
+        {"queries": ["mecha"], "max_concurrency": MAX_BATCH_CONCURRENCY + 1},
+        {"queries": []},
+        {"queries": ["mecha"] * (MAX_BATCH_QUERIES + 1)},
+    ]:
+        assert client.post("/recommend/batch", json=body).status_code == 422
@@ -0,0 +1,34 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_catalog_version(tmp_path, monkeypatch):
+    # Catalog updates are signalled through a file, keep tests from writing it in the working directory
+    monkeypatch.setattr("app.services.catalog_service.CATALOG_VERSION_FILE", str(tmp_path / "catalog_version.json"))
+    monkeypatch.setattr("app.services.catalog_service.MEDIA_UPDATES_FILE", str(tmp_path / "media_updates.json"))
+
+
+@pytest.fixture(autouse=True)
+def isolated_embedding_store(tmp_path, monkeypatch):
+    # Use a fresh embedding store for each test instead of the persistent one
+    monkeypatch.setattr("app.services.embedding_store.EMBEDDING_STORE_PATH", str(tmp_path / "embedding_store.sqlite3"))
+    monkeypatch.setattr("app.services.embedding_store._embedding_store", None)
+
+
+@pytest.fixture(autouse=True)
+def isolated_query_log(tmp_path, monkeypatch):
+    # Use a fresh query log for each test instead of the persistent one
+    monkeypatch.setattr("app.services.query_log.QUERY_LOG_PATH", str(tmp_path / "query_log.sqlite3"))
+    monkeypatch.setattr("app.services.query_log._query_log", None)
+
+
+@pytest.fixture(autouse=True)
+def isolated_sync_state(tmp_path, monkeypatch):
+    # Keep tests from writing the vector database sync state in the working directory
+    monkeypatch.setattr("app.vector_db.sync_state.SYNC_STATE_FILE", str(tmp_path / "vdb_sync_state.json"))
+
+
+@pytest.fixture(autouse=True)
+def isolated_checkpoints(tmp_path, monkeypatch):
+    # Keep tests from resuming from, or writing, the checkpoints of real runs
+    monkeypatch.setattr("app.services.checkpoint.CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import logging
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app.api.routes import app
+from app.monitoring.metrics import track_stage, track_dependency, record_cache_lookup
+from app.monitoring.structured_logging import JsonFormatter
+
+
+def sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_track_stage_records_latency_and_errors():
+    labels = {"stage": "test_stage"}
+    count_before = sample("osusume_recommender_stage_duration_seconds_count", labels)
+    errors_before = sample("osusume_recommender_stage_errors_total", labels)
+
+    with track_stage("test_stage"):
+        pass
+    with pytest.raises(ValueError):
+        with track_stage("test_stage"):
+            raise ValueError()
+
+    assert sample("osusume_recommender_stage_duration_seconds_count", labels) == count_before + 2
+    assert sample("osusume_recommender_stage_errors_total", labels) == errors_before + 1
+
+
+def test_cancellation_is_not_an_error():
+    stage_labels = {"stage": "cancelled_stage"}
+    dependency_labels = {"dependency": "cancelled_dependency", "operation": "op"}
+
+    async def cancelled():
+        with track_stage("cancelled_stage"), track_dependency("cancelled_dependency", "op"):
+            await asyncio.sleep(10)
+
+    async def main():
+        task = asyncio.create_task(cancelled())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+    assert sample("osusume_recommender_stage_errors_total", stage_labels) == 0
+    assert sample("osusume_dependency_request_errors_total", dependency_labels) == 0
+    assert sample("osusume_recommender_stage_duration_seconds_count", stage_labels) == 1
+
+
+def test_track_dependency_records_latency():
+    labels = {"dependency": "test_dependency", "operation": "op"}
+    count_before = sample("osusume_dependency_request_duration_seconds_count", labels)
+
+    with track_dependency("test_dependency", "op"):
+        pass
+
+    assert sample("osusume_dependency_request_duration_seconds_count", labels) == count_before + 1
+
+
+def test_metrics_endpoint_exposes_prometheus_text():
+    record_cache_lookup("test_cache", hit=True)
+
+    with TestClient(app) as client:
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'osusume_cache_requests_total{cache="test_cache",result="hit"}' in response.text
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord("app.test", logging.DEBUG, __file__, 1, "Embedding %d queries", (3,), None)
+    record.stage = "embed"
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "Embedding 3 queries"
+    assert entry["level"] == "DEBUG"
+    assert entry["stage"] == "embed"
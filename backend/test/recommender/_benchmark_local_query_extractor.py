@@ -0,0 +1,79 @@
+# Benchmark, prefixed with underscore to not be run automatically with pytest.
+# Measures how often the local rule-based query extractor is confident enough to skip the LLM on a sample of
+# queries, and the latency saved by doing so. The vocabulary is a sample of the content descriptors of the catalog,
+# and the LLM latency is the typical duration of a query processing call.
+import statistics
+import time
+
+from app.recommender.local_query_extractor import extract_query
+from common.config.recommender.recommender_config import get_recommender_config
+
+LLM_LATENCY = 0.8
+N_REPETITIONS = 100
+
+VOCABULARY = frozenset([
+    "action", "adventure", "comedy", "drama", "fantasy", "horror", "mecha", "mystery", "psychological", "romance",
+    "sci-fi", "slice of life", "sports", "supernatural", "thriller", "isekai", "shounen", "shoujo", "seinen", "josei",
+    "school", "space", "military", "music", "historical", "magic", "time travel", "coming of age", "cyberpunk",
+    "post-apocalyptic", "vampire", "detective", "martial arts", "idol", "cooking", "tragedy", "harem", "samurai",
+])
+
+SAMPLE_QUERIES = [
+    "finished mecha TV anime from the 90s rated above 8",
+    "ongoing isekai manga",
+    "slice of life anime movies released after 2015",
+    "psychological thriller from the late 2000s",
+    "completed romance manhwa rated 8 or higher",
+    "sports anime from the 80s",
+    "cyberpunk movies before 2000",
+    "currently airing fantasy with a score of at least 7.5",
+    "space opera with military themes",
+    "horror manga that is not finished",
+    "samurai historical drama",
+    "comedy school anime between 2005 and 2012",
+    "something like Cowboy Bebop but darker",
+    "a sad anime that will make me cry",
+    "anime where the main character is overpowered from the start",
+    "romance without harem",
+    "shows similar to Steins;Gate",
+    "a cozy anime to watch with my family",
+    "mystery detective light novels",
+    "upcoming shounen adaptations",
+    "vampire anime rated below 6",
+    "idol music anime from 2018",
+    "post-apocalyptic adventure",
+    "what should I watch after finishing Attack on Titan?",
+    "underrated seinen manga with a mature story",
+]
+
+
+def test_local_query_extractor_benchmark():
+    min_confidence = get_recommender_config().local_query_min_confidence or 0.8
+
+    durations = []
+    fallbacks = []
+    for query in SAMPLE_QUERIES:
+        start = time.perf_counter()
+        for _ in range(N_REPETITIONS):
+            extraction = extract_query(query, VOCABULARY)
+        durations.append((time.perf_counter() - start) / N_REPETITIONS)
+        if extraction.confidence < min_confidence:
+            fallbacks.append((query, extraction.confidence, extraction.unknown_words))
+
+    fallback_rate = len(fallbacks) / len(SAMPLE_QUERIES)
+    mean_duration = statistics.mean(durations)
+    # Queries processed locally save the LLM call, those that fall back pay for the local extraction on top of it
+    saved_per_query = (1 - fallback_rate) * LLM_LATENCY - mean_duration
+
+    print(f"Minimum confidence: {min_confidence}")
+    print(f"Fallback rate: {len(fallbacks)}/{len(SAMPLE_QUERIES)} ({fallback_rate:.0%})")
+    print(f"Local extraction: {mean_duration * 1000:.3f} ms mean, {max(durations) * 1000:.3f} ms max")
+    print(f"Latency saved: {saved_per_query * 1000:.0f} ms per query on average "
+          f"(assuming {LLM_LATENCY * 1000:.0f} ms per LLM call)")
+    print("Queries left to the LLM:")
+    for query, confidence, unknown_words in fallbacks:
+        print(f"  {confidence:.2f}  {query!r}  unknown: {unknown_words}")
+
+
+if __name__ == "__main__":
+    test_local_query_extractor_benchmark()
@@ -0,0 +1,47 @@
+# Benchmark, prefixed with underscore to not be run automatically with pytest.
+# Measures the duration of rerank on several hundred candidates with full-size vectors and payloads.
+import random
+import statistics
+import time
+
+from qdrant_client.http.models import ScoredPoint
+
+from app.recommender.reranker import rerank
+from common.config.recommender.recommender_config import get_recommender_config
+
+DIMENSIONS = 1536
+N_SELECTED = 5
+N_REPETITIONS = 50
+DESCRIPTORS = [f"descriptor {i}" for i in range(300)]
+
+
+def make_candidates(n_candidates):
+    return [
+        ScoredPoint(
+            id=i, version=0, score=random.uniform(0.2, 0.7),
+            vector=[random.gauss(0, 1) for _ in range(DIMENSIONS)],
+            payload={
+                "score": random.choice([None, round(random.uniform(4, 9.5), 1)]),
+                "content_descriptors": random.sample(DESCRIPTORS, 12),
+            },
+        )
+        for i in range(n_candidates)
+    ]
+
+
+def test_reranker_benchmark():
+    cfg = get_recommender_config().reranker
+    keywords = random.sample(DESCRIPTORS, 4)
+    for n_candidates in (10, 100, 300, 500):
+        candidates = make_candidates(n_candidates)
+        durations = []
+        for _ in range(N_REPETITIONS):
+            start = time.perf_counter()
+            rerank(candidates, n_selected=N_SELECTED, keywords=keywords, cfg=cfg)
+            durations.append(time.perf_counter() - start)
+        print(f"{n_candidates:>4} candidates: {statistics.median(durations) * 1000:.2f} ms median, "
+              f"{max(durations) * 1000:.2f} ms max")
+
+
+if __name__ == "__main__":
+    test_reranker_benchmark()
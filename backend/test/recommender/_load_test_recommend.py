@@ -0,0 +1,156 @@
+# Load test, prefixed with underscore to not be run automatically with pytest.
+# Compares the concurrent throughput of /recommend when the pipeline blocks the event loop (previous behaviour)
+# and when it is fully asynchronous. External dependencies are replaced with fakes that only simulate their latency,
+# so the test can run without OpenAI, Qdrant or Postgres.
+import asyncio
+import json
+import tempfile
+import time
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI
+
+import app.recommender.query_processor as query_processor
+import app.recommender.retriever as retriever
+import app.services.embedding_store as embedding_store
+from app.api.models import convert_media
+from app.api.routes import app as async_app, QueryRequest
+from app.clients.openai_client import openai_client, async_openai_client
+from app.db.models import MediaType, Status
+from app.recommender.cache import recommendation_cache
+from app.recommender.pipeline import get_recommendations
+from app.recommender.retriever import media_cache
+from app.vector_db.vector_database import vector_database_client, async_vector_database_client
+from common.config.recommender.recommender_config import get_recommender_config
+
+LLM_LATENCY = 0.8
+EMBEDDING_LATENCY = 0.15
+VECTOR_DATABASE_LATENCY = 0.02
+DATABASE_LATENCY = 0.01
+
+N_REQUESTS = 50
+
+LLM_RESPONSE = json.dumps({
+    "embedding_text": "a finished mecha anime",
+    "keywords": ["mecha", "space"],
+    "hard_constraints": {
+        "score_range": {"min": 8, "max": None},
+        "type": {"include": ["TV"], "exclude": []},
+        "date_range": {"start": "1990-01", "end": "1999-12"},
+        "status": {"include": ["FINISHED"], "exclude": []},
+    },
+})
+
+FAKE_MEDIA = [
+    SimpleNamespace(
+        media_id=i, title=f"Media {i}", type=MediaType.TV, external_url=None, image_url=None,
+        status=Status.FINISHED, score=8.5
+    )
+    for i in range(5)
+]
+
+
+class FakeResult:
+    def all(self):
+        return FAKE_MEDIA
+
+
+class FakeSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def execute(self, query):
+        time.sleep(DATABASE_LATENCY)
+        return FakeResult()
+
+
+class FakeAsyncSession(FakeSession):
+    async def execute(self, query):
+        await asyncio.sleep(DATABASE_LATENCY)
+        return FakeResult()
+
+
+def install_fakes():
+    def get_response_from_prompt_id(user_input, prompt_id):
+        time.sleep(LLM_LATENCY)
+        return LLM_RESPONSE
+
+    async def get_response_from_prompt_id_async(user_input, prompt_id):
+        await asyncio.sleep(LLM_LATENCY)
+        return LLM_RESPONSE
+
+    def get_embeddings(texts, model, dimensions):
+        time.sleep(EMBEDDING_LATENCY)
+        return [[0.0] * dimensions for _ in texts]
+
+    def query_points(**kwargs):
+        time.sleep(VECTOR_DATABASE_LATENCY)
+        return SimpleNamespace(points=[SimpleNamespace(id=i) for i in range(kwargs["limit"])])
+
+    async def query_points_async(**kwargs):
+        await asyncio.sleep(VECTOR_DATABASE_LATENCY)
+        return SimpleNamespace(points=[SimpleNamespace(id=i) for i in range(kwargs["limit"])])
+
+    openai_client.get_response_from_prompt_id = get_response_from_prompt_id
+    openai_client.get_embeddings = get_embeddings
+    async_openai_client.get_response_from_prompt_id = get_response_from_prompt_id_async
+    vector_database_client.query_points = query_points
+    async_vector_database_client.query_points = query_points_async
+    retriever.SessionLocal = FakeSession
+    retriever.AsyncSessionLocal = FakeAsyncSession
+    # Every query goes through the (slow) LLM, which is what this test is about
+    query_processor.process_query_locally = lambda *args: None
+
+
+# Reproduces the previous route, where the async endpoint called the blocking pipeline
+blocking_app = FastAPI()
+
+
+@blocking_app.post("/recommend")
+async def recommend_blocking(request: QueryRequest):
+    recommendations = get_recommendations(request.query, get_recommender_config())
+    recommendations_response = [convert_media(rec) for rec in recommendations]
+    return {
+        "message": " ; ".join(str(rec) for rec in recommendations_response)
+    }
+
+
+async def run_load(app, n_requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/recommend", json={"query": f"finished mecha TV anime from the 90s #{i}"})
+            for i in range(n_requests)
+        ])
+        elapsed = time.perf_counter() - start
+
+    assert all(response.status_code == 200 for response in responses)
+    return elapsed
+
+
+def test_recommend_load():
+    install_fakes()
+    for name, app in [("blocking", blocking_app), ("async", async_app)]:
+        # Start each run cold
+        recommendation_cache.clear()
+        media_cache.clear()
+        embedding_store._embedding_store = None
+        embedding_store.EMBEDDING_STORE_PATH = tempfile.mktemp(suffix=".sqlite3")
+        elapsed = asyncio.run(run_load(app, N_REQUESTS))
+        print(f"{name:>8}: {N_REQUESTS} concurrent requests in {elapsed:.2f}s "
+              f"({N_REQUESTS / elapsed:.1f} req/s)")
+
+
+if __name__ == "__main__":
+    test_recommend_load()
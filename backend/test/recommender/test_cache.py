@@ -0,0 +1,85 @@
+import pytest
+
+from app.recommender.cache import TTLCache, make_recommendation_cache_key, hash_config
+from app.services.catalog_service import mark_catalog_updated, MEDIA_CATALOG, get_catalog_version, \
+    get_catalog_versions
+from app.services.openai_service import QueryValidationError
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+
+@pytest.fixture
+def config():
+    return RecommenderConfiguration(
+        embedder="embedder_model",
+        dimensions=123,
+        prompt_id="123abc",
+        top_k=10,
+        n_selected=5,
+    )
+
+
+def test_cache_hit_and_miss():
+    cache = TTLCache("test", max_size=2)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_contains_does_not_count_lookups():
+    cache = TTLCache("test", max_size=2)
+    cache.set("a", 1)
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TTLCache("test", max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_cache_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.recommender.cache.time.monotonic", lambda: now[0])
+    cache = TTLCache("test", max_size=2, ttl_seconds=10)
+    cache.set("a", 1)
+    now[0] += 11
+    assert cache.get("a") is None
+
+
+def test_cache_cleared_when_version_changes():
+    version = [1]
+    cache = TTLCache("test", max_size=2, version_provider=lambda: version[0])
+    cache.set("a", 1)
+    version[0] = 2
+    assert cache.get("a") is None
+
+
+def test_catalog_update_changes_version():
+    before = get_catalog_version()
+    mark_catalog_updated(MEDIA_CATALOG)
+    assert get_catalog_version() != before
+    assert MEDIA_CATALOG in get_catalog_versions()
+
+
+def test_cache_key_normalizes_query(config):
+    assert make_recommendation_cache_key("  mecha   anime ", config) == make_recommendation_cache_key("mecha anime", config)
+
+
+def test_cache_key_depends_on_config(config):
+    other_config = config.model_copy(update={"top_k": 20})
+    assert hash_config(config) != hash_config(other_config)
+    assert make_recommendation_cache_key("mecha", config) != make_recommendation_cache_key("mecha", other_config)
+
+
+def test_cache_key_rejects_invalid_query(config):
+    with pytest.raises(QueryValidationError):
+        make_recommendation_cache_key("   ", config)
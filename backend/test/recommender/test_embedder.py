@@ -1,7 +1,9 @@
+import asyncio
+
 import pytest
 
 from app.db.models import MediaType, Status
-from app.recommender.embedder import embed_processed_query
+from app.recommender.embedder import embed_processed_query, embed_processed_query_async
 from app.recommender.models import ProcessedRecommenderQuery, RecommenderQueryHardConstraints, ScoreRange, \
     TypeConstraints, DateRange, StatusConstraints, EmbeddedRecommenderQuery
 
@@ -35,3 +37,16 @@ def test_embed_processed_query(monkeypatch, sample_processed_query):
     # Assertions
     assert isinstance(result, EmbeddedRecommenderQuery)
     assert result.vector == [0.1, 0.2, 0.3]
+
+
+def test_embed_processed_query_async(monkeypatch, sample_processed_query):
+    async def fake_embedding(text, model, dimensions):
+        assert text == "An anime with action and adventure, action, adventure"
+        return [0.1, 0.2, 0.3]
+
+    monkeypatch.setattr("app.recommender.embedder.get_embedding_async", fake_embedding)
+
+    result = asyncio.run(embed_processed_query_async(query=sample_processed_query, model="model", dimensions=3))
+
+    assert isinstance(result, EmbeddedRecommenderQuery)
+    assert result.vector == [0.1, 0.2, 0.3]
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from qdrant_client.http.models import ScoredPoint
+
+from app.recommender.keyword_expander import expand_keywords_async, expand_keywords_batch_async, keyword_cache
+from app.services.catalog_service import mark_catalog_updated, VECTOR_CATALOG
+from common.config.recommender.recommender_config import RecommenderConfiguration, KeywordExpansionConfiguration
+
+TAGS = {
+    "robots": ["mecha", "robot"],
+    "space": ["space", "space opera"],
+    "giant robots": ["mecha"],
+}
+
+
+def make_config(mode="boost"):
+    return RecommenderConfiguration(
+        embedder="embedder_model",
+        dimensions=3,
+        prompt_id="123abc",
+        top_k=3,
+        n_selected=2,
+        keyword_expansion=KeywordExpansionConfiguration(mode=mode, tags_per_keyword=2, min_similarity=0.4),
+    )
+
+
+@pytest.fixture
+def vdb_requests(monkeypatch):
+    keyword_cache.clear()
+    requests = []
+
+    async def fake_embedding(text, model, dimensions):
+        return [float(len(text))]
+
+    async def fake_nearest_content_descriptors(vectors, k, score_threshold=None):
+        assert (k, score_threshold) == (2, 0.4)
+        keywords_by_length = {float(len(keyword)): keyword for keyword in TAGS}
+        requests.append([keywords_by_length[vector[0]] for vector in vectors])
+        return [
+            [
+                ScoredPoint(id=i, version=0, score=0.9, payload={"content_descriptor": tag})
+                for i, tag in enumerate(TAGS[keywords_by_length[vector[0]]])
+            ]
+            for vector in vectors
+        ]
+
+    monkeypatch.setattr("app.recommender.keyword_expander.get_embedding_async", fake_embedding)
+    monkeypatch.setattr(
+        "app.recommender.keyword_expander.get_nearest_content_descriptors_async", fake_nearest_content_descriptors
+    )
+    yield requests
+    keyword_cache.clear()
+
+
+def test_keywords_resolved_in_one_batch_and_cached(vdb_requests):
+    tags = asyncio.run(expand_keywords_async(["Robots", "space", "robots "], make_config()))
+
+    assert tags == ["mecha", "robot", "space", "space opera"]
+    assert vdb_requests == [["robots", "space"]]
+
+    # Only the new keyword is searched
+    tags = asyncio.run(expand_keywords_async(["giant robots", "space"], make_config()))
+    assert tags == ["mecha", "space", "space opera"]
+    assert vdb_requests[1:] == [["giant robots"]]
+
+    # Re-indexing the content descriptors invalidates the cache
+    mark_catalog_updated(VECTOR_CATALOG)
+    asyncio.run(expand_keywords_async(["space"], make_config()))
+    assert vdb_requests[2:] == [["space"]]
+
+
+def test_batch_expansion_shares_one_request(vdb_requests):
+    tags = asyncio.run(expand_keywords_batch_async([["robots"], [], ["space", "robots"]], make_config()))
+
+    assert tags == [["mecha", "robot"], [], ["space", "space opera", "mecha", "robot"]]
+    assert vdb_requests == [["robots", "space"]]
+
+
+def test_disabled_expansion(vdb_requests):
+    assert asyncio.run(expand_keywords_async(["robots"], make_config(mode="off"))) == []
+    assert vdb_requests == []
+
+
+def test_failed_expansion_returns_no_tags(monkeypatch, vdb_requests):
+    async def failing_search(vectors, k, score_threshold=None):
+        raise ConnectionError("Qdrant is down")
+
+    monkeypatch.setattr("app.recommender.keyword_expander.get_nearest_content_descriptors_async", failing_search)
+    assert asyncio.run(expand_keywords_async(["robots"], make_config())) == []
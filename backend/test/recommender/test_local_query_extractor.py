@@ -0,0 +1,102 @@
+import pytest
+
+from app.recommender.local_query_extractor import extract_query
+
+VOCABULARY = frozenset([
+    "mecha", "space", "romance", "slice of life", "action", "comedy", "isekai", "psychological", "time travel",
+    "horror", "coming of age", "school", "music",
+])
+
+
+def test_extracts_all_constraints():
+    extraction = extract_query("finished mecha TV anime from the 90s rated above 8", VOCABULARY)
+
+    assert extraction.confidence == 1.0
+    assert extraction.raw_query == {
+        "embedding_text": "mecha anime",
+        "keywords": ["mecha"],
+        "hard_constraints": {
+            "score_range": {"min": 8.0, "max": None},
+            "type": {"include": ["TV"], "exclude": []},
+            "date_range": {"start": "1990-01", "end": "1999-12"},
+            "status": {"include": ["FINISHED"], "exclude": []},
+        },
+    }
+
+
+@pytest.mark.parametrize("query,include,exclude", [
+    ("romance movies", ["MOVIE"], []),
+    ("isekai manga or light novels", ["MANGA", "NOVEL"], []),
+    ("romance but not a movie", [], ["MOVIE"]),
+    ("show me some non-TV mecha", [], ["TV"]),
+    ("a show about music", [], []),  # "show" alone does not mean a TV series
+])
+def test_types(query, include, exclude):
+    constraints = extract_query(query, VOCABULARY).raw_query["hard_constraints"]
+    assert constraints["type"] == {"include": include, "exclude": exclude}
+
+
+@pytest.mark.parametrize("query,include,exclude", [
+    ("currently airing comedy", ["ONGOING"], []),
+    ("completed horror", ["FINISHED"], []),
+    ("not yet released isekai", ["UPCOMING"], []),
+    ("comedy that is not finished", [], ["FINISHED"]),
+])
+def test_statuses(query, include, exclude):
+    constraints = extract_query(query, VOCABULARY).raw_query["hard_constraints"]
+    assert constraints["status"] == {"include": include, "exclude": exclude}
+
+
+@pytest.mark.parametrize("query,start,end", [
+    ("mecha from the 80s", "1980-01", "1989-12"),
+    ("mecha from the late 2000s", "2006-01", "2009-12"),
+    ("mecha from the nineties", "1990-01", "1999-12"),
+    ("mecha released after 2015", "2016-01", None),
+    ("mecha before 2000", None, "1999-12"),
+    ("mecha between 2005 and 2012", "2005-01", "2012-12"),
+    ("mecha from 2010", "2010-01", "2010-12"),
+    ("school anime from 2020 2021", "2020-01", "2021-12"),
+    ("mecha from 2010 onwards", "2010-01", None),
+    ("mecha 2005 and newer", "2005-01", None),
+    ("mecha 2019 or newer", "2019-01", None),
+    ("mecha from 2012 or later", "2012-01", None),
+    ("mecha 2015 or earlier", None, "2015-12"),
+    ("mecha 2008 and older", None, "2008-12"),
+])
+def test_date_ranges(query, start, end):
+    constraints = extract_query(query, VOCABULARY).raw_query["hard_constraints"]
+    assert constraints["date_range"] == {"start": start, "end": end}
+
+
+@pytest.mark.parametrize("query,score_min,score_max", [
+    ("comedy with a score of at least 7.5", 7.5, None),
+    ("comedy rated 8 or higher", 8.0, None),
+    ("comedy above 6/10", 6.0, None),
+    ("comedy rated below 5", None, 5.0),
+])
+def test_score_ranges(query, score_min, score_max):
+    constraints = extract_query(query, VOCABULARY).raw_query["hard_constraints"]
+    assert constraints["score_range"] == {"min": score_min, "max": score_max}
+
+
+def test_multi_word_keywords():
+    extraction = extract_query("slice-of-life and coming of age anime", VOCABULARY)
+    assert extraction.raw_query["keywords"] == ["slice of life", "coming of age"]
+    assert extraction.confidence == 1.0
+
+
+@pytest.mark.parametrize("query", [
+    "something like Cowboy Bebop but darker",   # unknown title
+    "horror without romance",                   # negated keyword
+    "good anime",                               # nothing to extract
+    "mecha from around 2010",                   # approximate year
+    "mecha 2010 or so",
+])
+def test_low_confidence(query):
+    assert extract_query(query, VOCABULARY).confidence < 0.5
+
+
+def test_partial_confidence():
+    extraction = extract_query("psychological thriller from the 2000s", VOCABULARY)
+    assert extraction.unknown_words == ["thriller"]
+    assert 0.5 < extraction.confidence < 1
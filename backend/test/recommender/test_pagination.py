@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from qdrant_client.http.models import ScoredPoint
+
+from app.recommender.models import EmbeddedRecommenderQuery, ProcessedRecommenderQuery, \
+    RecommenderQueryHardConstraints, ScoreRange, TypeConstraints, DateRange, StatusConstraints
+from app.recommender.pagination import save_session, create_cursor, get_next_page_async, session_store, cursor_store
+from app.services.catalog_service import mark_catalog_updated, MEDIA_CATALOG
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+PROCESSED_QUERY = ProcessedRecommenderQuery(
+    embedding_text="a mecha anime",
+    keywords=["mecha"],
+    hard_constraints=RecommenderQueryHardConstraints(
+        score_range=ScoreRange(min=None, max=None),
+        type=TypeConstraints(included_types=[], excluded_types=[]),
+        date_range=DateRange(start=None, end=None),
+        status=StatusConstraints(included_statuses=[], excluded_statuses=[]),
+    ),
+)
+
+
+def make_config():
+    return RecommenderConfiguration(embedder="embedder_model", dimensions=3, prompt_id="123abc", top_k=5, n_selected=2)
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    session_store.clear()
+    cursor_store.clear()
+    searches = []
+
+    async def fake_retrieve_next_top_k(embedded_query, processed_query, k, offset, required_tags=None, hybrid=False, adaptive=None, multi_vector=False, search_params=None):
+        searches.append((embedded_query.vector, k, offset))
+        # The collection holds media 0 to 6, and the first 5 are the stored candidates
+        return [ScoredPoint(id=i, version=0, score=1.0) for i in range(offset, min(offset + k, 7))]
+
+    async def fake_hydrate_media(points, media_ids, hydration):
+        return media_ids
+
+    monkeypatch.setattr("app.recommender.pagination.retrieve_top_k_async", fake_retrieve_next_top_k)
+    monkeypatch.setattr("app.recommender.pagination.hydrate_media_async", fake_hydrate_media)
+    return searches
+
+
+def test_pages_are_served_from_the_session_then_the_vector_database(searches):
+    points = [ScoredPoint(id=i, version=0, score=1.0 - i / 10, vector=[0.1, 0.2, 0.3]) for i in range(5)]
+    save_session("key", PROCESSED_QUERY, EmbeddedRecommenderQuery(vector=[0.5, 0.5, 0.5]), points, [3, 1, 0, 4, 2])
+
+    page = asyncio.run(get_next_page_async(create_cursor("key", 2), make_config()))
+    assert page.media == [0, 4]
+    assert searches == []
+
+    page = asyncio.run(get_next_page_async(page.cursor, make_config()))
+    assert page.media == [2, 5]
+    assert searches == [([0.5, 0.5, 0.5], 1, 5)]
+
+    page = asyncio.run(get_next_page_async(page.cursor, make_config()))
+    assert page.media == [6]
+    assert page.cursor is None
+
+
+def test_unknown_and_expired_cursors(searches):
+    points = [ScoredPoint(id=i, version=0, score=1.0) for i in range(5)]
+    save_session("key", PROCESSED_QUERY, EmbeddedRecommenderQuery(vector=[0.5, 0.5, 0.5]), points, list(range(5)))
+    cursor = create_cursor("key", 2)
+
+    assert asyncio.run(get_next_page_async("unknown", make_config())) is None
+
+    mark_catalog_updated(MEDIA_CATALOG)
+    assert asyncio.run(get_next_page_async(cursor, make_config())) is None
+    assert create_cursor("key", 2) is None
@@ -0,0 +1,235 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from qdrant_client.http.models import ScoredPoint
+
+from app.recommender.cache import recommendation_cache
+from app.recommender.pagination import create_recommendation_cursor, get_next_page_async, session_store
+from app.recommender.models import EmbeddedRecommenderQuery, ProcessedRecommenderQuery, \
+    RecommenderQueryHardConstraints, ScoreRange, TypeConstraints, DateRange, StatusConstraints
+from app.recommender.pipeline import get_recommendations_async, stream_recommendations, get_recommendations_batch
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    recommendation_cache.clear()
+    session_store.clear()
+    yield
+    recommendation_cache.clear()
+    session_store.clear()
+
+
+PROCESSED_QUERY = ProcessedRecommenderQuery(
+    embedding_text="a mecha anime",
+    keywords=["mecha"],
+    hard_constraints=RecommenderQueryHardConstraints(
+        score_range=ScoreRange(min=8.0, max=None),
+        type=TypeConstraints(included_types=[], excluded_types=[]),
+        date_range=DateRange(start=None, end=None),
+        status=StatusConstraints(included_statuses=[], excluded_statuses=[]),
+    ),
+)
+
+
+def make_config():
+    return RecommenderConfiguration(
+        embedder="embedder_model",
+        dimensions=3,
+        prompt_id="123abc",
+        top_k=3,
+        n_selected=2,
+    )
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    async def fake_process_query(user_query, prompt_id, local_min_confidence=None):
+        calls.append("process_query")
+        return PROCESSED_QUERY
+
+    async def fake_embed(model, dimensions, query):
+        calls.append("embed")
+        assert query == PROCESSED_QUERY
+        return EmbeddedRecommenderQuery(vector=[0.1, 0.2, 0.3])
+
+    async def fake_retrieve_top_k(embedded_query, processed_query, k, required_tags=None, hybrid=False, adaptive=None, multi_vector=False, search_params=None):
+        calls.append("retrieve_top_k")
+        assert k == 3
+        return [ScoredPoint(id=i, version=0, score=1.0 - i / 10) for i in (4, 8, 15)]
+
+    async def fake_hydrate_media(points, media_ids, hydration):
+        calls.append("retrieve_media")
+        return media_ids
+
+    monkeypatch.setattr("app.recommender.pipeline.process_query_async", fake_process_query)
+    monkeypatch.setattr("app.recommender.pipeline.embed_processed_query_async", fake_embed)
+    monkeypatch.setattr("app.recommender.pipeline.retrieve_top_k_async", fake_retrieve_top_k)
+    monkeypatch.setattr("app.recommender.pipeline.hydrate_media_async", fake_hydrate_media)
+    monkeypatch.setattr("app.recommender.pagination.hydrate_media_async", fake_hydrate_media)
+    return calls
+
+
+def test_get_recommendations_async(monkeypatch, calls):
+    async def fake_retrieve_next_top_k(embedded_query, processed_query, k, offset, required_tags=None, hybrid=False, adaptive=None, multi_vector=False, search_params=None):
+        calls.append("retrieve_next_top_k")
+        assert embedded_query.vector == pytest.approx([0.1, 0.2, 0.3]) and (k, offset) == (1, 3)
+        return []
+
+    monkeypatch.setattr("app.recommender.pagination.retrieve_top_k_async", fake_retrieve_next_top_k)
+    result = asyncio.run(get_recommendations_async("some query", make_config()))
+
+    assert result == [4, 8]
+    assert calls == ["process_query", "embed", "retrieve_top_k", "retrieve_media"]
+
+    # Identical queries are served from the cache
+    calls.clear()
+    assert asyncio.run(get_recommendations_async("  some   query ", make_config())) == [4, 8]
+    assert calls == []
+
+    # The next page comes from the ranked candidates, without processing or embedding the query again
+    page = asyncio.run(get_next_page_async(create_recommendation_cursor("some query", make_config()), make_config()))
+    assert page.media == [15]
+    assert page.cursor is None
+    assert calls == ["retrieve_next_top_k", "retrieve_media"]
+
+
+def test_stream_recommendations(calls):
+    async def collect():
+        return [event async for event in stream_recommendations("some query", make_config())]
+
+    events = asyncio.run(collect())
+
+    assert [event for event, _ in events] == ["constraints", "candidates", "media"]
+    assert events[0][1].score_range.min == 8.0
+    assert [point.id for point in events[1][1]] == [4, 8, 15]
+    assert events[2][1] == [4, 8]
+    # The stream saves the session too, so its cached first page can be paginated
+    assert create_recommendation_cursor("some query", make_config()) is not None
+
+
+def test_get_recommendations_batch(monkeypatch):
+    in_flight = {"current": 0, "max": 0}
+    media_queries = []
+
+    async def fake_process_query(user_query, prompt_id, local_min_confidence=None):
+        in_flight["current"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["current"])
+        await asyncio.sleep(0.01)
+        in_flight["current"] -= 1
+        if user_query == "broken":
+            raise ValueError("LLM error")
+        return PROCESSED_QUERY.model_copy(update={"embedding_text": user_query})
+
+    def fake_embed_processed_queries(model, dimensions, queries):
+        return [EmbeddedRecommenderQuery(vector=[float(len(query.embedding_text))]) for query in queries]
+
+    async def fake_retrieve_top_k_batch(embedded_queries, processed_queries, k, required_tags=None, hybrid=False, search_params=None):
+        return [
+            [ScoredPoint(id=int(query.vector[0]) + i, version=0, score=1.0) for i in range(k)]
+            for query in embedded_queries
+        ]
+
+    async def fake_retrieve_media(media_ids):
+        media_queries.append(media_ids)
+        return [SimpleNamespace(media_id=media_id) for media_id in sorted(media_ids)]
+
+    monkeypatch.setattr("app.recommender.pipeline.process_query_async", fake_process_query)
+    monkeypatch.setattr("app.recommender.pipeline.embed_processed_queries", fake_embed_processed_queries)
+    monkeypatch.setattr("app.recommender.pipeline.retrieve_top_k_batch_async", fake_retrieve_top_k_batch)
+    monkeypatch.setattr("app.recommender.pipeline.retrieve_media_async", fake_retrieve_media)
+
+    queries = ["aa", "broken", "aaaa", "a", "   "]
+    results = asyncio.run(get_recommendations_batch(queries, make_config(), max_concurrency=2))
+
+    assert [result.query for result in results] == queries
+    assert [[media.media_id for media in result.media] for result in results] == [[2, 3], [], [4, 5], [1, 2], []]
+    assert results[1].error == "LLM error"
+    assert results[4].error is not None
+    assert in_flight["max"] == 2
+    assert len(media_queries) == 1  # all media are hydrated with one query
+    # Recommendations cached by the batch can be paginated from /recommend
+    assert create_recommendation_cursor("aa", make_config()) is not None
+
+
+@pytest.fixture
+def speculation(monkeypatch, calls):
+    candidates = []
+
+    async def slow_process_query(user_query, prompt_id, local_min_confidence=None):
+        calls.append("process_query")
+        await asyncio.sleep(0.01)  # the speculative search finishes first
+        return PROCESSED_QUERY
+
+    async def fake_embed_raw_query(model, dimensions, user_query):
+        calls.append("embed_raw_query")
+        return EmbeddedRecommenderQuery(vector=[0.3, 0.2, 0.1])
+
+    async def fake_retrieve_unfiltered(embedded_query, k, search_params=None):
+        calls.append("retrieve_unfiltered")
+        assert k == 15
+        return candidates
+
+    monkeypatch.setattr("app.recommender.pipeline.process_query_async", slow_process_query)
+    monkeypatch.setattr("app.recommender.pipeline.embed_raw_query_async", fake_embed_raw_query)
+    monkeypatch.setattr("app.recommender.pipeline.retrieve_unfiltered_top_k_async", fake_retrieve_unfiltered)
+    return candidates
+
+
+def make_speculative_config():
+    return make_config().model_copy(update={"speculative_retrieval": True, "speculative_k_factor": 5})
+
+
+def test_speculative_candidates_used_when_enough_match(calls, speculation):
+    speculation.extend(
+        ScoredPoint(id=i, version=0, score=1.0 - i / 100, payload={"score": score})
+        for i, score in enumerate([9.0, 5.0, 8.5, None, 8.0, 8.2] + [6.0] * 9)
+    )
+
+    result = asyncio.run(get_recommendations_async("some query", make_speculative_config()))
+
+    # Only the candidates with a score of at least 8 are kept
+    assert result == [0, 2]
+    assert sorted(calls) == ["embed_raw_query", "process_query", "retrieve_media", "retrieve_unfiltered"]
+
+
+def test_speculation_falls_back_to_filtered_search(calls, speculation):
+    speculation.extend(ScoredPoint(id=i, version=0, score=1.0, payload={"score": 9.0 - i}) for i in range(15))
+
+    result = asyncio.run(get_recommendations_async("some query", make_speculative_config()))
+
+    # Only 2 of the 15 candidates match, fewer than top_k
+    assert result == [4, 8]
+    assert calls[-3:] == ["embed", "retrieve_top_k", "retrieve_media"]
+
+
+def test_expanded_keywords_filter_and_boost(monkeypatch, calls):
+    searches = []
+    reranked = []
+
+    async def fake_expand_keywords(keywords, cfg):
+        calls.append("expand_keywords")
+        return ["mecha", "robot"]
+
+    async def fake_retrieve_top_k(embedded_query, processed_query, k, required_tags=None, hybrid=False, adaptive=None, multi_vector=False, search_params=None):
+        searches.append(required_tags)
+        return [ScoredPoint(id=1, version=0, score=0.9)]
+
+    def fake_rerank(points, n_selected, keywords, cfg):
+        reranked.append(keywords)
+        return [point.id for point in points]
+
+    monkeypatch.setattr("app.recommender.pipeline.expand_keywords_async", fake_expand_keywords)
+    monkeypatch.setattr("app.recommender.pipeline.retrieve_top_k_async", fake_retrieve_top_k)
+    monkeypatch.setattr("app.recommender.pipeline.rerank", fake_rerank)
+
+    for mode in ("boost", "filter"):
+        cfg = make_config()
+        cfg.keyword_expansion.mode = mode
+        asyncio.run(get_recommendations_async("some query", cfg))
+
+    assert searches == [None, ["mecha", "robot"]]
+    assert reranked == [["mecha", "mecha", "robot"]] * 2
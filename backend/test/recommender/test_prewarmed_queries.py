@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.db.models import MediaType
+from app.recommender.embedder import embed_processed_query_async
+from app.recommender.models import ProcessedRecommenderQuery, RecommenderQueryHardConstraints, ScoreRange, \
+    TypeConstraints, DateRange, StatusConstraints, EmbeddedRecommenderQuery
+from app.recommender.pipeline import prewarm_queries
+from app.recommender.prewarmed_queries import prewarmed_queries
+from app.recommender.query_processor import process_query_async
+from app.services.query_log import get_query_log
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+PROCESSED_QUERY = ProcessedRecommenderQuery(
+    embedding_text="a mecha anime",
+    keywords=["mecha"],
+    hard_constraints=RecommenderQueryHardConstraints(
+        score_range=ScoreRange(min=8.0, max=None),
+        type=TypeConstraints(included_types=[MediaType.TV], excluded_types=[]),
+        date_range=DateRange(start=datetime(2000, 1, 1), end=None),
+        status=StatusConstraints(included_statuses=[], excluded_statuses=[]),
+    ),
+)
+
+
+def make_config():
+    return RecommenderConfiguration(
+        embedder="embedder_model", dimensions=2, prompt_id="123abc", top_k=3, n_selected=2,
+        local_query_min_confidence=None,
+    )
+
+
+@pytest.fixture(autouse=True)
+def empty_table():
+    prewarmed_queries.clear()
+    yield
+    prewarmed_queries.clear()
+
+
+def test_query_log_counts_near_identical_queries():
+    query_log = get_query_log()
+    for query in ["Mecha anime", "  mecha   ANIME. ", "romance", "mecha anime!", ""]:
+        query_log.record(query)
+
+    assert query_log.top_queries(1) == [("mecha anime", 3)]
+    assert query_log.top_queries(5) == [("mecha anime", 3), ("romance", 1)]
+
+
+def test_query_log_counts_in_memory_until_flushed():
+    query_log = get_query_log()
+    query_log.record("mecha anime")
+
+    def stored_counts():
+        return query_log._connection.execute("SELECT query, count FROM queries").fetchall()
+
+    assert stored_counts() == []  # nothing written on the request path
+    query_log.record("mecha anime")
+    query_log.flush()
+    assert stored_counts() == [("mecha anime", 2)]
+    query_log.record("mecha anime")
+    assert query_log.top_queries(1) == [("mecha anime", 3)]  # readers flush first
+
+
+def test_prewarmed_queries_skip_the_llm_and_the_embedder(monkeypatch):
+    processed = []
+
+    def fake_process_query(user_query, prompt_id, local_min_confidence=None):
+        processed.append(user_query)
+        return PROCESSED_QUERY
+
+    def fake_embed_processed_queries(model, dimensions, queries):
+        return [EmbeddedRecommenderQuery(vector=[0.5, 0.25]) for _ in queries]
+
+    async def unavailable(*args, **kwargs):
+        raise AssertionError("prewarmed queries must not call OpenAI")
+
+    monkeypatch.setattr("app.recommender.pipeline.process_query", fake_process_query)
+    monkeypatch.setattr("app.recommender.pipeline.embed_processed_queries", fake_embed_processed_queries)
+    monkeypatch.setattr("app.recommender.query_processor.get_processed_recommender_query_async", unavailable)
+    monkeypatch.setattr("app.recommender.embedder.get_embedding_async", unavailable)
+
+    for query in ["mecha anime", "mecha anime", "romance"]:
+        get_query_log().record(query)
+    assert prewarm_queries(make_config(), top_n=1) == 1
+    assert processed == ["mecha anime"]
+
+    assert prewarmed_queries.load(make_config()) == 1
+    processed_query = asyncio.run(process_query_async("Mecha Anime", "123abc"))
+    assert processed_query == PROCESSED_QUERY
+    embedded_query = asyncio.run(embed_processed_query_async("embedder_model", 2, processed_query))
+    assert embedded_query.vector == [0.5, 0.25]
+
+    # Other prompts and embedders are not served from the table
+    assert prewarmed_queries.get_processed_query("mecha anime", "other_prompt") is None
+    assert prewarmed_queries.get_vector("a mecha anime, mecha", "other_model", 2) is None
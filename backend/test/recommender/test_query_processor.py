@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 from datetime import datetime
 from app.recommender.query_processor import (
@@ -7,6 +9,7 @@ from app.recommender.query_processor import (
     parse_status_constraints,
     parse_hard_constraints,
     process_query,
+    process_query_async,
     ScoreRange,
     DateRange,
     MediaType,
@@ -96,3 +99,48 @@ def test_process_query_integration(monkeypatch, raw_query_dict):
     assert result.hard_constraints.type.included_types[0] == MediaType.TV
     assert result.hard_constraints.date_range.start == datetime(2020, 1, 1)
     assert result.hard_constraints.status.included_statuses[0] == Status.FINISHED
+
+
+def test_process_query_async(monkeypatch, raw_query_dict):
+    async def fake_processed_query(_, __):
+        return raw_query_dict
+
+    monkeypatch.setattr("app.recommender.query_processor.get_processed_recommender_query_async", fake_processed_query)
+
+    result = asyncio.run(process_query_async("any user input", prompt_id="123"))
+    assert isinstance(result, ProcessedRecommenderQuery)
+    assert result.keywords == ["action", "adventure"]
+    assert result.hard_constraints.type.excluded_types == [MediaType.MANGA]
+
+
+# --- Local rule-based processing ---
+
+def test_process_query_locally_skips_llm(monkeypatch):
+    def fail(*args):
+        raise AssertionError("The LLM should not be called")
+
+    monkeypatch.setattr("app.recommender.query_processor.get_processed_recommender_query", fail)
+    monkeypatch.setattr(
+        "app.recommender.query_processor.get_content_descriptor_vocabulary", lambda: frozenset(["mecha"])
+    )
+
+    result = process_query("finished mecha TV anime from the 90s", prompt_id="123", local_min_confidence=0.8)
+    assert result.keywords == ["mecha"]
+    assert result.hard_constraints.type.included_types == [MediaType.TV]
+    assert result.hard_constraints.date_range.end == datetime(1999, 12, 1)
+
+
+def test_process_query_falls_back_to_llm_when_not_confident(monkeypatch, raw_query_dict):
+    async def fake_processed_query(_, __):
+        return raw_query_dict
+
+    async def fake_vocabulary():
+        return frozenset(["mecha"])
+
+    monkeypatch.setattr("app.recommender.query_processor.get_processed_recommender_query_async", fake_processed_query)
+    monkeypatch.setattr("app.recommender.query_processor.get_content_descriptor_vocabulary_async", fake_vocabulary)
+
+    result = asyncio.run(
+        process_query_async("something like Cowboy Bebop but darker", prompt_id="123", local_min_confidence=0.8)
+    )
+    assert result.embedding_text == "An anime with action and adventure"
@@ -0,0 +1,57 @@
+import numpy as np
+from qdrant_client.http.models import ScoredPoint
+
+from app.recommender.reranker import rerank, score_prior, keyword_overlap
+from common.config.recommender.recommender_config import RerankerConfiguration
+
+RELEVANCE_ONLY = RerankerConfiguration(similarity_weight=1.0, keyword_weight=0.0, score_weight=0.0, mmr_lambda=1.0)
+
+
+def make_point(point_id, similarity, score=None, descriptors=(), vector=None):
+    return ScoredPoint(
+        id=point_id, version=0, score=similarity, vector=vector,
+        payload={"score": score, "content_descriptors": list(descriptors)},
+    )
+
+
+def test_ranks_by_similarity():
+    points = [make_point(1, 0.5), make_point(2, 0.9), make_point(3, 0.7)]
+    assert rerank(points, n_selected=2, cfg=RELEVANCE_ONLY) == [2, 3]
+
+
+def test_keywords_and_score_boost_candidates():
+    points = [
+        make_point(1, 0.80, score=6.0, descriptors=["drama"]),
+        make_point(2, 0.78, score=9.0, descriptors=["Mecha", "space"]),
+        make_point(3, 0.79, score=None, descriptors=["mecha"]),
+    ]
+    cfg = RerankerConfiguration(similarity_weight=1.0, keyword_weight=0.3, score_weight=0.2, mmr_lambda=1.0)
+
+    assert rerank(points, n_selected=3, keywords=["mecha", "space"], cfg=cfg) == [2, 3, 1]
+
+
+def test_score_prior_fills_missing_scores_with_the_mean():
+    points = [make_point(1, 0.5, score=6.0), make_point(2, 0.5, score=None), make_point(3, 0.5, score=8.0)]
+    np.testing.assert_allclose(score_prior(points), [0.6, 0.7, 0.8], rtol=1e-6)
+
+
+def test_keyword_overlap():
+    points = [make_point(1, 0.5, descriptors=["mecha", "space"]), make_point(2, 0.5)]
+    np.testing.assert_allclose(keyword_overlap(points, ["Mecha", "comedy"]), [0.5, 0.0])
+
+
+def test_mmr_skips_near_duplicates():
+    points = [
+        make_point(1, 0.90, vector=[1.0, 0.0, 0.0]),
+        make_point(2, 0.89, vector=[0.99, 0.01, 0.0]),   # almost the same as 1
+        make_point(3, 0.80, vector=[0.0, 1.0, 0.0]),
+    ]
+    cfg = RerankerConfiguration(similarity_weight=1.0, keyword_weight=0.0, score_weight=0.0, mmr_lambda=0.5)
+
+    assert rerank(points, n_selected=2, cfg=cfg) == [1, 3]
+    assert rerank(points, n_selected=2, cfg=RELEVANCE_ONLY) == [1, 2]
+
+
+def test_handles_fewer_points_than_selected():
+    assert rerank([make_point(1, 0.5, vector=[1.0, 0.0])], n_selected=5) == [1]
+    assert rerank([], n_selected=5) == []
@@ -2,9 +2,21 @@ import pytest
 from datetime import datetime
 from typing import Optional, List
 
-from qdrant_client.http.models import Filter, FieldCondition, Range, MatchValue, DatetimeRange
+from qdrant_client.http.models import Filter, FieldCondition, Range, MatchValue, DatetimeRange, MatchAny, SearchParams, \
+    QuantizationSearchParams
 
-from app.recommender.retriever import build_filter_from_constraints
+from qdrant_client.http.models import ScoredPoint
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.db.models import Base, Media, MediaType, Status
+from app.recommender.models import MediaRecord
+from app.recommender.retriever import build_filter_from_constraints, hydrate_media, is_payload_fresh, \
+    retrieve_media, media_cache, matches_constraints, choose_search_strategy, get_search_strategy, cardinality_cache, \
+    build_search_params, merge_search_params
+from app.services.catalog_service import mark_catalog_updated, mark_media_updated, MEDIA_CATALOG, VECTOR_CATALOG
+from common.config.recommender.recommender_config import AdaptiveSearchConfiguration, MediaCollectionConfiguration
 
 
 # --- Minimal mock models for testing ---
@@ -103,3 +115,202 @@ def test_status_include_and_exclude():
     f = build_filter_from_constraints(constraints)
     assert any(fc.key == "status" and fc.match.value == "completed" for fc in f.should)
     assert any(fc.key == "status" and fc.match.value == "dropped" for fc in f.must_not)
+
+
+# --- Hydration ---
+
+def make_payload(title, indexed_at):
+    return {
+        "title": title,
+        "type": "TV",
+        "external_url": f"https://anilist.co/{title}",
+        "image_url": None,
+        "status": "FINISHED",
+        "score": 8.0,
+        "indexed_at": indexed_at,
+    }
+
+
+def test_is_payload_fresh():
+    assert is_payload_fresh(make_payload("a", indexed_at=10.0), media_updated_at=5.0)
+    assert not is_payload_fresh(make_payload("a", indexed_at=1.0), media_updated_at=5.0)
+    assert not is_payload_fresh({"title": "a"}, media_updated_at=0.0)
+    assert not is_payload_fresh(None, media_updated_at=0.0)
+
+
+def test_hydrate_media_from_payload_falls_back_for_stale_points(monkeypatch):
+    mark_catalog_updated(MEDIA_CATALOG)
+    mark_media_updated([2])  # only the payload of the media updated since it was indexed is stale
+    points = [
+        ScoredPoint(id=1, version=0, score=0.9, payload=make_payload("fresh", indexed_at=0.0)),
+        ScoredPoint(id=2, version=0, score=0.8, payload=make_payload("stale", indexed_at=0.0)),
+        ScoredPoint(id=3, version=0, score=0.7, payload={"title": "incomplete"}),
+    ]
+    database_queries = []
+
+    def fake_retrieve_media(media_ids):
+        database_queries.append(media_ids)
+        return [MediaRecord(media_id, f"db {media_id}", "TV", None, None, None, None) for media_id in media_ids]
+
+    monkeypatch.setattr("app.recommender.retriever.retrieve_media", fake_retrieve_media)
+
+    media = hydrate_media(points, media_ids=[3, 1, 2], hydration="payload")
+
+    assert [m.title for m in media] == ["db 3", "fresh", "db 2"]
+    assert database_queries == [[3, 2]]
+
+
+def test_hydrate_media_from_database(monkeypatch):
+    monkeypatch.setattr(
+        "app.recommender.retriever.retrieve_media",
+        lambda media_ids: [MediaRecord(media_id, "db", "TV", None, None, None, None) for media_id in media_ids],
+    )
+    points = [ScoredPoint(id=1, version=0, score=0.9, payload=make_payload("fresh", indexed_at=float("inf")))]
+
+    assert [m.title for m in hydrate_media(points, media_ids=[1], hydration="database")] == ["db"]
+
+
+# --- Media retrieval ---
+
+@pytest.fixture
+def media_database(monkeypatch):
+    engine = create_engine("sqlite:///:memory:", echo=False)
+    Base.metadata.create_all(engine)
+    session_local = sessionmaker(bind=engine)
+    with session_local() as session:
+        session.add_all([
+            Media(media_id=1, title="Gundam", type=MediaType.TV, status=Status.FINISHED, score=8.1),
+            Media(media_id=2, title="Akira", type=MediaType.MOVIE, status=None, score=None),
+            Media(media_id=3, title="Berserk", type=MediaType.MANGA, status=Status.ONGOING, score=9.4),
+        ])
+        session.commit()
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    monkeypatch.setattr("app.recommender.retriever.SessionLocal", session_local)
+    media_cache.clear()
+    yield statements
+    media_cache.clear()
+
+
+def test_retrieve_media_keeps_order(media_database):
+    media = retrieve_media([3, 1, 2])
+
+    assert [m.title for m in media] == ["Berserk", "Gundam", "Akira"]
+    assert media[0] == MediaRecord(3, "Berserk", "MANGA", None, None, "ONGOING", 9.4)
+    assert media[2].status is None
+
+
+def test_retrieve_media_only_fetches_uncached_media(media_database):
+    retrieve_media([1, 2])
+    assert len(media_database) == 1
+
+    retrieve_media([2, 1])
+    assert len(media_database) == 1  # served from the cache
+
+    assert [m.title for m in retrieve_media([1, 3])] == ["Gundam", "Berserk"]
+    assert len(media_database) == 2
+
+
+def test_media_cache_invalidated_by_ingestion(media_database):
+    retrieve_media([1])
+    mark_catalog_updated(MEDIA_CATALOG)
+    retrieve_media([1])
+    assert len(media_database) == 2
+
+
+# --- Local filtering ---
+
+@pytest.mark.parametrize("payload,expected", [
+    ({"score": 8.5, "type": "TV", "status": "FINISHED", "start_date": "1995-04-03"}, True),
+    ({"score": 7.0, "type": "TV", "status": "FINISHED", "start_date": "1995-04-03"}, False),   # score too low
+    ({"score": None, "type": "TV", "status": "FINISHED", "start_date": "1995-04-03"}, False),  # no score
+    ({"score": 9.0, "type": "TV", "status": "FINISHED", "start_date": "2001-01-01"}, False),   # too recent
+    ({"score": 9.0, "type": "MANGA", "status": "ONGOING", "start_date": "1995-04-03"}, False),  # excluded type
+    ({"score": 9.0, "type": "OVA", "status": "FINISHED", "start_date": "1995-04-03"}, True),   # included status
+    ({"score": 9.0, "type": "OVA", "status": "UPCOMING", "start_date": "1995-04-03"}, False),  # nothing included
+    (None, False),
+])
+def test_matches_constraints(payload, expected):
+    constraints = RecommenderQueryHardConstraints(
+        ScoreRange(8.0, None),
+        TypeConstraint([MediaType.TV], [MediaType.MANGA]),
+        DateRange(datetime(1990, 1, 1), datetime(1999, 12, 1)),
+        StatusConstraint([Status.FINISHED], []),
+    )
+    assert matches_constraints(payload, constraints) is expected
+
+
+def test_matches_without_constraints():
+    constraints = RecommenderQueryHardConstraints(
+        ScoreRange(None, None),
+        TypeConstraint([], []),
+        DateRange(None, None),
+        StatusConstraint([], [])
+    )
+    assert matches_constraints({}, constraints)
+
+
+def test_required_tags_filter():
+    constraints = RecommenderQueryHardConstraints(
+        ScoreRange(None, None),
+        TypeConstraint([], []),
+        DateRange(None, None),
+        StatusConstraint([], [])
+    )
+    vdb_filter = build_filter_from_constraints(constraints, required_tags=["mecha", "robot"])
+
+    assert vdb_filter.must == [FieldCondition(key="content_descriptors", match=MatchAny(any=["mecha", "robot"]))]
+    assert matches_constraints({"content_descriptors": ["robot", "drama"]}, constraints, ["mecha", "robot"])
+    assert not matches_constraints({"content_descriptors": ["drama"]}, constraints, ["mecha", "robot"])
+
+
+@pytest.mark.parametrize("cardinality, name, k, search_params", [
+    (0, "empty", 0, None),
+    (300, "exact", 10, SearchParams(exact=True)),
+    (5_000, "selective", 10, SearchParams(hnsw_ef=256)),
+    (60_000, "loose", 20, None),
+    (None, "loose", 20, None),
+])
+def test_choose_search_strategy(cardinality, name, k, search_params):
+    cfg = AdaptiveSearchConfiguration(enabled=True, loose_k_factor=2.0)
+    strategy = choose_search_strategy(cardinality, 100_000, 10, cfg)
+
+    assert (strategy.name, strategy.k, strategy.search_params) == (name, k, search_params)
+
+
+def test_search_params_follow_the_collection_settings():
+    assert build_search_params(MediaCollectionConfiguration()) is None
+
+    base = build_search_params(MediaCollectionConfiguration(quantization="scalar", search_hnsw_ef=128, oversampling=3.0))
+    assert base == SearchParams(hnsw_ef=128, quantization=QuantizationSearchParams(rescore=True, oversampling=3.0))
+
+    # The strategy refines the collection settings, and exact searches skip the quantized vectors
+    assert merge_search_params(base, None) == base
+    assert merge_search_params(base, SearchParams(hnsw_ef=256)).hnsw_ef == 256
+    assert merge_search_params(base, SearchParams(hnsw_ef=256)).quantization.oversampling == 3.0
+    assert merge_search_params(base, SearchParams(exact=True)) == SearchParams(
+        exact=True, quantization=QuantizationSearchParams(ignore=True)
+    )
+    assert merge_search_params(None, SearchParams(exact=True)) == SearchParams(exact=True)
+
+
+def test_search_strategy_counts_are_cached_until_reindexing(monkeypatch):
+    counted_filters = []
+
+    def fake_count_media(vdb_filter=None):
+        counted_filters.append(vdb_filter)
+        return 100_000 if vdb_filter is None else 50
+
+    monkeypatch.setattr("app.recommender.retriever.count_media", fake_count_media)
+    cardinality_cache.clear()
+    cfg = AdaptiveSearchConfiguration(enabled=True)
+    vdb_filter = Filter(must=[FieldCondition(key="status", match=MatchValue(value="CANCELLED"))])
+
+    assert get_search_strategy(vdb_filter, 10, cfg).name == "exact"
+    assert get_search_strategy(vdb_filter, 10, cfg).name == "exact"
+    assert counted_filters == [vdb_filter, None]
+
+    mark_catalog_updated(VECTOR_CATALOG)
+    get_search_strategy(vdb_filter, 10, cfg)
+    assert len(counted_filters) == 4
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.recommender.single_flight import SingleFlight
+
+
+def test_concurrent_threads_share_one_call():
+    flights = SingleFlight("test")
+    n_calls = []
+
+    def compute():
+        n_calls.append(1)
+        time.sleep(0.1)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", compute))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["result"] * 5
+    assert len(n_calls) == 1
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+
+def test_concurrent_coroutines_share_one_call():
+    flights = SingleFlight("test")
+    n_calls = []
+
+    async def compute():
+        n_calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*[flights.do_async("key", compute) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert len(n_calls) == 1
+    assert flights.stats()["coalesced"] == 4
+
+
+def test_thread_waits_for_coroutine():
+    flights = SingleFlight("test")
+
+    async def compute():
+        await asyncio.sleep(0.1)
+        return "result"
+
+    async def main():
+        leader = asyncio.create_task(flights.do_async("key", compute))
+        await asyncio.sleep(0.01)
+        follower = await asyncio.to_thread(flights.do, "key", lambda: "not coalesced")
+        return await leader, follower
+
+    assert asyncio.run(main()) == ("result", "result")
+
+
+def test_exception_is_shared_and_key_released():
+    flights = SingleFlight("test")
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flights.do("key", fail)
+
+    assert flights.do("key", lambda: "ok") == "ok"
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flights = SingleFlight("test")
+    n_calls = []
+
+    async def compute():
+        n_calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        leader = asyncio.create_task(flights.do_async("key", compute))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flights.do_async("key", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()  # e.g. the client of the leader disconnected
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "result"
+    assert len(n_calls) == 1
+    assert flights.stats()["in_flight"] == 0
@@ -0,0 +1,40 @@
+from app.services.checkpoint import CheckpointLog, get_checkpoint
+
+
+def test_appended_batches_are_loaded_back(tmp_path):
+    checkpoint = CheckpointLog(tmp_path / "job.log")
+    assert checkpoint.load() == set()
+
+    checkpoint.append([1, 2])
+    checkpoint.append([3])
+
+    assert CheckpointLog(tmp_path / "job.log").load() == {1, 2, 3}
+    assert (tmp_path / "job.log").read_text().splitlines() == ["[1,2]", "[3]"]
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    (tmp_path / "job.log").write_text("[1,2]\n[3,4")
+    checkpoint = CheckpointLog(tmp_path / "job.log")
+    assert checkpoint.load() == {1, 2}
+
+    checkpoint.append([5])
+    assert CheckpointLog(tmp_path / "job.log").load() == {1, 2, 5}
+
+
+def test_log_is_compacted(tmp_path):
+    checkpoint = CheckpointLog(tmp_path / "job.log", compact_every=3)
+    for i in range(6):
+        checkpoint.append([i])
+
+    assert checkpoint.load() == set(range(6))
+    assert len((tmp_path / "job.log").read_text().splitlines()) == 2
+
+    checkpoint.clear()
+    assert checkpoint.load() == set()
+
+
+def test_checkpoints_are_scoped():
+    get_checkpoint("vdb_init", "media", "text-embedding-3-small").append([1])
+
+    assert get_checkpoint("vdb_init", "media", "text-embedding-3-small").load() == {1}
+    assert get_checkpoint("vdb_init", "media", "onnx:/models/e5").load() == set()
@@ -0,0 +1,37 @@
+import math
+
+from app.services.embedders import get_embedder, HashingEmbedder, OpenAIEmbedder
+from app.services.embedding_service import get_embedding, get_embeddings
+from app.services.embedding_store import get_embedding_store
+
+
+def cosine(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def test_get_embedder_selects_backend_from_model_name():
+    assert isinstance(get_embedder("hashing"), HashingEmbedder)
+    assert isinstance(get_embedder("text-embedding-3-small"), OpenAIEmbedder)
+    assert get_embedder("hashing") is get_embedder("hashing")
+
+
+def test_hashing_embedder_is_deterministic_and_normalized():
+    embedder = HashingEmbedder()
+    vector = embedder.embed_text("giant robots fighting in space", 64)
+
+    assert vector == embedder.embed_text("Giant robots, fighting in space!", 64)
+    assert math.isclose(cosine(vector, vector), 1.0)
+    assert embedder.embed_text("", 64) == [0.0] * 64
+
+
+def test_hashing_embedder_favors_shared_words():
+    embedder = HashingEmbedder()
+    query = embedder.embed_text("giant robots fighting in space", 256)
+
+    assert cosine(query, embedder.embed_text("robots fighting in space", 256)) > \
+        cosine(query, embedder.embed_text("a quiet romance at school", 256))
+
+
+def test_hashing_embeddings_skip_the_store():
+    assert get_embedding("mecha", model="hashing", dimensions=8) == get_embeddings(["mecha"], "hashing", 8)[0]
+    assert len(get_embedding_store()) == 0
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from app.services.embedding_batcher import EmbeddingMicroBatcher
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts, model, dimensions):
+        with self.lock:
+            self.calls.append((list(texts), model, dimensions))
+        return [[float(len(text))] * dimensions for text in texts]
+
+
+def test_concurrent_texts_are_sent_in_one_request():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingMicroBatcher(embedder, window_ms=50, max_batch_size=10)
+
+    futures = [batcher.submit(text, "model", 2) for text in ["a", "bb", "ccc", "bb"]]
+
+    assert [future.result(timeout=1) for future in futures] == [[1.0, 1.0], [2.0, 2.0], [3.0, 3.0], [2.0, 2.0]]
+    assert embedder.calls == [(["a", "bb", "ccc"], "model", 2)]
+    assert batcher.stats()["requests_sent"] == 1
+
+
+def test_batches_are_bounded_by_size():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingMicroBatcher(embedder, window_ms=50, max_batch_size=2)
+
+    futures = [batcher.submit(str(i), "model", 1) for i in range(5)]
+    for future in futures:
+        future.result(timeout=1)
+
+    assert all(len(texts) <= 2 for texts, _, _ in embedder.calls)
+    assert sum(len(texts) for texts, _, _ in embedder.calls) == 5
+
+
+def test_models_are_sent_separately():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingMicroBatcher(embedder, window_ms=50)
+
+    first = batcher.submit("a", "model_1", 1)
+    second = batcher.submit("a", "model_2", 1)
+    first.result(timeout=1)
+    second.result(timeout=1)
+
+    assert sorted(model for _, model, _ in embedder.calls) == ["model_1", "model_2"]
+
+
+def test_requests_are_spaced_by_rate_limit():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingMicroBatcher(embedder, window_ms=0, max_requests_per_minute=600)  # one request every 100ms
+
+    start = time.monotonic()
+    batcher.submit("a", "model", 1).result(timeout=1)
+    batcher.submit("b", "model", 1).result(timeout=1)
+
+    assert time.monotonic() - start >= 0.1
+    assert len(embedder.calls) == 2
+
+
+def test_errors_are_propagated_to_every_caller():
+    def failing_embedder(texts, model, dimensions):
+        raise RuntimeError("API down")
+
+    batcher = EmbeddingMicroBatcher(failing_embedder, window_ms=20)
+    futures = [batcher.submit(text, "model", 1) for text in ["a", "b"]]
+
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=1)
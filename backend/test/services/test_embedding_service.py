@@ -0,0 +1,39 @@
+from concurrent.futures import Future
+from unittest.mock import patch
+
+from app.services.embedding_store import get_embedding_store
+from app.services.embedding_service import get_embeddings, get_embedding
+
+
+def fake_vector(text):
+    return [float(len(text))]
+
+
+@patch("app.services.openai_service.tiktoken")  # avoids downloading the tokenizer
+@patch("app.services.openai_service.openai_client")
+def test_get_embeddings_collapses_duplicates_and_reuses_store(mock_client, mock_tiktoken):
+    mock_tiktoken.encoding_for_model.return_value.encode.side_effect = lambda text: text.split()
+    mock_client.get_embeddings_batched.side_effect = lambda texts, **kwargs: [fake_vector(t) for t in texts]
+    get_embedding_store().put("war", [42.0], "text-embedding-3-small", 1)
+
+    vectors = get_embeddings(["action", "war", "action", "drama"], model="text-embedding-3-small", dimensions=1)
+
+    assert vectors == [[6.0], [42.0], [6.0], [5.0]]
+    sent_texts = mock_client.get_embeddings_batched.call_args.kwargs["texts"]
+    assert sent_texts == ["action", "drama"]
+
+    # Second run is served entirely from the store
+    mock_client.get_embeddings_batched.reset_mock()
+    assert get_embeddings(["drama", "action"], model="text-embedding-3-small", dimensions=1) == [[5.0], [6.0]]
+    mock_client.get_embeddings_batched.assert_not_called()
+
+
+@patch("app.services.embedding_service.get_query_embedding_batcher")
+def test_get_embedding_uses_store(mock_get_batcher):
+    future = Future()
+    future.set_result([0.5])
+    mock_get_batcher.return_value.submit.return_value = future
+
+    assert get_embedding("mecha", model="model", dimensions=1) == [0.5]
+    assert get_embedding("mecha", model="model", dimensions=1) == [0.5]
+    mock_get_batcher.return_value.submit.assert_called_once_with(text="mecha", model="model", dimensions=1)
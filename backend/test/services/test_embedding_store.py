@@ -0,0 +1,73 @@
+import pytest
+
+from app.services.embedding_store import EmbeddingStore, make_embedding_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EmbeddingStore(str(tmp_path / "store.sqlite3"), max_entries=3)
+
+
+def test_key_depends_on_model_dimensions_and_text():
+    key = make_embedding_key("action", "model", 3)
+    assert key == make_embedding_key("action", "model", 3)
+    assert key != make_embedding_key("action", "other_model", 3)
+    assert key != make_embedding_key("action", "model", 4)
+    assert key != make_embedding_key("drama", "model", 3)
+
+
+def test_put_and_get(store):
+    store.put_many({"action": [0.5, 0.25], "drama": [1.0, 0.0]}, "model", 2)
+    assert store.get_many(["action", "drama", "war"], "model", 2) == {"action": [0.5, 0.25], "drama": [1.0, 0.0]}
+    assert store.get("action", "other_model", 2) is None
+    assert store.stats()["hits"] == 2
+    assert store.stats()["misses"] == 2
+
+
+def test_evicts_least_recently_used(store, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("app.services.embedding_store.time.time", lambda: now[0])
+    for text in ["a", "b", "c"]:
+        now[0] += 1
+        store.put(text, [1.0], "model", 1)
+
+    now[0] += 1
+    store.get("a", "model", 1)  # "b" is now the least recently used entry
+    now[0] += 1
+    store.put("d", [1.0], "model", 1)
+
+    assert len(store) == 3
+    assert set(store.get_many(["a", "b", "c", "d"], "model", 1)) == {"a", "c", "d"}
+
+
+def test_persists_across_instances(tmp_path):
+    path = str(tmp_path / "store.sqlite3")
+    EmbeddingStore(path).put("action", [0.5], "model", 1)
+    assert EmbeddingStore(path).get("action", "model", 1) == [0.5]
+
+
+def test_reads_defer_last_used_updates(tmp_path, monkeypatch):
+    now = [1.0]
+    monkeypatch.setattr("app.services.embedding_store.time.time", lambda: now[0])
+    store = EmbeddingStore(str(tmp_path / "store.sqlite3"), touch_flush_size=2)
+    store.put_many({"a": [1.0], "b": [1.0]}, "model", 1)
+
+    def last_used(text):
+        key = make_embedding_key(text, "model", 1)
+        return store._connection.execute("SELECT last_used FROM embeddings WHERE key = ?", (key,)).fetchone()[0]
+
+    now[0] = 2.0
+    store.get("a", "model", 1)
+    assert last_used("a") == 1.0  # kept in memory, nothing written by the read
+
+    store.get("b", "model", 1)  # touch_flush_size pending updates are written at once
+    assert last_used("a") == last_used("b") == 2.0
+
+
+def test_stats_since_snapshot(store):
+    store.put("action", [0.5], "model", 1)
+    store.get_many(["action", "drama"], "model", 1)
+    snapshot = store.stats()
+    store.get("action", "model", 1)
+    assert store.stats(since=snapshot) == {"hits": 1, "misses": 0, "hit_rate": 1.0}
+    assert store.stats()["hits"] == 2
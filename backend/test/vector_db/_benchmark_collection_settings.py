@@ -0,0 +1,111 @@
+# Benchmark, prefixed with underscore to not be run automatically with pytest. Needs the Qdrant service and an indexed
+# media collection: a sample of its vectors is indexed into temporary collections with each setting, and searched with
+# held-out vectors as queries.
+# Reports recall@k against exact search, the estimated memory of the vectors and HNSW graph, and the search latency.
+import statistics
+import time
+
+from qdrant_client.models import SearchParams, QuantizationSearchParams, PointStruct, HnswConfigDiff
+
+from app.recommender.retriever import build_search_params
+from app.vector_db.initialize_vdb import build_media_vectors_config, build_quantization_config
+from app.vector_db.vector_database import vector_database_client, DEFAULT_MEDIA_COLLECTION_NAME, DENSE_VECTOR_NAME
+from common.config.recommender.recommender_config import get_recommender_config, MediaCollectionConfiguration
+
+BENCHMARK_COLLECTION_NAME = "media_settings_benchmark"
+N_INDEXED = 20_000
+N_QUERIES = 200
+K = 10
+
+SETTINGS = {
+    "default": MediaCollectionConfiguration(),
+    "hnsw_ef_128": MediaCollectionConfiguration(search_hnsw_ef=128),
+    "hnsw_m_32": MediaCollectionConfiguration(hnsw_m=32, hnsw_ef_construct=200),
+    "on_disk": MediaCollectionConfiguration(on_disk=True),
+    "scalar": MediaCollectionConfiguration(quantization="scalar"),
+    "scalar_on_disk": MediaCollectionConfiguration(quantization="scalar", on_disk=True),
+    "scalar_no_rescore": MediaCollectionConfiguration(quantization="scalar", rescore=False),
+    "binary": MediaCollectionConfiguration(quantization="binary", oversampling=3.0),
+    "binary_on_disk": MediaCollectionConfiguration(quantization="binary", on_disk=True, oversampling=3.0),
+}
+
+
+def sample_vectors(n):
+    vectors, offset = [], None
+    while len(vectors) < n:
+        points, offset = vector_database_client.scroll(
+            collection_name=DEFAULT_MEDIA_COLLECTION_NAME, limit=1000, offset=offset, with_vectors=[DENSE_VECTOR_NAME],
+        )
+        vectors.extend(
+            point.vector[DENSE_VECTOR_NAME] if isinstance(point.vector, dict) else point.vector for point in points
+        )
+        if offset is None:
+            break
+    return vectors[:n]
+
+
+def estimate_ram_bytes(settings: MediaCollectionConfiguration, n_vectors: int, dimensions: int) -> int:
+    """ Vectors and HNSW graph kept in RAM (the layer 0 of the graph has 2 * m links of 4 bytes per node). """
+    ram = 0 if settings.on_disk else n_vectors * dimensions * 4
+    if settings.quantization != "none" and (settings.quantization_always_ram or not settings.on_disk):
+        ram += n_vectors * dimensions // (1 if settings.quantization == "scalar" else 8)
+    return ram + n_vectors * settings.hnsw_m * 2 * 4
+
+
+def create_collection(settings: MediaCollectionConfiguration, vectors, dimensions):
+    cfg = get_recommender_config().model_copy(update={"media_collection": settings, "dimensions": dimensions})
+    vector_database_client.delete_collection(BENCHMARK_COLLECTION_NAME)
+    vector_database_client.create_collection(
+        collection_name=BENCHMARK_COLLECTION_NAME,
+        vectors_config=build_media_vectors_config(cfg),
+        hnsw_config=HnswConfigDiff(m=settings.hnsw_m, ef_construct=settings.hnsw_ef_construct),
+        quantization_config=build_quantization_config(settings),
+    )
+    for start in range(0, len(vectors), 1000):
+        vector_database_client.upsert(
+            collection_name=BENCHMARK_COLLECTION_NAME,
+            points=[PointStruct(id=start + i, vector=vector) for i, vector in enumerate(vectors[start:start + 1000])],
+        )
+    # Wait for the HNSW graph (and quantized vectors) to be built, searches would be exact meanwhile
+    while vector_database_client.get_collection(BENCHMARK_COLLECTION_NAME).status != "green":
+        time.sleep(1)
+
+
+def search(query, params):
+    response = vector_database_client.query_points(
+        collection_name=BENCHMARK_COLLECTION_NAME, query=query, limit=K, search_params=params,
+    )
+    return [point.id for point in response.points]
+
+
+def test_collection_settings_benchmark():
+    vectors = sample_vectors(N_INDEXED + N_QUERIES)
+    indexed, queries = vectors[:-N_QUERIES], vectors[-N_QUERIES:]
+    dimensions = len(vectors[0])
+    print(f"{len(indexed)} vectors of {dimensions} dimensions, {len(queries)} queries, recall@{K}")
+
+    for name, settings in SETTINGS.items():
+        create_collection(settings, indexed, dimensions)
+        params = build_search_params(settings)
+        exact_params = SearchParams(exact=True, quantization=QuantizationSearchParams(ignore=True))
+
+        recalls, durations = [], []
+        for query in queries:
+            expected = set(search(query, exact_params))
+            start = time.perf_counter()
+            found = search(query, params)
+            durations.append(time.perf_counter() - start)
+            recalls.append(len(expected.intersection(found)) / K)
+
+        durations.sort()
+        print(
+            f"{name:>18}: recall {statistics.mean(recalls):.3f}, "
+            f"~{estimate_ram_bytes(settings, len(indexed), dimensions) / 2 ** 20:.0f} MiB RAM, "
+            f"{statistics.median(durations) * 1000:.2f} ms median, "
+            f"{durations[int(len(durations) * 0.95)] * 1000:.2f} ms p95"
+        )
+    vector_database_client.delete_collection(BENCHMARK_COLLECTION_NAME)
+
+
+if __name__ == "__main__":
+    test_collection_settings_benchmark()
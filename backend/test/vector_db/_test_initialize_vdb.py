@@ -1,10 +1,13 @@
 # Integration tests, prefixed with underscore to not be run automatically with pytest
+from itertools import islice
+
 from sqlalchemy import func
 from sqlalchemy.orm import selectinload
 
 from app.db.database import SessionLocal
-from app.db.models import Media, ContentDescriptor
+from app.db.models import ContentDescriptor
 from app.vector_db.initialize_vdb import initialize_media, initialize_content_descriptors
+from app.vector_db.media_reader import stream_media
 from app.vector_db.vector_database import vector_database_client
 
 
@@ -15,13 +18,7 @@ def test_initialize_media():
     vector_database_client.delete_collection(test_collection)
 
     with SessionLocal() as session:
-        media_sample = (
-            session.query(Media)
-            .options(selectinload(Media.content_descriptors))
-            .order_by(func.random())
-            .limit(max_media)
-            .all()
-        )
+        media_sample = list(islice(stream_media(session), max_media))
 
     initialize_media(
         media_list=media_sample,
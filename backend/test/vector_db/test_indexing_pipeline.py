@@ -0,0 +1,108 @@
+import threading
+import time
+from dataclasses import dataclass
+from unittest.mock import MagicMock
+
+from qdrant_client.models import PointStruct
+
+from app.services.checkpoint import CheckpointLog
+from app.vector_db.indexing_pipeline import IndexingPipeline
+
+
+@dataclass
+class FakeMedia:
+    media_id: int
+    summary: str
+
+
+def make_pipeline(tmp_path, build_points, processed_ids=frozenset(), **kwargs):
+    return IndexingPipeline(
+        MagicMock(),
+        "media",
+        build_points=build_points,
+        has_text=lambda media: bool(media.summary),
+        checkpoint=CheckpointLog(tmp_path / "checkpoint.log"),
+        processed_ids=set(processed_ids),
+        **kwargs,
+    )
+
+
+def to_points(batch):
+    return [PointStruct(id=media.media_id, vector=[1.0]) for media in batch]
+
+
+def test_pipeline_indexes_and_checkpoints_streamed_media(tmp_path):
+    media = (FakeMedia(i, "" if i == 3 else "text") for i in range(10))  # a generator, like a database stream
+    pipeline = make_pipeline(tmp_path, to_points, processed_ids={0}, batch_size=4)
+
+    assert pipeline.run(media) == 0
+
+    upserts = pipeline.vdb_client.upsert.call_args_list
+    assert sorted(point.id for call in upserts for point in call.kwargs["points"]) == [1, 2, 4, 5, 6, 7, 8, 9]
+    assert all(call.kwargs["wait"] is False for call in upserts)
+    assert pipeline.checkpoint.load() == {1, 2, 4, 5, 6, 7, 8, 9}
+    assert pipeline.stats["read"].n_items == 10
+    assert pipeline.stats["upsert"].n_items == 8
+
+
+def test_embedding_batches_run_concurrently_and_failures_are_not_checkpointed(tmp_path):
+    in_flight, max_in_flight = [0], [0]
+    lock = threading.Lock()
+
+    def slow_build_points(batch):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        if batch[0].media_id == 0:
+            raise RuntimeError("rate limited")
+        return to_points(batch)
+
+    pipeline = make_pipeline(tmp_path, slow_build_points, batch_size=2, n_embedding_workers=3)
+
+    assert pipeline.run([FakeMedia(i, "text") for i in range(6)]) == 1
+    assert max_in_flight[0] > 1
+    assert pipeline.checkpoint.load() == {2, 3, 4, 5}
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def run_with_timeout(pipeline, media, timeout=5.0):
+    """ Run the pipeline in a thread, return the error it raised, failing the test if it hangs. """
+    errors = []
+
+    def target():
+        try:
+            pipeline.run(media)
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the pipeline hung"
+    return errors[0] if errors else None
+
+
+def test_checkpoint_error_stops_the_pipeline(tmp_path):
+    pipeline = make_pipeline(tmp_path, to_points, batch_size=1, queue_size=1, n_upload_workers=1)
+    pipeline.checkpoint = MagicMock()
+    pipeline.checkpoint.append.side_effect = OSError("disk full")
+
+    error = run_with_timeout(pipeline, (FakeMedia(i, "text") for i in range(50)))
+
+    assert isinstance(error, OSError)
+    assert pipeline.stats["read"].n_items < 50  # the reader stopped early
+
+
+def test_embedding_worker_error_stops_the_pipeline(tmp_path):
+    def interrupted_build_points(batch):
+        raise Interrupted()
+
+    pipeline = make_pipeline(tmp_path, interrupted_build_points, batch_size=1, queue_size=1, n_embedding_workers=1)
+
+    assert isinstance(run_with_timeout(pipeline, [FakeMedia(i, "text") for i in range(50)]), Interrupted)
@@ -1,13 +1,16 @@
-import os
 from dataclasses import field
+from typing import Optional
 from unittest.mock import MagicMock, patch
 
 import pytest
 from pydantic.dataclasses import dataclass
-from qdrant_client.models import VectorParams, Distance
+from qdrant_client.models import VectorParams, Distance, SparseVectorParams, Modifier, HnswConfigDiff, ScalarType
 
-from app.vector_db.initialize_vdb import initialize_media, initialize_content_descriptors, RECOVERY_FILE
-from common.config.recommender.recommender_config import RecommenderConfiguration
+from app.services.checkpoint import get_checkpoint
+from app.vector_db.initialize_vdb import initialize_media, initialize_content_descriptors, chunk_summary, \
+    build_media_collection_params
+from common.config.recommender.recommender_config import RecommenderConfiguration, MultiVectorConfiguration, \
+    MediaCollectionConfiguration
 
 
 @dataclass
@@ -26,7 +29,9 @@ class FakeMedia:
     type: str
     start_date: str
     status: str
-    content_descriptors: list[MockDescriptor]
+    tags: list[str]
+    external_url: Optional[str] = None
+    image_url: Optional[str] = None
 
 
 @pytest.fixture
@@ -40,10 +45,9 @@ def fake_media_entries():
             type="TV",
             start_date="2016-04-03",
             status="Finished",
-            content_descriptors=[
-                MockDescriptor(content_descriptor="action", content_descriptor_id=1),
-                MockDescriptor(content_descriptor="school", content_descriptor_id=2)
-            ],
+            tags=["action", "school"],
+            external_url="https://anilist.co/anime/21459",
+            image_url="https://img.com/mha.jpg",
         ),
         FakeMedia(
             media_id=2,
@@ -53,10 +57,7 @@ def fake_media_entries():
             type="TV",
             start_date="2018-01-11",
             status="Finished",
-            content_descriptors=[
-                MockDescriptor(content_descriptor="drama", content_descriptor_id=3),
-                MockDescriptor(content_descriptor="war", content_descriptor_id=4)
-            ],
+            tags=["drama", "war"],
         ),
     ]
 
@@ -82,46 +83,116 @@ def mock_config():
 
 @patch("app.vector_db.initialize_vdb.get_embeddings")  # Patch where it's imported, not where it's defined
 def test_initialize_media(mock_get_embeddings, fake_media_entries, mock_config):
-    try:
-        # Setup
-        vdb_client = MagicMock()
-
-        mock_get_embeddings.return_value = [
-            [0.1] * 123,
-            [0.2] * 123,
-        ]
-
-        # Call
-        initialize_media(fake_media_entries, vdb_client, collection_name="test_media", config=mock_config)
-
-        # Assertions
-        vdb_client.create_collection.assert_called_once_with(
-            collection_name="test_media",
-            vectors_config=VectorParams(
-                size=123,
-                distance=Distance.COSINE,
-            ),
-        )
-
-        mock_get_embeddings.assert_called_once_with(
-            texts=[
-                "heroes, action, school",
-                "sad, drama, war"
-            ],
-            model="embedder_model",
-            dimensions=123,
-        )
-
-        # Capture the points
-        uploaded_points = vdb_client.upsert.call_args.kwargs["points"]
-
-        assert len(uploaded_points) == 2
-        assert uploaded_points[0].id == 1
-        assert uploaded_points[0].payload["title"] == "My Hero Academia"
-        assert uploaded_points[1].vector == [0.2] * 123
-    finally:
-        if os.path.exists(RECOVERY_FILE):
-            os.remove(RECOVERY_FILE)
+    # Setup
+    vdb_client = MagicMock()
+
+    mock_get_embeddings.return_value = [
+        [0.1] * 123,
+        [0.2] * 123,
+    ]
+
+    # Call
+    initialize_media(fake_media_entries, vdb_client, collection_name="test_media", config=mock_config)
+
+    # Assertions
+    vdb_client.create_collection.assert_called_once_with(
+        collection_name="test_media",
+        vectors_config=VectorParams(
+            size=123,
+            distance=Distance.COSINE,
+            on_disk=False,
+        ),
+        sparse_vectors_config={"sparse": SparseVectorParams(modifier=Modifier.IDF)},
+        hnsw_config=HnswConfigDiff(m=16, ef_construct=100),
+        quantization_config=None,
+    )
+
+    mock_get_embeddings.assert_called_once_with(
+        texts=[
+            "heroes, action, school",
+            "sad, drama, war"
+        ],
+        model="embedder_model",
+        dimensions=123,
+    )
+
+    # Capture the points
+    uploaded_points = vdb_client.upsert.call_args.kwargs["points"]
+
+    assert len(uploaded_points) == 2
+    assert uploaded_points[0].id == 1
+    assert uploaded_points[0].payload["title"] == "My Hero Academia"
+    assert uploaded_points[0].payload["external_url"] == "https://anilist.co/anime/21459"
+    assert uploaded_points[0].payload["image_url"] == "https://img.com/mha.jpg"
+    assert "indexed_at" in uploaded_points[0].payload
+    assert uploaded_points[1].vector[""] == [0.2] * 123
+    assert len(uploaded_points[0].vector["sparse"].indices) == 5  # hero, academia, heroes, action, school ("my" is a stopword)
+
+
+@patch("app.vector_db.initialize_vdb.get_embeddings")
+def test_initialize_media_resumes_from_checkpoint(mock_get_embeddings, fake_media_entries, mock_config):
+    vdb_client = MagicMock()
+    vdb_client.collection_exists.return_value = True
+    checkpoint = get_checkpoint("vdb_init", "test_media", mock_config.embedder, mock_config.dimensions)
+    checkpoint.append([1])
+    mock_get_embeddings.return_value = [[0.2] * 123]
+
+    initialize_media(fake_media_entries, vdb_client, collection_name="test_media", config=mock_config)
+
+    vdb_client.create_collection.assert_not_called()
+    assert mock_get_embeddings.call_args.kwargs["texts"] == ["sad, drama, war"]
+    assert checkpoint.load() == set()  # the run completed
+
+
+def test_media_collection_params(mock_config):
+    mock_config.media_collection = MediaCollectionConfiguration(
+        on_disk=True, quantization="scalar", hnsw_m=32, hnsw_ef_construct=200,
+    )
+    params = build_media_collection_params(mock_config)
+
+    assert params["vectors_config"].on_disk
+    assert params["hnsw_config"] == HnswConfigDiff(m=32, ef_construct=200)
+    assert params["quantization_config"].scalar.type == ScalarType.INT8
+    assert params["quantization_config"].scalar.always_ram
+
+    mock_config.media_collection = MediaCollectionConfiguration(quantization="binary")
+    assert build_media_collection_params(mock_config)["quantization_config"].binary.always_ram
+
+
+def test_chunk_summary():
+    assert chunk_summary("A short summary.", chunk_words=5, max_chunks=3) == []
+    assert chunk_summary("One two three. Four five. Six seven eight nine ten eleven.", chunk_words=5, max_chunks=3) == [
+        "One two three. Four five.",
+        "Six seven eight nine ten",
+        "eleven.",
+    ]
+    assert len(chunk_summary("word " * 100, chunk_words=10, max_chunks=4)) == 4
+
+
+@patch("app.vector_db.initialize_vdb.get_embeddings")
+def test_initialize_media_multi_vector(mock_get_embeddings, fake_media_entries, mock_config):
+    vdb_client = MagicMock()
+    mock_config.multi_vector = MultiVectorConfiguration(enabled=True, summary_chunk_words=2, max_summary_chunks=2)
+    fake_media_entries[1].tags = []
+    fake_media_entries[1].summary = "Sad story. Letters."
+    mock_get_embeddings.side_effect = lambda texts, model, dimensions: [[float(i)] * 3 for i in range(len(texts))]
+
+    initialize_media(fake_media_entries, vdb_client, collection_name="test_media", config=mock_config)
+
+    vectors_config = vdb_client.create_collection.call_args.kwargs["vectors_config"]
+    assert set(vectors_config) == {"", "tags", "summary_chunks"}
+    assert vectors_config["summary_chunks"].multivector_config is not None
+
+    # Main texts first, then the tags of the first media, then the summary chunks of the second one
+    assert mock_get_embeddings.call_args.kwargs["texts"] == [
+        "heroes, action, school", "sad story. letters., ", "action, school", "sad story.", "letters."
+    ]
+    uploaded_points = vdb_client.upsert.call_args.kwargs["points"]
+    assert uploaded_points[0].vector[""] == [0.0] * 3
+    assert uploaded_points[0].vector["tags"] == [2.0] * 3
+    assert "summary_chunks" not in uploaded_points[0].vector
+    assert "tags" not in uploaded_points[1].vector
+    assert uploaded_points[1].vector["summary_chunks"] == [[3.0] * 3, [4.0] * 3]
 
 
 @patch("app.vector_db.initialize_vdb.get_embeddings")
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+
+from app.vector_db.media_reader import build_media_records_query
+
+
+def compile_query(query) -> str:
+    return str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_media_records_query_aggregates_tags_and_selects_only_indexed_columns():
+    sql = compile_query(build_media_records_query())
+
+    assert "array_remove(array_agg(content_descriptors.content_descriptor ORDER BY" in sql
+    assert "LEFT OUTER JOIN media_content_descriptors" in sql
+    assert "GROUP BY media.media_id" in sql
+    assert "media.created_at" not in sql and "media.end_date" not in sql
+    assert "WHERE" not in sql
+
+
+def test_media_records_query_filters_on_updated_at():
+    sql = compile_query(build_media_records_query(updated_since=datetime(2024, 1, 1)))
+
+    assert "WHERE media.updated_at >= '2024-01-01 00:00:00'" in sql
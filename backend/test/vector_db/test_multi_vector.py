@@ -0,0 +1,64 @@
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import ScoredPoint
+from qdrant_client.models import SparseVectorParams, Modifier, PointStruct
+
+from app.recommender.reranker import get_point_vector
+from app.vector_db import vector_database
+from app.vector_db.initialize_vdb import build_media_vectors_config
+from app.vector_db.vector_database import get_top_k_multi_vector_from_media, get_top_k_from_media, \
+    fuse_multi_vector_results, DEFAULT_MEDIA_COLLECTION_NAME, SPARSE_VECTOR_NAME
+from common.config.recommender.recommender_config import RecommenderConfiguration, MultiVectorConfiguration
+
+
+@pytest.fixture
+def local_multi_vector_collection(monkeypatch):
+    client = QdrantClient(":memory:")
+    cfg = RecommenderConfiguration(
+        embedder="embedder_model", dimensions=2, prompt_id="123abc", top_k=10, n_selected=5,
+        multi_vector=MultiVectorConfiguration(enabled=True),
+    )
+    client.create_collection(
+        collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+        vectors_config=build_media_vectors_config(cfg),
+        sparse_vectors_config={SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)},
+    )
+    client.upsert(
+        collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+        points=[
+            PointStruct(id=1, vector={"": [1.0, 0.0], "tags": [1.0, 0.1]}),
+            # The main vector of media 2 is far from the query, but one of its summary chunks is close
+            PointStruct(id=2, vector={"": [0.0, 1.0], "summary_chunks": [[0.1, 1.0], [1.0, 0.05]]}),
+            PointStruct(id=3, vector={"": [0.2, 1.0]}),
+        ],
+    )
+    monkeypatch.setattr(vector_database, "vector_database_client", client)
+    return client
+
+
+def test_multi_vector_search_keeps_the_best_similarity_of_each_media(local_multi_vector_collection):
+    query_vector = [1.0, 0.0]
+
+    dense_only = get_top_k_from_media(vector=query_vector, k=2)
+    multi_vector = get_top_k_multi_vector_from_media(vector=query_vector, k=2, with_vectors=True)
+
+    assert [point.id for point in dense_only] == [1, 3]
+    assert [point.id for point in multi_vector] == [1, 2]
+    assert multi_vector[1].score == pytest.approx(0.9988, abs=1e-3)
+    assert get_point_vector(multi_vector[1]) == pytest.approx([0.0, 1.0])  # the main vector is returned for reranking
+
+
+def test_multi_vector_search_with_offset(local_multi_vector_collection):
+    query_vector = [1.0, 0.0]
+    next_page = get_top_k_multi_vector_from_media(vector=query_vector, k=2, offset=1)
+    assert [point.id for point in next_page] == [2, 3]
+
+
+def test_fuse_multi_vector_results():
+    main = [ScoredPoint(id=1, version=0, score=0.5), ScoredPoint(id=2, version=0, score=0.4)]
+    tags = [ScoredPoint(id=2, version=0, score=0.9)]
+    chunks = [ScoredPoint(id=3, version=0, score=0.3)]
+
+    fused = fuse_multi_vector_results([main, tags, chunks], k=2)
+
+    assert [(point.id, point.score) for point in fused] == [(2, 0.9), (1, 0.5)]
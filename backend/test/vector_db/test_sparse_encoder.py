@@ -0,0 +1,66 @@
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.models import VectorParams, Distance, SparseVectorParams, Modifier, PointStruct
+
+from app.vector_db import vector_database
+from app.vector_db.sparse_encoder import tokenize, encode_document, encode_query, term_index, average_document_length
+from app.vector_db.vector_database import get_top_k_from_media, DEFAULT_MEDIA_COLLECTION_NAME, SPARSE_VECTOR_NAME
+
+
+def test_tokenize_removes_stopwords_and_punctuation():
+    assert tokenize("The Girl Who Leapt Through Time!") == ["girl", "leapt", "time"]
+
+
+def test_encode_query_weighs_distinct_terms_equally():
+    vector = encode_query("mecha mecha space")
+    assert sorted(vector.indices) == sorted([term_index("mecha"), term_index("space")])
+    assert vector.values == [1.0, 1.0]
+
+
+def test_encode_document_saturates_repeated_terms_and_penalizes_long_documents():
+    short = encode_document("mecha mecha space", avg_doc_length=3)
+    weights = dict(zip(short.indices, short.values))
+    assert weights[term_index("mecha")] > weights[term_index("space")]
+    assert weights[term_index("mecha")] < 2 * weights[term_index("space")]
+
+    long = encode_document("mecha " + "filler " * 20, avg_doc_length=3)
+    assert dict(zip(long.indices, long.values))[term_index("mecha")] < weights[term_index("space")]
+
+
+def test_average_document_length():
+    assert average_document_length(["one two", "three four five six"]) == 3
+    assert average_document_length([]) == 1.0
+
+
+@pytest.fixture
+def local_media_collection(monkeypatch):
+    client = QdrantClient(":memory:")
+    client.create_collection(
+        collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+        vectors_config=VectorParams(size=2, distance=Distance.COSINE),
+        sparse_vectors_config={SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)},
+    )
+    texts = {1: "space opera battles", 2: "space pirates adventure", 3: "cowboy bebop bounty hunters"}
+    dense = {1: [1.0, 0.0], 2: [0.9, 0.1], 3: [0.0, 1.0]}
+    client.upsert(
+        collection_name=DEFAULT_MEDIA_COLLECTION_NAME,
+        points=[
+            PointStruct(
+                id=media_id,
+                vector={"": dense[media_id], SPARSE_VECTOR_NAME: encode_document(text, avg_doc_length=3)},
+            )
+            for media_id, text in texts.items()
+        ],
+    )
+    monkeypatch.setattr(vector_database, "vector_database_client", client)
+    return client
+
+
+def test_hybrid_search_finds_exact_lexical_matches(local_media_collection):
+    query_vector = [1.0, 0.05]  # semantically close to the space media
+
+    dense_only = get_top_k_from_media(vector=query_vector, k=2)
+    hybrid = get_top_k_from_media(vector=query_vector, k=2, sparse_vector=encode_query("cowboy bebop"))
+
+    assert [point.id for point in dense_only] == [1, 2]
+    assert 3 in [point.id for point in hybrid]
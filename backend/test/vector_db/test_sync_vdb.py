@@ -0,0 +1,89 @@
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Optional
+
+import pytest
+from qdrant_client import QdrantClient
+
+from app.services.catalog_service import mark_media_updated, get_media_update_times
+from app.vector_db import initialize_vdb
+from app.vector_db.initialize_vdb import initialize_media, hash_media_text
+from app.vector_db.sync_state import load_sync_state
+from app.vector_db.sync_vdb import sync_media
+from common.config.recommender.recommender_config import RecommenderConfiguration
+
+
+@dataclass
+class FakeMedia:
+    media_id: int
+    title: str
+    summary: str
+    updated_at: datetime
+    score: Optional[float] = None
+    type: str = "TV"
+    start_date: Optional[str] = None
+    status: str = "FINISHED"
+    external_url: Optional[str] = None
+    image_url: Optional[str] = None
+    tags: list = field(default_factory=list)
+
+
+@pytest.fixture
+def config():
+    return RecommenderConfiguration(embedder="hashing", dimensions=16, prompt_id="123abc", top_k=10, n_selected=5)
+
+
+@pytest.fixture
+def embedded_texts(monkeypatch):
+    embedded_texts = []
+    get_embeddings = initialize_vdb.get_embeddings
+
+    def recording_get_embeddings(texts, model, dimensions):
+        embedded_texts.extend(texts)
+        return get_embeddings(texts=texts, model=model, dimensions=dimensions)
+
+    monkeypatch.setattr("app.vector_db.initialize_vdb.get_embeddings", recording_get_embeddings)
+    return embedded_texts
+
+
+def test_sync_only_reembeds_changed_texts(config, embedded_texts):
+    client = QdrantClient(":memory:")
+    media = [
+        FakeMedia(1, "Planetes", "Space debris collectors.", datetime(2024, 1, 1), tags=["space"]),
+        FakeMedia(2, "Mushishi", "A wandering healer.", datetime(2024, 1, 2), score=8.0),
+        FakeMedia(3, "Removed", "Gone from the catalog.", datetime(2024, 1, 3)),
+    ]
+    initialize_media(media, client, collection_name="media", config=config)
+    assert load_sync_state("media").watermark == datetime(2024, 1, 3)
+    embedded_texts.clear()
+    mark_media_updated([1, 2])  # by the ingestion, their payloads are stale until synced
+
+    changed_media = [
+        replace(media[0], summary="Space debris collectors in orbit.", updated_at=datetime(2024, 2, 1)),
+        replace(media[1], score=9.0, title="Mushi-shi", updated_at=datetime(2024, 2, 2)),
+    ]
+    report = sync_media(changed_media, {1, 2}, client, collection_name="media", batch_size=1, config=config,
+                        state=load_sync_state("media"))
+
+    assert (report.n_embedded, report.n_updated, report.n_deleted) == (1, 1, 1)
+    assert embedded_texts == ["space debris collectors in orbit., space"]
+
+    points = {point.id: point for point in client.retrieve("media", ids=[1, 2, 3], with_payload=True)}
+    assert set(points) == {1, 2}
+    assert points[1].payload["text_hash"] == hash_media_text("space debris collectors in orbit., space")
+    assert points[2].payload["score"] == 9.0
+    assert points[2].payload["title"] == "Mushi-shi"
+    assert load_sync_state("media").watermark == datetime(2024, 2, 2)
+    assert get_media_update_times() == {}
+
+
+def test_sync_without_changes_keeps_the_watermark(config, embedded_texts):
+    client = QdrantClient(":memory:")
+    media = [FakeMedia(1, "Planetes", "Space debris collectors.", datetime(2024, 1, 1))]
+    initialize_media(media, client, collection_name="media", config=config)
+
+    report = sync_media([], {1}, client, collection_name="media", config=config, state=load_sync_state("media"))
+
+    assert not report.changed
+    assert client.count("media").count == 1
+    assert load_sync_state("media").watermark == datetime(2024, 1, 1)